@@ -0,0 +1,59 @@
+from collections import deque
+from typing import Dict, List, Optional, Sequence
+
+
+class AhoCorasick:
+    """
+    Multi-pattern substring matcher: finds which of many patterns occur in a text in one pass.
+
+    Patterns are identified by their index, and first_match() returns the lowest index that
+    occurs, which lets callers keep "first entry wins" semantics of a linear scan.
+    Matching is exact, normalize (e.g. lowercase) patterns and text beforehand.
+    """
+
+    def __init__(self, patterns: Sequence[str]):
+        self._no_match = len(patterns)
+        self._goto: List[Dict[str, int]] = [{}]
+        # Lowest pattern index ending at each node, including via its fail links
+        self._best: List[int] = [self._no_match]
+
+        for index, pattern in enumerate(patterns):
+            node = 0
+            for char in pattern:
+                child = self._goto[node].get(char)
+                if child is None:
+                    child = len(self._goto)
+                    self._goto.append({})
+                    self._best.append(self._no_match)
+                    self._goto[node][char] = child
+                node = child
+            self._best[node] = min(self._best[node], index)
+
+        # Breadth-first, so a node's fail target (always shallower) is done before the node
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            self._best[node] = min(self._best[node], self._best[self._fail[node]])
+            for char, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                queue.append(child)
+
+    def first_match(self, text: str) -> Optional[int]:
+        """Returns the lowest index of the patterns occurring in *text*, or None."""
+        goto, fail, best_at = self._goto, self._fail, self._best
+        node = 0
+        best = best_at[0]  # empty patterns match anything
+        for char in text:
+            if best == 0:
+                break
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if best_at[node] < best:
+                best = best_at[node]
+        return best if best != self._no_match else None
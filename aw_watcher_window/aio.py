@@ -0,0 +1,415 @@
+"""
+An asyncio API for the watcher, to run it inside an application that has an event loop,
+and the core that main() runs on.
+
+Window samples come from async generators over a WindowSource, the backend:
+
+- poll_samples() polls it every *poll_time* seconds, like heartbeat_loop.
+- event_samples() samples it whenever its wait_async() reports a change, like
+  event_loop. XlibSource waits on the X connection through ``loop.add_reader``, other
+  sources wait on a thread.
+
+Calls into the backend block, so they run on an executor, by default a thread of the
+generator's own that is used for nothing else (X connections and COM don't like
+switching threads). A stalled X server then holds up that thread, not the event loop.
+
+AsyncSender transforms samples and sends them as heartbeats, and watch() joins the two::
+
+    client = ActivityWatchClient("aw-watcher-window")
+    bucket_id = f"{client.client_name}_{client.client_hostname}"
+    client.create_bucket(bucket_id, "currentwindow", queued=True)
+    fetch_window = partial(fetch_current_window, get_window_source())
+    with client:
+        await watch(poll_samples(fetch_window, poll_time=1.0), AsyncSender(client, bucket_id))
+
+poll_loop() and event_loop() put them together like heartbeat_loop and event_loop do,
+with the same options, and are what main() runs.
+"""
+
+import asyncio
+import logging
+import os
+import signal
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import partial
+from typing import AsyncIterator, Awaitable, Callable, Iterator, Optional, TypeVar
+
+from .exceptions import FatalError
+from .pipeline import assemble, compute_pulsetime, send_sample, transform_window
+from .sampler import COALESCE, Sample, SampleQueue
+from .schedule import AdaptivePollInterval, Scheduler
+from .window import WindowInfo
+
+logger = logging.getLogger(__name__)
+
+_now = partial(datetime.now, timezone.utc)
+
+T = TypeVar("T")
+
+
+def _orphaned() -> bool:
+    if os.getppid() == 1:
+        logger.info("window-watcher stopped because parent process died")
+        return True
+    return False
+
+
+@contextmanager
+def _executor(executor: Optional[Executor], name: str) -> Iterator[Executor]:
+    """*executor*, or a thread of its own for the block if None."""
+    if executor is not None:
+        yield executor
+        return
+    own = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"aw-watcher-window-{name}")
+    try:
+        yield own
+    finally:
+        # A call still running (e.g. a hung X request) finishes on its own
+        own.shutdown(wait=False)
+
+
+async def poll_samples(
+    fetch_window: Callable[[], Optional[WindowInfo]],
+    poll_time: float,
+    max_poll_time: Optional[float] = None,
+    executor: Optional[Executor] = None,
+    scheduler: Optional[Scheduler] = None,
+    now: Callable[[], datetime] = _now,
+) -> AsyncIterator[Sample]:
+    """
+    Samples the window every *poll_time* seconds, backing off towards *max_poll_time*
+    while it stays the same, like heartbeat_loop. Ends when *fetch_window* (called like
+    fetch_current_window) raises FatalError.
+
+    Polls are run on deadlines by *scheduler*, by default one on the event loop's clock.
+    """
+    loop = asyncio.get_running_loop()
+    poll_interval = AdaptivePollInterval(poll_time, max(poll_time, max_poll_time or 0))
+    if scheduler is None:
+        scheduler = Scheduler(clock=loop.time)
+
+    # The interval we actually waited before the current poll, which is what the
+    # pulsetime has to cover.
+    interval = poll_interval.min_interval
+    last_window = None
+    with _executor(executor, "poll") as pool:
+        while not _orphaned():
+            try:
+                window = await loop.run_in_executor(pool, fetch_window)
+            except FatalError:
+                return
+
+            changed = False
+            if window is None:
+                logger.debug("Unable to fetch window, trying again on next poll")
+            else:
+                changed = window != last_window
+                last_window = window
+                pulsetime = scheduler.pulsetime(interval, compute_pulsetime(interval))
+                yield Sample(window, now(), pulsetime)
+
+            interval = poll_interval.next(changed)
+            await asyncio.sleep(scheduler.advance(interval))
+            scheduler.woke()
+
+
+async def event_samples(
+    source,
+    fetch_window: Callable[[], Optional[WindowInfo]],
+    keepalive_time: float,
+    executor: Optional[Executor] = None,
+    now: Callable[[], datetime] = _now,
+) -> AsyncIterator[Sample]:
+    """
+    Samples the window whenever *source* (a WindowSource) sees it change, and every
+    *keepalive_time* seconds otherwise, like event_loop. Ends when *fetch_window* (the
+    window of *source*, like fetch_current_window) or the source raises FatalError.
+
+    When cancelled (e.g. on SIGTERM), the last window is sampled once more before the
+    cancellation goes on, since it lasted until then.
+    """
+    loop = asyncio.get_running_loop()
+    pulsetime = compute_pulsetime(keepalive_time)
+    last_window = None
+    with _executor(executor, "events") as pool:
+        try:
+            while not _orphaned():
+                try:
+                    window = await loop.run_in_executor(pool, fetch_window)
+                except FatalError:
+                    return
+
+                if window is None:
+                    logger.debug("Unable to fetch window, trying again on next change")
+                else:
+                    timestamp = now()
+                    if last_window is not None and last_window != window:
+                        # Samples are sparse in this mode, so extend the previous window
+                        # up to the switch before starting the new one.
+                        yield Sample(last_window, timestamp, pulsetime)
+                    last_window = window
+                    yield Sample(window, timestamp, pulsetime)
+
+                try:
+                    await source.wait_async(keepalive_time, pool)
+                except FatalError:
+                    return
+        except asyncio.CancelledError:
+            if last_window is not None:
+                yield Sample(last_window, now(), pulsetime)
+            raise
+
+
+class AsyncSender:
+    """
+    Transforms samples (with *transform*, by default transform_window behind a
+    TransformCache) and sends them as heartbeats to *bucket_id*, through a
+    HeartbeatCoalescer with *coalesce_time*.
+
+    Heartbeats are handed to the client on the event loop, which is right for
+    ActivityWatchClient's queued heartbeats: they only append to its queue. A client that
+    does I/O (e.g. a Spool or an EventMerger) should be given an *executor* to send on.
+    """
+
+    def __init__(
+        self,
+        client,
+        bucket_id: str,
+        coalesce_time: float = 0.0,
+        executor: Optional[Executor] = None,
+        transform: Optional[Callable] = None,
+        **transform_config,
+    ):
+        from .heartbeat import HeartbeatCoalescer
+        from .transform_cache import TransformCache
+
+        self.coalescer = HeartbeatCoalescer(client, bucket_id, coalesce_time)
+        self.transform = TransformCache(transform_window) if transform is None else transform
+        self.executor = executor
+        self._send = partial(send_sample, self.coalescer, self.transform, **transform_config)
+        self._pulsetime: Optional[float] = None
+
+    async def _call(self, func: Callable[..., T], *args) -> T:
+        if self.executor is None:
+            return func(*args)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def send(self, sample: Sample) -> None:
+        self._pulsetime = sample.pulsetime
+        await self._call(self._send, sample)
+
+    async def aclose(self) -> None:
+        """Sends what the coalescer held back."""
+        if self._pulsetime is not None:
+            await self._call(self.coalescer.flush, self._pulsetime)
+        logger.info(f"Heartbeat coalescing: {self.coalescer.stats()}")
+
+
+async def watch(
+    samples: AsyncIterator[Sample], sender: AsyncSender, queue: Optional[SampleQueue] = None
+) -> None:
+    """
+    Sends every sample from *samples* with *sender*, until they end or the task is
+    cancelled, and then what *sender* held back.
+
+    With *queue* (a SampleQueue), the samples are taken by a task of their own and queued,
+    so that a slow send doesn't hold up sampling (see sampler). The samples queued when
+    sampling ends are still sent.
+    """
+    try:
+        if queue is None:
+            async for sample in samples:
+                await sender.send(sample)
+        else:
+            await _watch_queued(samples, sender, queue)
+    finally:
+        aclose = getattr(samples, "aclose", None)
+        if aclose is not None:
+            await aclose()
+        await sender.aclose()
+
+
+async def _watch_queued(samples: AsyncIterator[Sample], sender: AsyncSender, queue: SampleQueue) -> None:
+    queued = asyncio.Event()
+
+    async def take() -> None:
+        try:
+            async for sample in samples:
+                queue.put(sample)
+                queued.set()
+        finally:
+            queued.set()
+
+    taker = asyncio.ensure_future(take())
+    try:
+        while True:
+            sample = queue.get(timeout=0.0)
+            if sample is not None:
+                await sender.send(sample)
+            elif taker.done():
+                break
+            else:
+                await queued.wait()
+                queued.clear()
+        # Raises what ended sampling, if anything did
+        await taker
+    finally:
+        if not taker.done():
+            taker.cancel()
+            try:
+                await taker
+            except asyncio.CancelledError:
+                pass
+        sample = queue.get(timeout=0.0)
+        while sample is not None:
+            await sender.send(sample)
+            sample = queue.get(timeout=0.0)
+
+
+async def run_swift(command) -> int:
+    """
+    Runs the macOS swift watcher (see build_swift_command), which sends heartbeats itself,
+    until it exits or the task is cancelled, which terminates it. Returns its exit code.
+    """
+    process = await asyncio.create_subprocess_exec(*command)
+    try:
+        return await process.wait()
+    except asyncio.CancelledError:
+        process.terminate()
+        await process.wait()
+        raise
+
+
+async def until_sigterm(coro: Awaitable[T]) -> Optional[T]:
+    """
+    Runs *coro* until it's done or the process gets SIGTERM, which cancels it so that it
+    sends what it holds back on the way out (aw-qt stops watchers with SIGTERM). Returns
+    what *coro* returned, None if it was stopped.
+    """
+    loop = asyncio.get_running_loop()
+    task = asyncio.ensure_future(coro)
+    stopped = False
+
+    def stop() -> None:
+        nonlocal stopped
+        logger.info("Got SIGTERM, stopping")
+        stopped = True
+        task.cancel()
+
+    previous = signal.getsignal(signal.SIGTERM)
+    try:
+        loop.add_signal_handler(signal.SIGTERM, stop)
+    except (NotImplementedError, RuntimeError, ValueError):
+        # No signal handlers on Windows event loops, nor outside the main thread
+        return await task
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if not stopped:
+            raise
+        return None
+    finally:
+        loop.remove_signal_handler(signal.SIGTERM)
+        signal.signal(signal.SIGTERM, previous)
+
+
+async def poll_loop(
+    client,
+    bucket_id: str,
+    source,
+    poll_time: float,
+    coalesce_time: float = 0.0,
+    max_poll_time: Optional[float] = None,
+    recorder=None,
+    queue_size: int = 0,
+    queue_overflow: str = COALESCE,
+    metrics=None,
+    inventory=None,
+    **transform_config,
+) -> None:
+    """
+    heartbeat_loop on the event loop: polls the window of *source* (a WindowSource) and
+    sends it as heartbeats to *bucket_id*, with the same options. Sampling and sending
+    each run on a thread of their own (see AsyncSender), and with *queue_size* > 0 they
+    are joined by a SampleQueue. Runs until the source fails fatally or it's cancelled.
+    """
+    from .transform_cache import TransformCache
+
+    loop = asyncio.get_running_loop()
+    transform = TransformCache(transform_window)
+    client, apply_transform, fetch_window = assemble(
+        client,
+        source,
+        transform,
+        recorder,
+        metrics,
+        inventory,
+        transform_config.get("research_category_map"),
+    )
+    scheduler = Scheduler(clock=loop.time)
+    queue = SampleQueue(queue_size, queue_overflow) if queue_size else None
+    with _executor(None, "send") as send_pool:
+        sender = AsyncSender(
+            client, bucket_id, coalesce_time, send_pool, apply_transform, **transform_config
+        )
+        if metrics is not None:
+            metrics.collect("heartbeat_coalescer", sender.coalescer.stats)
+            if queue is not None:
+                metrics.collect("sample_queue", queue.stats)
+            if inventory is not None:
+                metrics.collect("inventory", inventory.stats)
+        try:
+            samples = poll_samples(fetch_window, poll_time, max_poll_time, scheduler=scheduler)
+            await watch(samples, sender, queue)
+        finally:
+            logger.info(
+                f"Poll lateness: {scheduler.lateness.stats()}, skipped ticks: {scheduler.skipped}"
+            )
+            _log_stats(transform, queue, inventory)
+
+
+async def event_loop(
+    client,
+    bucket_id: str,
+    source,
+    keepalive_time: float,
+    recorder=None,
+    metrics=None,
+    inventory=None,
+    **transform_config,
+) -> None:
+    """
+    event_loop on the event loop: samples the window of *source* (a WindowSource) when
+    it changes, and every *keepalive_time* seconds, and sends it as heartbeats to
+    *bucket_id*, with the same options. Runs until the source fails fatally or it's
+    cancelled, when the last window is extended until then (see event_samples).
+    """
+    from .transform_cache import TransformCache
+
+    transform = TransformCache(transform_window)
+    client, apply_transform, fetch_window = assemble(
+        client,
+        source,
+        transform,
+        recorder,
+        metrics,
+        inventory,
+        transform_config.get("research_category_map"),
+    )
+    with _executor(None, "send") as send_pool:
+        # Heartbeats are sparse already, there's nothing to coalesce
+        sender = AsyncSender(client, bucket_id, 0.0, send_pool, apply_transform, **transform_config)
+        try:
+            await watch(event_samples(source, fetch_window, keepalive_time), sender)
+        finally:
+            _log_stats(transform, None, inventory)
+
+
+def _log_stats(transform, queue: Optional[SampleQueue], inventory) -> None:
+    logger.info(f"Transform cache: {transform.stats()}")
+    if queue is not None:
+        logger.info(f"Sample queue: {queue.stats()}")
+    if inventory is not None:
+        logger.info(f"Window inventory: {inventory.stats()}")
@@ -0,0 +1,88 @@
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+_missing = object()
+
+
+class LRUCache:
+    """A bounded mapping that evicts the least recently used entry when full.
+
+    Keeps hit/miss counters so callers can check that the cache actually saves work.
+
+    With *maxweight*, entries are also evicted while the sum of ``weigh(key, value)``
+    over all entries exceeds it, e.g. to bound memory when entry sizes vary a lot.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 128,
+        maxweight: Optional[int] = None,
+        weigh: Optional[Callable[[Hashable, Any], int]] = None,
+    ):
+        if maxsize <= 0:
+            raise ValueError("maxsize must be positive")
+        if (maxweight is None) != (weigh is None):
+            raise ValueError("maxweight and weigh must be given together")
+        self.maxsize = maxsize
+        self.maxweight = maxweight
+        self.weigh = weigh
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._weights: Dict[Hashable, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self._data.get(key, _missing)
+        if value is _missing:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.weigh is not None:
+            self._forget_weight(key)
+            weight = self.weigh(key, value)
+            self._weights[key] = weight
+            self.weight += weight
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize or (
+            self.maxweight is not None and self.weight > self.maxweight and self._data
+        ):
+            evicted, _ = self._data.popitem(last=False)
+            self._forget_weight(evicted)
+
+    def _forget_weight(self, key: Hashable) -> None:
+        self.weight -= self._weights.pop(key, 0)
+
+    def pop(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        self._forget_weight(key)
+        return self._data.pop(key, default)
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._weights.clear()
+        self.weight = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        stats = {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+        }
+        if self.maxweight is not None:
+            stats["weight"] = self.weight
+            stats["maxweight"] = self.maxweight
+        return stats
@@ -45,6 +45,10 @@ def parse_args():
     default_exclude_title = config["exclude_title"]
     default_exclude_titles = config["exclude_titles"]
     default_strategy_macos = config["strategy_macos"]
+    default_max_poll_time = config.get("max_poll_time", default_poll_time)
+    default_strategy_linux = config.get("strategy_linux", "poll")
+    default_keepalive_time = config.get("keepalive_time", 10.0)
+    default_coalesce_time = config.get("coalesce_time", 0.0)
     default_research_enabled = config.get("research_enabled", False)
 
     parser = argparse.ArgumentParser(
@@ -70,6 +74,13 @@ def parse_args():
     parser.add_argument(
         "--poll-time", dest="poll_time", type=float, default=default_poll_time
     )
+    parser.add_argument(
+        "--max-poll-time",
+        dest="max_poll_time",
+        type=float,
+        default=default_max_poll_time,
+        help="Back off from poll-time up to this many seconds while the window is unchanged. Defaults to poll-time (no backoff).",
+    )
     parser.add_argument(
         "--strategy",
         dest="strategy",
@@ -77,6 +88,125 @@ def parse_args():
         choices=["jxa", "applescript", "swift"],
         help="(macOS only) strategy to use for retrieving the active window",
     )
+    parser.add_argument(
+        "--strategy-linux",
+        dest="strategy_linux",
+        default=default_strategy_linux,
+        choices=["poll", "events"],
+        help="(Linux only) poll the X server every poll-time, or wait for X11 property change events",
+    )
+    parser.add_argument(
+        "--displays",
+        dest="displays",
+        nargs="+",
+        default=config.get("displays", []),
+        metavar="DISPLAY",
+        help="(Linux only) Watch these X displays instead of $DISPLAY, each into a bucket of its own, e.g. --displays :10 :11",
+    )
+    parser.add_argument(
+        "--x-deadline",
+        dest="x_deadline",
+        type=float,
+        default=config.get("x_deadline", 5.0),
+        help="(Linux only) Seconds after which a stuck call to the X server is aborted and the connection rebuilt, 0 to wait forever",
+    )
+    parser.add_argument(
+        "--inventory-interval",
+        dest="inventory_interval",
+        type=float,
+        default=config.get("inventory_interval", 0.0),
+        help="(Linux only) Every this many seconds, record which windows are open (class, desktop and pid) into a bucket of its own, as changes since the last time. 0 to not record them",
+    )
+    parser.add_argument(
+        "--keepalive-time",
+        dest="keepalive_time",
+        type=float,
+        default=default_keepalive_time,
+        help="(Linux only) With --strategy-linux events, seconds between samples while the window is unchanged, so the server sees the watcher is still alive",
+    )
+    parser.add_argument(
+        "--coalesce-time",
+        dest="coalesce_time",
+        type=float,
+        default=default_coalesce_time,
+        help="When polling, seconds between heartbeats sent to the server while the window is unchanged, 0 (the default) to send every poll",
+    )
+    parser.add_argument(
+        "--queue-size",
+        dest="queue_size",
+        type=int,
+        default=config.get("queue_size", 0),
+        help="Sample windows on a separate thread, queueing up to this many samples for sending. 0 to sample and send on one thread",
+    )
+    parser.add_argument(
+        "--queue-overflow",
+        dest="queue_overflow",
+        default=config.get("queue_overflow", "coalesce"),
+        choices=["coalesce", "drop-oldest"],
+        help="What to do when the sample queue is full: merge unchanged samples into the newest queued one, or drop the oldest",
+    )
+    parser.add_argument(
+        "--merge-interval",
+        dest="merge_interval",
+        type=float,
+        default=config.get("merge_interval", 0.0),
+        help="Merge heartbeats into events locally and send them in bulk every this many seconds, 0 to let the server merge heartbeats",
+    )
+    parser.add_argument(
+        "--record",
+        dest="record",
+        default=None,
+        metavar="PATH",
+        help="Append every window sample (before exclusions) to a trace file at PATH, for replaying with aw_watcher_window.replay",
+    )
+    parser.add_argument(
+        "--spool",
+        dest="spool",
+        default=config.get("spool"),
+        metavar="PATH",
+        help="Keep heartbeats in an SQLite database at PATH until the server has them, so none are lost while it is unreachable",
+    )
+    parser.add_argument(
+        "--profile-startup",
+        dest="profile_startup",
+        action="store_true",
+        help="Log how long each step of starting up took, and the slowest imports",
+    )
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        default=config.get("profile"),
+        metavar="DIR",
+        help="Sample the watcher's stacks and write them to DIR as collapsed stacks for flamegraphs, every --profile-rotate seconds and on SIGUSR1",
+    )
+    parser.add_argument(
+        "--profile-rate",
+        dest="profile_rate",
+        type=float,
+        default=config.get("profile_rate", 5.0),
+        help="Stack samples per second taken with --profile",
+    )
+    parser.add_argument(
+        "--profile-rotate",
+        dest="profile_rotate",
+        type=float,
+        default=config.get("profile_rotate", 3600.0),
+        help="Seconds between the files written with --profile, of which the newest 24 are kept",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        dest="metrics_port",
+        type=int,
+        default=config.get("metrics_port"),
+        help="Serve per-stage timings and counters in the Prometheus text format on this port of localhost",
+    )
+    parser.add_argument(
+        "--metrics-socket",
+        dest="metrics_socket",
+        default=config.get("metrics_socket"),
+        metavar="PATH",
+        help="Like --metrics-port, but on a Unix socket at PATH",
+    )
     research_group = parser.add_mutually_exclusive_group()
     research_group.add_argument(
         "--research",
@@ -92,6 +222,16 @@ def parse_args():
         help="Disable Research Edition mode, even when enabled in the config file.",
     )
     parsed_args = parser.parse_args()
+    if parsed_args.displays:
+        # These follow $DISPLAY only, the loops of the seats (see seats) have none of them
+        for option, dest in [
+            ("--record", "record"),
+            ("--inventory-interval", "inventory_interval"),
+            ("--metrics-port", "metrics_port"),
+            ("--metrics-socket", "metrics_socket"),
+        ]:
+            if getattr(parsed_args, dest):
+                parser.error(f"{option} is not supported with --displays")
     parsed_args.research_category_map = dict(config.get("research_category_map", {}))
     parsed_args.research_app_category_map = dict(config.get("research_app_category_map", {}))
     return parsed_args
@@ -0,0 +1,168 @@
+import logging
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+import requests
+from aw_core.models import Event
+
+logger = logging.getLogger(__name__)
+
+
+class HeartbeatCoalescer:
+    """
+    Drops heartbeats that the server would merge anyway, before they reach aw-client's queue.
+
+    An unchanged window is only forwarded every *keepalive_time* seconds. The last dropped
+    heartbeat is kept back and sent whenever the server needs it to come to the same
+    conclusion as it would have with every heartbeat: before the window changes, before a
+    gap that breaks the heartbeat chain, and on flush(). The resulting timeline is the same.
+
+    Keep-alives are sent with a pulsetime that covers the keep-alive interval; every other
+    heartbeat keeps the pulsetime it was given, so chain breaks still happen where they would.
+    """
+
+    def __init__(self, client, bucket_id: str, keepalive_time: float):
+        self.client = client
+        self.bucket_id = bucket_id
+        self.keepalive_time = keepalive_time
+
+        self.last_sent: Optional[Event] = None
+        self.last_seen: Optional[Event] = None
+        self.pending: Optional[Event] = None
+
+        self.sent = 0
+        self.suppressed = 0
+
+    def _send(self, event: Event, pulsetime: float) -> None:
+        self.client.heartbeat(self.bucket_id, event, pulsetime=pulsetime, queued=True)
+        self.last_sent = event
+        self.sent += 1
+
+    def _keepalive_pulsetime(self, pulsetime: float) -> float:
+        return self.keepalive_time + pulsetime
+
+    def heartbeat(self, event: Event, pulsetime: float) -> None:
+        last_seen, self.last_seen = self.last_seen, event
+
+        if (
+            self.keepalive_time <= 0
+            or self.last_sent is None
+            or last_seen is None
+            or event.data != last_seen.data
+            or (event.timestamp - last_seen.timestamp).total_seconds() >= pulsetime
+        ):
+            # The server has to see the end of the previous chain exactly as before
+            self.flush(pulsetime)
+            self._send(event, pulsetime)
+        elif (event.timestamp - self.last_sent.timestamp).total_seconds() >= self.keepalive_time:
+            if self.pending is not None:
+                self.suppressed += 1
+                self.pending = None
+            self._send(event, self._keepalive_pulsetime(pulsetime))
+        else:
+            if self.pending is not None:
+                self.suppressed += 1
+            self.pending = event
+
+    def flush(self, pulsetime: float) -> None:
+        """Sends the heartbeat held back last, if any. Call this on shutdown."""
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            self._send(pending, self._keepalive_pulsetime(pulsetime))
+
+    def stats(self) -> dict:
+        total = self.sent + self.suppressed + (1 if self.pending is not None else 0)
+        return {
+            "sent": self.sent,
+            "suppressed": self.suppressed,
+            "suppressed_ratio": self.suppressed / total if total else 0.0,
+        }
+
+
+class _Span:
+    def __init__(self, event: Event, pulsetime: float):
+        self.event = Event(timestamp=event.timestamp, duration=event.duration, data=event.data)
+        # The pulsetime of the heartbeat that started it, which decides whether the
+        # server merges it into the previous event
+        self.pulsetime = pulsetime
+        # Whether (a part of) it was already sent as a heartbeat
+        self.on_server = False
+
+    def merge(self, event: Event, pulsetime: float) -> bool:
+        """Extends the span with *event*, as aw-server would merge a heartbeat, if it can."""
+        last = self.event
+        if last.data != event.data:
+            return False
+        if not last.timestamp <= event.timestamp <= last.timestamp + last.duration + timedelta(seconds=pulsetime):
+            return False
+        last.duration = max(last.duration, event.timestamp + event.duration - last.timestamp)
+        return True
+
+
+class EventMerger:
+    """
+    Merges heartbeats into events client-side, and sends finished events in bulk.
+
+    Stands in for the client where heartbeats are sent (e.g. HeartbeatCoalescer). Spans
+    are extended with the rules aw-server uses for heartbeats, so the same events come
+    out, but the server only gets a request every *flush_interval* seconds (of event
+    time): the events finished since the last flush in one ``insert_events`` call, and the
+    span still growing as a heartbeat, so a crash loses at most one flush interval.
+
+    Requests are sent directly (not through aw-client's queue, which would reorder them
+    relative to the inserts). When they fail, the spans are kept and sent on the next flush.
+    """
+
+    def __init__(self, client, flush_interval: float):
+        self.client = client
+        self.flush_interval = timedelta(seconds=flush_interval)
+        self.requests = 0
+        self.inserted = 0
+        self._spans: Dict[str, List[_Span]] = {}
+        self._last_flush: Dict[str, Event] = {}
+
+    def create_bucket(self, bucket_id: str, event_type: str, queued: bool = False) -> None:
+        self.client.create_bucket(bucket_id, event_type, queued=queued)
+
+    def heartbeat(self, bucket_id: str, event: Event, pulsetime: float, queued: bool = False) -> None:
+        spans = self._spans.setdefault(bucket_id, [])
+        if not spans or not spans[-1].merge(event, pulsetime):
+            spans.append(_Span(event, pulsetime))
+
+        last_flush = self._last_flush.get(bucket_id)
+        if last_flush is None or event.timestamp - last_flush.timestamp >= self.flush_interval:
+            self._last_flush[bucket_id] = event
+            self._flush_bucket(bucket_id)
+
+    def _flush_bucket(self, bucket_id: str) -> bool:
+        spans = self._spans.get(bucket_id)
+        if not spans:
+            return True
+        try:
+            *finished, current = spans
+            if finished and finished[0].on_server:
+                # Was the growing span at the last flush, the server has to merge the rest of it
+                self._send_heartbeat(bucket_id, finished.pop(0))
+                spans.pop(0)
+            if finished:
+                self.client.insert_events(bucket_id, [span.event for span in finished])
+                self.requests += 1
+                self.inserted += len(finished)
+                del spans[: len(finished)]
+            self._send_heartbeat(bucket_id, current)
+            current.on_server = True
+        except (requests.RequestException, OSError) as e:
+            logger.warning(f"Failed to send merged events, retrying on next flush: {e}")
+            return False
+        return True
+
+    def _send_heartbeat(self, bucket_id: str, span: _Span) -> None:
+        self.client.heartbeat(bucket_id, span.event, pulsetime=span.pulsetime, queued=False)
+        self.requests += 1
+
+    def flush(self) -> bool:
+        """Sends everything not yet sent. Call this periodically and on shutdown."""
+        return all([self._flush_bucket(bucket_id) for bucket_id in self._spans])
+
+    def stats(self) -> dict:
+        return {"requests": self.requests, "inserted": self.inserted}
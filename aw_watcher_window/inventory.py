@@ -0,0 +1,316 @@
+"""
+Snapshots of every client window (_NET_CLIENT_LIST), not just the focused one, recorded
+to a bucket of their own with ``--inventory-interval``.
+
+The inventory is kept up to date from events rather than by listing all windows each
+time: SubstructureNotify and PropertyChange on the root window tell us when windows
+come and go (CreateNotify, DestroyNotify, _NET_CLIENT_LIST changes), and PropertyChange
+on each client window when its class, desktop or pid changes. Only what changed is
+asked for again, in a single batch of requests (see xlib_batch).
+
+Snapshots are delta-encoded: an event holds the windows added, removed and changed
+since the previous one, and nothing is sent if nothing changed. A full snapshot goes
+out first and every *keyframe_every* snapshots, so that the inventory at any point can
+be rebuilt from the last full snapshot before it and the deltas after (see apply).
+"""
+
+import logging
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from functools import partial
+from time import monotonic
+from typing import Callable, ContextManager, Dict, Iterable, List, NamedTuple, Optional, Set
+
+import Xlib.error
+from Xlib import X, Xatom
+
+from aw_core.models import Event
+
+from .xlib_batch import property_strlist, read_property_or_none, send_get_property
+from .xlib_events import ROOT_EVENT_MASK, WINDOW_EVENT_MASK
+
+logger = logging.getLogger(__name__)
+
+_now = partial(datetime.now, timezone.utc)
+
+DEFAULT_KEYFRAME_EVERY = 60
+
+
+def _cardinal(prop) -> int:
+    # Unlike xprop's _property_int, 0 is a value here: the first desktop
+    if prop is None or not prop[1]:
+        return -1
+    return prop[1][0]
+
+
+class InventoryWindow(NamedTuple):
+    id: int
+    cls: str
+    desktop: int
+    pid: int
+
+    def to_dict(self) -> dict:
+        return {"id": hex(self.id), "class": self.cls, "desktop": self.desktop, "pid": self.pid}
+
+
+class Inventory:
+    """
+    The client windows of *display*, kept up to date from the events that *dispatcher*
+    (an EventDispatcher on the same display) hands it. Call update() to apply them.
+
+    Like ActiveWindowWatcher, it makes its requests inside *watched()*.
+    """
+
+    def __init__(
+        self,
+        display,
+        dispatcher,
+        send=send_get_property,
+        watched: Callable[[], ContextManager] = nullcontext,
+    ):
+        self.display = display
+        self.dispatcher = dispatcher
+        self.root = display.screen().root
+        self.send = send
+        self.watched = watched
+
+        with watched():
+            self.NET_CLIENT_LIST = display.intern_atom("_NET_CLIENT_LIST")
+            self.NET_WM_DESKTOP = display.intern_atom("_NET_WM_DESKTOP")
+            self.NET_WM_PID = display.intern_atom("_NET_WM_PID")
+        self.window_atoms = {Xatom.WM_CLASS, self.NET_WM_DESKTOP, self.NET_WM_PID}
+
+        self.windows: Dict[int, InventoryWindow] = {}
+        # The windows as of the last snapshot, and the ids that may differ since
+        self._snapshot: Dict[int, InventoryWindow] = {}
+        self._touched: Set[int] = set()
+        # What events said needs to be asked for again
+        self._client_list_changed = True
+        self._stale: Set[int] = set()
+        # Number of batches of requests, i.e. round-trips to the X server
+        self.round_trips = 0
+
+        dispatcher.add_listener(self.handle_event)
+        with watched():
+            self.root.change_attributes(event_mask=ROOT_EVENT_MASK)
+            display.flush()
+
+    def handle_event(self, event) -> None:
+        if event.type == X.CreateNotify:
+            # Usually a frame or a window not yet mapped, the client list says which to track
+            self._client_list_changed = True
+        elif event.type == X.DestroyNotify:
+            window_id = event.window.id
+            if window_id in self.windows:
+                self._remove(window_id)
+            else:
+                # A frame of a reparenting window manager, its client may be gone too
+                self._client_list_changed = True
+        elif event.type == X.PropertyNotify:
+            if event.window.id == self.root.id:
+                if event.atom == self.NET_CLIENT_LIST:
+                    self._client_list_changed = True
+            elif event.window.id in self.windows and event.atom in self.window_atoms:
+                self._stale.add(event.window.id)
+
+    def _remove(self, window_id: int) -> None:
+        del self.windows[window_id]
+        self._stale.discard(window_id)
+        self._touched.add(window_id)
+
+    def _read_client_list(self) -> List[int]:
+        self.round_trips += 1
+        req = self.send(self.display, self.root.id, self.NET_CLIENT_LIST, X.AnyPropertyType)
+        prop = read_property_or_none(req)
+        return list(prop[1]) if prop else []
+
+    def _query(self, window_ids: Iterable[int]) -> None:
+        properties = {
+            "class": (Xatom.WM_CLASS, X.AnyPropertyType),
+            "desktop": (self.NET_WM_DESKTOP, X.AnyPropertyType),
+            "pid": (self.NET_WM_PID, X.AnyPropertyType),
+        }
+        requests = {
+            window_id: {
+                key: self.send(self.display, window_id, atom, property_type)
+                for key, (atom, property_type) in properties.items()
+            }
+            for window_id in window_ids
+        }
+        if not requests:
+            return
+        self.round_trips += 1
+        for window_id, reqs in requests.items():
+            props = {key: read_property_or_none(req) for key, req in reqs.items()}
+            classes = property_strlist(props["class"]) if props["class"] else []
+            window = InventoryWindow(
+                window_id,
+                # WM_CLASS is instance and class, like get_window_class we want the latter
+                classes[1] if len(classes) > 1 else (classes[0] if classes else "unknown"),
+                _cardinal(props["desktop"]),
+                _cardinal(props["pid"]),
+            )
+            if self.windows.get(window_id) != window:
+                self.windows[window_id] = window
+                self._touched.add(window_id)
+
+    def _subscribe(self, window_ids: Iterable[int]) -> None:
+        for window_id in window_ids:
+            window = self.display.create_resource_object("window", window_id)
+            # One-way, so it costs no round-trip. An error for a window already gone is ignored.
+            window.change_attributes(event_mask=WINDOW_EVENT_MASK, onerror=Xlib.error.CatchError())
+
+    def update(self) -> None:
+        """
+        Applies the events that arrived since the last update, asking the X server for
+        what they said changed: the client list and the properties of new and changed
+        windows, in at most two round-trips.
+
+        :raises StalledCallError: if the watchdog aborted a request (see *watched*)
+        """
+        with self.watched():
+            self.dispatcher.drain()
+            added: List[int] = []
+            if self._client_list_changed:
+                self._client_list_changed = False
+                client_list = self._read_client_list()
+                current = set(client_list)
+                for window_id in [w for w in self.windows if w not in current]:
+                    self._remove(window_id)
+                added = [w for w in client_list if w not in self.windows]
+                self._subscribe(added)
+            stale = [w for w in self._stale if w in self.windows]
+            self._stale.clear()
+            self._query(added + stale)
+            self.display.flush()
+
+    def snapshot(self, full: bool = False) -> Optional[dict]:
+        """
+        Returns the event data of a snapshot of the windows as of the last update(): the
+        windows added, removed and changed since the previous snapshot, or with *full*
+        all of them. None if nothing changed.
+        """
+        touched, self._touched = self._touched, set()
+        if full:
+            self._snapshot = dict(self.windows)
+            return {
+                "snapshot": "full",
+                "count": len(self.windows),
+                "windows": [w.to_dict() for w in sorted(self.windows.values())],
+            }
+
+        added: List[dict] = []
+        removed: List[str] = []
+        changed: List[dict] = []
+        for window_id in sorted(touched):
+            before = self._snapshot.get(window_id)
+            after = self.windows.get(window_id)
+            if before == after:
+                # e.g. created and destroyed again in between
+                continue
+            if after is None:
+                removed.append(hex(window_id))
+                del self._snapshot[window_id]
+            else:
+                (added if before is None else changed).append(after.to_dict())
+                self._snapshot[window_id] = after
+        if not (added or removed or changed):
+            return None
+        return {
+            "snapshot": "delta",
+            "count": len(self.windows),
+            "added": added,
+            "removed": removed,
+            "changed": changed,
+        }
+
+
+def apply(windows: Dict[str, dict], data: dict) -> Dict[str, dict]:
+    """
+    Returns the inventory (window dicts by hex id) after the snapshot event *data*,
+    given *windows*, the inventory before it.
+    """
+    if data["snapshot"] == "full":
+        return {w["id"]: w for w in data["windows"]}
+    windows = dict(windows)
+    for window_id in data["removed"]:
+        windows.pop(window_id, None)
+    for window in data["added"] + data["changed"]:
+        windows[window["id"]] = window
+    return windows
+
+
+_xlib_inventory: Optional[Inventory] = None
+
+
+def xlib_inventory() -> Inventory:
+    """The Inventory of the xlib module's connection, a new one after it reconnected."""
+    global _xlib_inventory
+    from . import xlib
+
+    xlib.connect()
+    if _xlib_inventory is None or _xlib_inventory.display is not xlib.display:
+        _xlib_inventory = Inventory(
+            xlib.display, xlib.dispatcher, watched=partial(xlib._watched, xlib.display)
+        )
+    return _xlib_inventory
+
+
+class InventoryRecorder:
+    """
+    Sends a snapshot of the Inventory from *get_inventory* to *bucket_id* every
+    *interval* seconds, when called from the sampling loop (see inventory_recording).
+    """
+
+    def __init__(
+        self,
+        client,
+        bucket_id: str,
+        interval: float,
+        get_inventory: Callable[[], Inventory] = xlib_inventory,
+        keyframe_every: int = DEFAULT_KEYFRAME_EVERY,
+        clock: Callable[[], float] = monotonic,
+        now: Callable[[], datetime] = _now,
+    ):
+        self.client = client
+        self.bucket_id = bucket_id
+        self.interval = interval
+        self.get_inventory = get_inventory
+        self.keyframe_every = keyframe_every
+        self.clock = clock
+        self.now = now
+        self.next_snapshot = float("-inf")
+        self.inventory: Optional[Inventory] = None
+        self.snapshots = 0
+        self.sent = 0
+
+    def maybe_record(self) -> None:
+        """Records a snapshot if one is due."""
+        if self.clock() >= self.next_snapshot:
+            self.next_snapshot = self.clock() + self.interval
+            self.record()
+
+    def record(self) -> None:
+        inventory = self.get_inventory()
+        if inventory is not self.inventory:
+            # A new connection starts from nothing, so the next snapshot is a full one
+            self.inventory = inventory
+            self.snapshots = 0
+        inventory.update()
+        data = inventory.snapshot(full=self.snapshots % self.keyframe_every == 0)
+        self.snapshots += 1
+        if data is None:
+            return
+        # pulsetime=0: every snapshot is an event of its own, never merged with the last
+        self.client.heartbeat(
+            self.bucket_id, Event(timestamp=self.now(), data=data), pulsetime=0.0, queued=True
+        )
+        self.sent += 1
+
+    def stats(self) -> dict:
+        return {
+            "snapshots": self.snapshots,
+            "sent": self.sent,
+            "windows": len(self.inventory.windows) if self.inventory is not None else 0,
+            "round_trips": self.inventory.round_trips if self.inventory is not None else 0,
+        }
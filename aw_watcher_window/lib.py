@@ -1,22 +1,38 @@
 import sys
-from typing import Optional
+import time
+from concurrent.futures import Executor
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, NamedTuple, Optional, Tuple, Union
 
 from .exceptions import FatalError
+from .window import WindowInfo, intern
 
+if TYPE_CHECKING:
+    # Imports python-xlib, which isn't there on every platform
+    from .xlib_events import ActiveWindowWatcher
 
-def get_current_window_linux() -> Optional[dict]:
+UNKNOWN_WINDOW = WindowInfo("unknown", "unknown")
+
+
+def get_window_info_linux() -> WindowInfo:
     from . import xlib
 
-    window = xlib.get_current_window()
+    return window_info_from_x(xlib.get_current_window_info())
 
-    if window is None:
-        cls = "unknown"
-        name = "unknown"
-    else:
-        cls = xlib.get_window_class(window)
-        name = xlib.get_window_name(window)
 
-    return {"app": cls, "title": name}
+def window_info_from_x(info: Optional[Tuple[str, str]]) -> WindowInfo:
+    """The WindowInfo of a (class, name) from xlib, UNKNOWN_WINDOW for None."""
+    if info is None:
+        return UNKNOWN_WINDOW
+    cls, name = info
+    return WindowInfo(intern(cls), intern(name))
+
+
+def _window_info(window: Optional[dict]) -> Optional[WindowInfo]:
+    return WindowInfo.from_dict(window) if window is not None else None
+
+
+def get_current_window_linux() -> Optional[dict]:
+    return get_window_info_linux().to_dict()
 
 
 def get_current_window_macos(strategy: str) -> Optional[dict]:
@@ -46,13 +62,9 @@ def get_current_window_windows() -> Optional[dict]:
         return None
 
     try:
-        app = windows.get_app_name(window_handle)
+        app = windows.get_process_name(window_handle)
     except Exception:
-        # Fall back to WMI for elevated/admin processes where OpenProcess fails
-        try:
-            app = windows.get_app_name_wmi(window_handle)
-        except Exception:
-            app = None
+        app = None
 
     title = windows.get_window_title(window_handle)
 
@@ -79,3 +91,228 @@ def get_current_window(strategy: Optional[str] = None) -> Optional[dict]:
         return get_current_window_windows()
     else:
         raise FatalError(f"Unknown platform: {sys.platform}")
+
+
+def get_window_info(strategy: Optional[str] = None) -> Optional[WindowInfo]:
+    """
+    Same as get_current_window(), as a WindowInfo with interned strings. On Linux no dict
+    is built at all.
+
+    :raises FatalError: if a fatal error occurs (e.g. unsupported platform, X server closed)
+    """
+    if sys.platform.startswith("linux"):
+        return get_window_info_linux()
+    return _window_info(get_current_window(strategy))
+
+
+class WindowChange(NamedTuple):
+    """The active window became *window* (None if there's none)."""
+
+    window: Optional[WindowInfo]
+    # time.monotonic() when the source returned it
+    timestamp: float
+    # Seconds the source took to fetch it
+    latency: float
+
+
+class WindowSource:
+    """
+    A backend that knows which window is active.
+
+    Subclasses implement get_current_window(), and wait() if they can be told about
+    changes instead of having to be polled. changes() builds a stream of WindowChange on
+    top of those. wait_async() is wait() for the asyncio API (see aio).
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+
+    def get_current_window(self) -> Optional[WindowInfo]:
+        """
+        Returns the active window, or None.
+
+        :raises FatalError: if the source can't be used anymore (e.g. X server closed)
+        """
+        raise NotImplementedError
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Waits up to *timeout* seconds for the window to change. Returns True if it might
+        have, False on timeout. Sources that can't tell just sleep.
+        """
+        time.sleep(timeout)
+        return False
+
+    async def wait_async(self, timeout: float, executor: Optional[Executor] = None) -> bool:
+        """
+        Like wait(), for a coroutine: runs wait() on *executor* (the event loop's default
+        one if None). Sources that can wait on the event loop itself override it.
+        """
+        import asyncio
+
+        return await asyncio.get_running_loop().run_in_executor(executor, self.wait, timeout)
+
+    def close(self) -> None:
+        pass
+
+    def changes(self, poll_time: float = 1.0) -> Iterator[WindowChange]:
+        """
+        Yields the active window, and again every time it changes, checking at least
+        every *poll_time* seconds. Ends when the source fails fatally.
+        """
+        last: object = object()  # equal to no window, so the first one is yielded
+        while True:
+            start = self.clock()
+            try:
+                window = self.get_current_window()
+            except FatalError:
+                return
+            end = self.clock()
+            if window != last:
+                last = window
+                yield WindowChange(window, end, end - start)
+            try:
+                self.wait(poll_time)
+            except FatalError:
+                return
+
+
+class XlibSource(WindowSource):
+    """
+    The active window from the X server over python-xlib, waiting on X events for changes.
+
+    The watchdog (see xlib.enable_watchdog) may rebuild the connection during any call,
+    the watcher of the old one is then replaced before the next wait.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        super().__init__(clock)
+        self._watcher: Optional["ActiveWindowWatcher"] = None
+
+    def get_current_window(self) -> Optional[WindowInfo]:
+        return get_window_info_linux()
+
+    def wait(self, timeout: float) -> bool:
+        from . import xlib
+        from .xlib_watchdog import StalledCallError
+
+        try:
+            if self._watcher is None or self._watcher.dispatcher is not xlib.dispatcher:
+                self._watcher = xlib.active_window_watcher()
+            return self._watcher.wait(timeout)
+        except StalledCallError:
+            # On a new connection now, the window may have changed meanwhile
+            return True
+
+    async def wait_async(self, timeout: float, executor: Optional[Executor] = None) -> bool:
+        """
+        Waits on the X connection through the event loop (see
+        ActiveWindowWatcher.wait_async), making the requests on *executor* if given.
+        """
+        import asyncio
+
+        from . import xlib
+        from .xlib_watchdog import StalledCallError
+
+        try:
+            if self._watcher is None or self._watcher.dispatcher is not xlib.dispatcher:
+                if executor is None:
+                    self._watcher = xlib.active_window_watcher()
+                else:
+                    loop = asyncio.get_running_loop()
+                    self._watcher = await loop.run_in_executor(executor, xlib.active_window_watcher)
+            return await self._watcher.wait_async(timeout, executor)
+        except StalledCallError:
+            # On a new connection now, the window may have changed meanwhile
+            return True
+
+
+class XpropSource(WindowSource):
+    """The active window by running ``xprop``, for when python-xlib can't connect."""
+
+    def get_current_window(self) -> Optional[WindowInfo]:
+        from . import xprop
+
+        window_id = xprop.get_active_window_id()
+        if int(window_id, 16) == 0:
+            return None
+        window = xprop.get_window(window_id, active_window=True)
+        return WindowInfo(intern(window["class"][-1]), intern(window["name"]))
+
+
+class WindowsSource(WindowSource):
+    def get_current_window(self) -> Optional[WindowInfo]:
+        return _window_info(get_current_window_windows())
+
+
+class MacOSSource(WindowSource):
+    """The active window on macOS, with the ``jxa`` or ``applescript`` strategy."""
+
+    def __init__(self, strategy: str = "jxa", clock: Callable[[], float] = time.monotonic):
+        if strategy not in ("jxa", "applescript"):
+            raise FatalError(f"invalid strategy '{strategy}'")
+        super().__init__(clock)
+        self.strategy = strategy
+
+    def get_current_window(self) -> Optional[WindowInfo]:
+        return _window_info(get_current_window_macos(self.strategy))
+
+
+class FakeWindowSource(WindowSource):
+    """
+    Returns *windows* (WindowInfo, or dicts like get_current_window() returns) one after
+    the other, then fails like a closed display would.
+
+    For testing and benchmarking pipelines without a display: wait() doesn't sleep, so
+    changes() runs through the windows as fast as they can be consumed.
+    """
+
+    def __init__(
+        self,
+        windows: Iterable[Union[WindowInfo, dict, None]],
+        latency: float = 0.0,
+        clock: Optional[Callable[[], float]] = None,
+    ):
+        self._own_clock = clock is None
+        super().__init__(clock or self._fake_clock)
+        self.now = 0.0
+        self.latency = latency
+        self.polls = 0
+        self._windows = iter(windows)
+
+    def _fake_clock(self) -> float:
+        return self.now
+
+    def get_current_window(self) -> Optional[WindowInfo]:
+        try:
+            window = next(self._windows)
+        except StopIteration:
+            raise FatalError("no more windows") from None
+        self.polls += 1
+        if self._own_clock:
+            self.now += self.latency
+        return _window_info(window) if isinstance(window, dict) else window
+
+    def wait(self, timeout: float) -> bool:
+        if self._own_clock:
+            self.now += timeout
+        return False
+
+
+def get_window_source(strategy: Optional[str] = None) -> WindowSource:
+    """
+    The WindowSource for this platform. *strategy* picks between ``jxa`` and
+    ``applescript`` on macOS, and with ``xprop`` uses XpropSource on Linux.
+
+    :raises FatalError: on an unsupported platform or strategy
+    """
+    if sys.platform.startswith("linux"):
+        return XpropSource() if strategy == "xprop" else XlibSource()
+    elif sys.platform == "darwin":
+        if strategy is None:
+            raise FatalError("macOS strategy not specified")
+        return MacOSSource(strategy)
+    elif sys.platform in ["win32", "cygwin"]:
+        return WindowsSource()
+    else:
+        raise FatalError(f"Unknown platform: {sys.platform}")
@@ -2,21 +2,25 @@ import logging
 import os
 import re
 import signal
-import subprocess
 import sys
+import threading
+from contextlib import contextmanager
 from datetime import datetime, timezone
-from time import sleep
+from functools import partial
 
-from aw_client import ActivityWatchClient
-from aw_core.log import setup_logging
-from aw_core.models import Event
-
-from .config import parse_args
 from .exceptions import FatalError
-from .lib import get_current_window
-from .research_filter import transform as research_transform
-from .macos_cli import build_swift_command
-from .macos_permissions import background_ensure_permissions
+from .pipeline import (
+    assemble,
+    compute_pulsetime,
+    fetch_current_window,
+    send_sample,
+    transform_window,
+)
+from .startup import StartupProfiler
+
+# Everything else, down to the loops and what they send (aw_core, and requests through
+# heartbeat), is imported where it's used, so that main() can time each import as a
+# step of startup (see --profile-startup) and configurations load only what they need.
 
 logger = logging.getLogger(__name__)
 
@@ -24,18 +28,8 @@ logger = logging.getLogger(__name__)
 log_level = os.environ.get("LOG_LEVEL")
 if log_level:
     logger.setLevel(logging.__getattribute__(log_level.upper()))
-
-
-def compute_pulsetime(poll_time: float) -> float:
-    """Scale pulsetime with poll_time so OS scheduling jitter doesn't break heartbeat chains.
-
-    At poll_time=1s, jitter ~0.15s is well within 1s margin (poll_time+1).
-    At poll_time=5s, jitter ~0.75s exceeds the 1s margin ~10% of the time,
-    causing missing time in the timeline. max(poll_time*1.5, poll_time+1) keeps
-    backward compatibility at poll_time≤2s while fixing the problem at higher
-    polling intervals. See: https://github.com/ActivityWatch/activitywatch/issues/1177
-    """
-    return max(poll_time * 1.5, poll_time + 1.0)
+    # The windows fetched are logged by pipeline
+    logging.getLogger(fetch_current_window.__module__).setLevel(logger.level)
 
 
 def kill_process(pid):
@@ -54,37 +48,206 @@ def try_compile_title_regex(title):
         exit(1)
 
 
+def compile_exclude_titles(titles):
+    """The TitleFilter of the regular expressions *titles*, exits on an invalid one."""
+    from .title_filter import TitleFilter
+
+    return TitleFilter(
+        [try_compile_title_regex(title) for title in titles if title is not None]
+    )
+
+
+def open_inventory_recorder(client, interval):
+    """An InventoryRecorder into a bucket of its own, or None without an *interval*."""
+    if not interval:
+        return None
+    from .inventory import InventoryRecorder
+
+    bucket_id = f"{client.client_name}-inventory_{client.client_hostname}"
+    client.create_bucket(bucket_id, "window-inventory", queued=True)
+    logger.info(f"Recording window inventory to {bucket_id} every {interval}s")
+    return InventoryRecorder(client, bucket_id, interval)
+
+
+@contextmanager
+def open_recorder(path):
+    """Yields a TraceWriter recording to *path* until the block exits, or None without one."""
+    if not path:
+        yield None
+        return
+    from .trace import TraceWriter
+
+    logger.info(f"Recording window samples to {path}")
+    with TraceWriter(path) as recorder:
+        yield recorder
+
+
+@contextmanager
+def spooled(client, path, bucket_id, event_type):
+    """
+    Yields what to send heartbeats to: *client*, or with a spool *path*, a SpoolingClient
+    in front of it that is flushed until the block exits.
+    """
+    if not path:
+        yield client
+        return
+    from .spool import Spool, SpoolingClient
+
+    logger.info(f"Spooling heartbeats in {path}")
+    sink = SpoolingClient(client, Spool(path))
+    sink.create_bucket(bucket_id, event_type)
+    sink.start()
+    try:
+        yield sink
+    finally:
+        sink.stop()
+        logger.info(f"Spool: {sink.stats()}")
+        sink.spool.close()
+
+
+@contextmanager
+def merging(client, merge_interval):
+    """
+    Yields what to send heartbeats to: *client*, or with a *merge_interval*, an
+    EventMerger in front of it that is flushed when the block exits.
+    """
+    if not merge_interval:
+        yield client
+        return
+    from .spool import SpoolingClient
+
+    if isinstance(client, SpoolingClient):
+        logger.warning("Merging events locally isn't supported together with the spool, ignoring")
+        yield client
+        return
+    logger.info(f"Merging events locally, sending them every {merge_interval}s")
+    from .heartbeat import EventMerger
+
+    merger = EventMerger(client, merge_interval)
+    try:
+        yield merger
+    finally:
+        merger.flush()
+        logger.info(f"Event merging: {merger.stats()}")
+
+
+@contextmanager
+def serving_metrics(port, path):
+    """
+    Yields a Metrics served on localhost *port* or the Unix socket at *path*, with the
+    platform backend instrumented, or None if neither is given.
+    """
+    if not port and not path:
+        yield None
+        return
+    from .metrics import Metrics, MetricsServer, instrumented_backends
+
+    metrics = Metrics()
+    if path:
+        server = MetricsServer(metrics, path=path)
+    else:
+        server = MetricsServer(metrics, port=port)
+    logger.info(f"Serving metrics at {server.address}")
+    server.start()
+    try:
+        with instrumented_backends(metrics):
+            yield metrics
+    finally:
+        server.stop()
+
+
+@contextmanager
+def profiling(path, rate, rotate_interval):
+    """Samples the watcher's stacks into *path* while in the block, if given (see StackSampler)."""
+    if not path:
+        yield
+        return
+    from .stack_sampler import StackSampler
+
+    sampler = StackSampler(path, rate, rotate_interval)
+    sampler.start()
+    try:
+        yield
+    finally:
+        sampler.stop()
+
+
 def main():
-    args = parse_args()
+    # Checked before parsing, so that parsing (and what it imports) is profiled too
+    profiler = StartupProfiler(enabled="--profile-startup" in sys.argv[1:])
+    profiler.start()
+
+    with profiler.step("parse arguments"):
+        from .config import parse_args
+
+        args = parse_args()
 
-    if sys.platform.startswith("linux") and (
+    if sys.platform.startswith("linux") and not args.displays and (
         "DISPLAY" not in os.environ or not os.environ["DISPLAY"]
     ):
         raise Exception("DISPLAY environment variable not set")
 
-    setup_logging(
-        name="aw-watcher-window",
-        testing=args.testing,
-        verbose=args.verbose,
-        log_stderr=True,
-        log_file=True,
-    )
+    with profiler.step("set up logging"):
+        from aw_core.log import setup_logging
+
+        setup_logging(
+            name="aw-watcher-window",
+            testing=args.testing,
+            verbose=args.verbose,
+            log_stderr=True,
+            log_file=True,
+        )
     if sys.platform == "darwin":
-        background_ensure_permissions()
+        with profiler.step("check permissions"):
+            from .macos_permissions import background_ensure_permissions
 
-    client = ActivityWatchClient(
-        "aw-watcher-window", host=args.host, port=args.port, testing=args.testing
-    )
+            background_ensure_permissions()
+
+    with profiler.step("create client"):
+        from aw_client import ActivityWatchClient
+
+        client = ActivityWatchClient(
+            "aw-watcher-window", host=args.host, port=args.port, testing=args.testing
+        )
+
+        bucket_id = f"{client.client_name}_{client.client_hostname}"
+        event_type = "currentwindow"
+
+        if not args.displays:
+            # Each display has a bucket of its own (see seats)
+            client.create_bucket(bucket_id, event_type, queued=True)
+
+    if sys.platform.startswith("linux"):
+        with profiler.step("connect to X server"):
+            from . import xlib
+
+            if not args.displays:
+                xlib.connect()
+            if args.x_deadline:
+                xlib.enable_watchdog(args.x_deadline)
 
-    bucket_id = f"{client.client_name}_{client.client_hostname}"
-    event_type = "currentwindow"
+    with profiler.step("import the loops"):
+        import asyncio
 
-    client.create_bucket(bucket_id, event_type, queued=True)
+        from . import aio
+
+        # Used from the loops below, which import them where they need them; loaded
+        # here so that the time they take shows up as a step of its own
+        import aw_core.models  # noqa: F401
+
+        from . import heartbeat, lib, sampler, schedule, title_filter, transform_cache  # noqa: F401
 
     logger.info("aw-watcher-window started")
-    client.wait_for_start()
+    with profiler.step("wait for server"):
+        client.wait_for_start()
+
+    profiler.stop()
+    if profiler.enabled:
+        logger.info(profiler.report())
 
-    with client:
+    with exit_on_sigterm(), profiling(
+        args.profile, args.profile_rate, args.profile_rotate
+    ), serving_metrics(args.metrics_port, args.metrics_socket) as metrics, client:
         research_category_map = (
             args.research_category_map
             if args.research_enabled
@@ -95,47 +258,127 @@ def main():
             if args.research_enabled
             else None
         )
+        research_classifier = None
+        if research_category_map is not None:
+            from .research_filter import ResearchClassifier
+
+            research_classifier = ResearchClassifier(
+                research_category_map, research_app_category_map
+            )
         if sys.platform == "darwin" and args.strategy == "swift":
+            from .macos_cli import build_swift_command
+
             logger.info("Using swift strategy, calling out to swift binary")
             binpath = os.path.join(
                 os.path.dirname(os.path.realpath(__file__)), "aw-watcher-window-macos"
             )
 
+            command = build_swift_command(
+                binpath,
+                client.server_address,
+                bucket_id,
+                client.client_hostname,
+                client.client_name,
+                exclude_title=args.exclude_title,
+                exclude_titles=args.exclude_titles,
+                research_category_map=research_category_map,
+                research_app_category_map=research_app_category_map,
+            )
             try:
-                p = subprocess.Popen(
-                    build_swift_command(
-                        binpath,
-                        client.server_address,
-                        bucket_id,
-                        client.client_hostname,
-                        client.client_name,
-                        exclude_title=args.exclude_title,
-                        exclude_titles=args.exclude_titles,
-                        research_category_map=research_category_map,
-                        research_app_category_map=research_app_category_map,
-                    )
-                )
-                # terminate swift process when this process dies
-                signal.signal(signal.SIGTERM, lambda *_: kill_process(p.pid))
-                p.wait()
+                # SIGTERM terminates the swift process too (see run_swift)
+                asyncio.run(aio.until_sigterm(aio.run_swift(command)))
             except KeyboardInterrupt:
                 print("KeyboardInterrupt")
-                kill_process(p.pid)
-        else:
-            heartbeat_loop(
-                client,
-                bucket_id,
-                poll_time=args.poll_time,
-                strategy=args.strategy,
+        elif sys.platform.startswith("linux") and args.displays:
+            from .seats import open_seats, seats_event_loop, seats_loop
+
+            transform_config = dict(
                 exclude_title=args.exclude_title,
-                exclude_titles=[
-                    try_compile_title_regex(title)
-                    for title in args.exclude_titles
-                    if title is not None
-                ],
+                exclude_titles=compile_exclude_titles(args.exclude_titles),
                 research_category_map=research_category_map,
                 research_app_category_map=research_app_category_map,
+                research_classifier=research_classifier,
             )
+            # One spool and one merger for all seats, their events are kept per bucket
+            with spooled(client, args.spool, bucket_id, event_type) as sink, merging(
+                sink, args.merge_interval
+            ) as sink:
+                if args.strategy_linux == "events":
+                    seats = open_seats(sink, bucket_id, event_type, args.displays)
+                    seats_event_loop(
+                        seats,
+                        keepalive_time=args.keepalive_time or args.poll_time,
+                        **transform_config,
+                    )
+                else:
+                    seats = open_seats(
+                        sink, bucket_id, event_type, args.displays, args.coalesce_time
+                    )
+                    seats_loop(
+                        seats,
+                        poll_time=args.poll_time,
+                        max_poll_time=args.max_poll_time,
+                        **transform_config,
+                    )
+        elif sys.platform.startswith("linux") and args.strategy_linux == "events":
+            logger.info("Using events strategy, waiting for X11 property changes")
+            from .lib import get_window_source
+
+            with spooled(client, args.spool, bucket_id, event_type) as sink, merging(
+                sink, args.merge_interval
+            ) as sink, open_recorder(args.record) as recorder:
+                watching = aio.event_loop(
+                    sink,
+                    bucket_id,
+                    get_window_source(args.strategy),
+                    keepalive_time=args.keepalive_time or args.poll_time,
+                    exclude_title=args.exclude_title,
+                    exclude_titles=compile_exclude_titles(args.exclude_titles),
+                    research_category_map=research_category_map,
+                    research_app_category_map=research_app_category_map,
+                    research_classifier=research_classifier,
+                    recorder=recorder,
+                    metrics=metrics,
+                    inventory=open_inventory_recorder(client, args.inventory_interval),
+                )
+                asyncio.run(aio.until_sigterm(watching))
+        else:
+            from .lib import get_window_source
+
+            with spooled(client, args.spool, bucket_id, event_type) as sink, merging(
+                sink, args.merge_interval
+            ) as sink, open_recorder(args.record) as recorder:
+                watching = aio.poll_loop(
+                    sink,
+                    bucket_id,
+                    get_window_source(args.strategy),
+                    poll_time=args.poll_time,
+                    coalesce_time=args.coalesce_time,
+                    max_poll_time=args.max_poll_time,
+                    exclude_title=args.exclude_title,
+                    exclude_titles=compile_exclude_titles(args.exclude_titles),
+                    research_category_map=research_category_map,
+                    research_app_category_map=research_app_category_map,
+                    research_classifier=research_classifier,
+                    recorder=recorder,
+                    queue_size=args.queue_size,
+                    queue_overflow=args.queue_overflow,
+                    metrics=metrics,
+                    inventory=open_inventory_recorder(client, args.inventory_interval)
+                    if sys.platform.startswith("linux")
+                    else None,
+                )
+                asyncio.run(aio.until_sigterm(watching))
+
+    log_backend_stats()
+
+
+def log_backend_stats():
+    """Logs, at debug level, how much the caches of the platform backend saved."""
+    if sys.platform.startswith("linux"):
+        from . import xlib
+
+        logger.debug(f"X window cache: {xlib.window_cache_stats()}")
 
 
 def heartbeat_loop(
@@ -147,79 +390,321 @@ def heartbeat_loop(
     exclude_titles=[],
     research_category_map=None,
     research_app_category_map=None,
+    research_classifier=None,
+    coalesce_time=0.0,
+    max_poll_time=None,
+    scheduler=None,
+    recorder=None,
+    queue_size=0,
+    queue_overflow="coalesce",
+    metrics=None,
+    inventory=None,
+    source=None,
+):
+    """
+    Polls the current window every *poll_time* seconds and sends it as a heartbeat.
+
+    The window comes from *source* (a WindowSource), by default get_window_source(strategy).
+
+    With *max_poll_time* > *poll_time*, the interval backs off towards *max_poll_time*
+    while the window stays the same (see AdaptivePollInterval).
+
+    With *coalesce_time* > 0, unchanged heartbeats are coalesced client-side
+    (see HeartbeatCoalescer) and only forwarded every *coalesce_time* seconds.
+
+    Polls are run on deadlines by *scheduler* (see Scheduler), a default one on the
+    monotonic clock if not given.
+
+    Transforms of windows seen before are memoized (see TransformCache).
+
+    With *recorder* (a TraceWriter), every sample is also recorded, before any transforms.
+
+    With *queue_size* > 0, windows are sampled on a thread of their own and queued for
+    sending (see SampleQueue for *queue_overflow*), and SIGTERM stops the loop cleanly.
+
+    With *metrics* (a Metrics), every stage is timed and counted.
+
+    With *inventory* (an InventoryRecorder), snapshots of all windows are recorded
+    from the sampling loop as well.
+    """
+    from .heartbeat import HeartbeatCoalescer
+    from .lib import get_window_source
+    from .sampler import SampleQueue, StageTimings, run_threaded
+    from .schedule import AdaptivePollInterval, Scheduler
+    from .transform_cache import TransformCache
+
+    pulsetime = compute_pulsetime(poll_time)
+    poll_interval = AdaptivePollInterval(poll_time, max(poll_time, max_poll_time or 0))
+    stop = threading.Event()
+    if scheduler is None:
+        # Waiting on stop lets the sampler thread stop right away
+        scheduler = Scheduler(sleep=stop.wait)
+    transform = TransformCache(transform_window)
+    if source is None:
+        source = get_window_source(strategy)
+    client, apply_transform, fetch_window = assemble(
+        client, source, transform, recorder, metrics, inventory, research_category_map
+    )
+    coalescer = HeartbeatCoalescer(client, bucket_id, coalesce_time)
+    now = partial(datetime.now, timezone.utc)
+    transform_config = dict(
+        exclude_title=exclude_title,
+        exclude_titles=exclude_titles,
+        research_category_map=research_category_map,
+        research_app_category_map=research_app_category_map,
+        research_classifier=research_classifier,
+    )
+    queue = SampleQueue(queue_size, queue_overflow) if queue_size else None
+    timings = StageTimings()
+    if metrics is not None:
+        metrics.collect("heartbeat_coalescer", coalescer.stats)
+        if queue is not None:
+            metrics.collect("sample_queue", queue.stats)
+        if inventory is not None:
+            metrics.collect("inventory", inventory.stats)
+    try:
+        if queue is None:
+            _heartbeat_loop(
+                coalescer,
+                poll_interval,
+                scheduler,
+                apply_transform,
+                fetch_window,
+                now,
+                **transform_config,
+            )
+        else:
+            send = partial(
+                send_sample,
+                coalescer,
+                timings.timed("transform", apply_transform),
+                **transform_config,
+            )
+            sample_loop = partial(
+                _sample_loop,
+                poll_interval,
+                scheduler,
+                timings.timed("sample", fetch_window),
+                now,
+                stop=stop,
+            )
+            with stop_on_sigterm(stop, queue):
+                run_threaded(sample_loop, timings.timed("send", send), queue, stop, timings)
+    finally:
+        coalescer.flush(pulsetime)
+        logger.info(f"Heartbeat coalescing: {coalescer.stats()}")
+        logger.info(
+            f"Poll lateness: {scheduler.lateness.stats()}, skipped ticks: {scheduler.skipped}"
+        )
+        logger.info(f"Transform cache: {transform.stats()}")
+        if queue is not None:
+            logger.info(f"Sample queue: {queue.stats()}, stage timings: {timings.stats()}")
+        if inventory is not None:
+            logger.info(f"Window inventory: {inventory.stats()}")
+
+
+@contextmanager
+def exit_on_sigterm():
+    """
+    Raises SystemExit on SIGTERM while in the block, so that the loops flush what they
+    hold back on the way out instead of the process dying right away. aw-qt stops
+    watchers with SIGTERM.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        # Signal handlers can only be set from the main thread
+        yield
+        return
+
+    def handler(signum, frame):
+        logger.info("Got SIGTERM, stopping")
+        raise SystemExit(0)
+
+    previous = signal.signal(signal.SIGTERM, handler)
+    try:
+        yield
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+
+
+@contextmanager
+def stop_on_sigterm(stop, queue):
+    """Sets *stop* on SIGTERM while in the block, instead of exiting right away."""
+    if threading.current_thread() is not threading.main_thread():
+        # Signal handlers can only be set from the main thread
+        yield
+        return
+
+    def handler(signum, frame):
+        logger.info("Got SIGTERM, stopping")
+        stop.set()
+        queue.wake()
+
+    previous = signal.signal(signal.SIGTERM, handler)
+    try:
+        yield
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+
+
+def _heartbeat_loop(
+    coalescer,
+    poll_interval,
+    scheduler,
+    transform,
+    fetch_window,
+    now,
+    exclude_title=False,
+    exclude_titles=[],
+    research_category_map=None,
+    research_app_category_map=None,
+    research_classifier=None,
 ):
-    while True:
+    """
+    The loop of heartbeat_loop, with its parts passed in so it can be driven on a fake clock.
+
+    *fetch_window* is called like fetch_current_window, *now* returns the event timestamp.
+    """
+    send = partial(
+        send_sample,
+        coalescer,
+        transform,
+        exclude_title=exclude_title,
+        exclude_titles=exclude_titles,
+        research_category_map=research_category_map,
+        research_app_category_map=research_app_category_map,
+        research_classifier=research_classifier,
+    )
+    _sample_loop(poll_interval, scheduler, fetch_window, now, send)
+
+
+def _sample_loop(poll_interval, scheduler, fetch_window, now, emit, stop=None):
+    """
+    Samples the window on *scheduler*'s ticks and passes each sample to *emit*, until
+    the window can't be fetched anymore, the parent process died or *stop* is set.
+    """
+    from .sampler import Sample
+
+    # The interval we actually waited before the current poll, which is what the
+    # pulsetime has to cover.
+    interval = poll_interval.min_interval
+    last_window = None
+    while stop is None or not stop.is_set():
         if os.getppid() == 1:
             logger.info("window-watcher stopped because parent process died")
             break
 
-        current_window = None
         try:
-            current_window = get_current_window(strategy)
-            logger.debug(current_window)
-        except (FatalError, OSError):
-            # Fatal exceptions should quit the program
-            try:
-                logger.exception("Fatal error, stopping")
-            except OSError:
-                pass
+            current_window = fetch_window()
+        except FatalError:
             break
-        except Exception:
-            # Non-fatal exceptions should be logged
-            try:
-                # If stdout has been closed, this exception-print can cause (I think)
-                #   OSError: [Errno 5] Input/output error
-                # See: https://github.com/ActivityWatch/activitywatch/issues/756#issue-1296352264
-                #
-                # However, I'm unable to reproduce the OSError in a test (where I close stdout before logging),
-                # so I'm in uncharted waters here... but this solution should work.
-                logger.exception("Exception thrown while trying to get active window")
-            except OSError:
-                break
 
+        changed = False
         if current_window is None:
             logger.debug("Unable to fetch window, trying again on next poll")
         else:
-            current_window = transform_window(
-                current_window,
-                exclude_title=exclude_title,
-                exclude_titles=exclude_titles,
-                research_category_map=research_category_map,
-                research_app_category_map=research_app_category_map,
-            )
+            changed = current_window != last_window
+            last_window = current_window
 
-            now = datetime.now(timezone.utc)
-            current_window_event = Event(timestamp=now, data=current_window)
-
-            client.heartbeat(
-                bucket_id,
-                current_window_event,
-                pulsetime=compute_pulsetime(poll_time),
-                queued=True,
-            )
+            pulsetime = scheduler.pulsetime(interval, compute_pulsetime(interval))
+            emit(Sample(current_window, now(), pulsetime))
 
-        sleep(poll_time)
+        interval = poll_interval.next(changed)
+        scheduler.wait(interval)
 
 
-def transform_window(
-    current_window,
+def event_loop(
+    client,
+    bucket_id,
+    source,
+    keepalive_time,
     exclude_title=False,
-    exclude_titles=None,
+    exclude_titles=[],
     research_category_map=None,
     research_app_category_map=None,
+    research_classifier=None,
+    recorder=None,
+    metrics=None,
+    inventory=None,
 ):
-    if research_category_map is not None:
-        return research_transform(
-            current_window,
-            research_category_map,
-            app_category_map=research_app_category_map,
-        )
+    """
+    Like heartbeat_loop, but only samples the window of *source* (a WindowSource) when
+    its wait() reports a change.
 
-    for pattern in exclude_titles or []:
-        if pattern.search(current_window["title"]):
-            current_window["title"] = "excluded"
+    A keep-alive heartbeat is still sent every *keepalive_time* seconds, so pulsetime is
+    derived from that interval rather than from poll_time.
 
-    if exclude_title:
-        current_window["title"] = "excluded"
+    With *metrics* (a Metrics), every stage is timed and counted.
+
+    With *inventory* (an InventoryRecorder), snapshots of all windows are recorded
+    along with the samples, so up to *keepalive_time* seconds after they are due.
+    """
+    from aw_core.models import Event
+
+    from .transform_cache import TransformCache
+
+    pulsetime = compute_pulsetime(keepalive_time)
+    transform = TransformCache(transform_window)
+    client, apply_transform, fetch_window = assemble(
+        client, source, transform, recorder, metrics, inventory, research_category_map
+    )
+    last_data = None
+
+    try:
+        while True:
+            if os.getppid() == 1:
+                logger.info("window-watcher stopped because parent process died")
+                break
+
+            try:
+                current_window = fetch_window()
+            except FatalError:
+                break
+
+            if current_window is None:
+                logger.debug("Unable to fetch window, trying again on next change")
+            else:
+                current_window = apply_transform(
+                    current_window,
+                    exclude_title=exclude_title,
+                    exclude_titles=exclude_titles,
+                    research_category_map=research_category_map,
+                    research_app_category_map=research_app_category_map,
+                    research_classifier=research_classifier,
+                )
+
+                now = datetime.now(timezone.utc)
+                if last_data is not None and last_data != current_window:
+                    # Heartbeats are sparse in this mode, so extend the previous window
+                    # up to the switch before starting the new one.
+                    client.heartbeat(
+                        bucket_id,
+                        Event(timestamp=now, data=last_data),
+                        pulsetime=pulsetime,
+                        queued=True,
+                    )
+                client.heartbeat(
+                    bucket_id,
+                    Event(timestamp=now, data=current_window),
+                    pulsetime=pulsetime,
+                    queued=True,
+                )
+                last_data = current_window
+
+            try:
+                source.wait(keepalive_time)
+            except FatalError:
+                break
+    except (SystemExit, KeyboardInterrupt):
+        if last_data is not None:
+            # Stopped (e.g. by SIGTERM) while waiting: the last window lasted until now
+            client.heartbeat(
+                bucket_id,
+                Event(timestamp=datetime.now(timezone.utc), data=last_data),
+                pulsetime=pulsetime,
+                queued=True,
+            )
+        raise
 
-    return current_window
+    logger.info(f"Transform cache: {transform.stats()}")
+    if inventory is not None:
+        logger.info(f"Window inventory: {inventory.stats()}")
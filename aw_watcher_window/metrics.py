@@ -0,0 +1,288 @@
+"""
+Timers and counters for the hot path, exported as Prometheus text.
+
+Nothing here runs unless metrics are enabled (``--metrics-port`` or ``--metrics-socket``):
+functions are instrumented by wrapping them when the pipeline is put together, so a
+watcher without metrics runs exactly the code it would without this module, which
+isn't even imported.
+"""
+
+import http.server
+import logging
+import os
+import socketserver
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from .schedule import Histogram
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "aw_watcher_window"
+
+# Backend calls take from microseconds (cached) to seconds (WMI, a hung X server)
+STAGE_BOUNDS = (
+    0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0
+)  # fmt: skip
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(str(value))}"' for key, value in labels) + "}"
+
+
+class Metrics:
+    """
+    Per-stage latency histograms, counters with labels, and stats collected on scrape.
+
+    Updates take a lock, they come from the sampler thread and the sender alike.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, Histogram] = {}
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.collectors: List[Tuple[str, Callable[[], dict]]] = []
+        self._lock = threading.Lock()
+
+    def count(self, name: str, value: float = 1, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram(STAGE_BOUNDS)
+            histogram.add(seconds)
+
+    def collect(self, name: str, stats: Callable[[], dict]) -> None:
+        """Exports the numbers in ``stats()`` (e.g. SampleQueue.stats) as gauges, read on every scrape."""
+        self.collectors.append((name, stats))
+
+    def timed(self, stage: str, func: Callable) -> Callable:
+        """Wraps *func* to time its calls as *stage*, and count the exceptions it raises by type."""
+        observe, count, clock = self.observe, self.count, time.perf_counter
+
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            except BaseException as e:
+                count("errors_total", stage=stage, type=type(e).__name__)
+                raise
+            finally:
+                observe(stage, clock() - start)
+
+        timed.__name__ = getattr(func, "__name__", stage)
+        return timed
+
+    def watched(self, fetch_window: Callable) -> Callable:
+        """Wraps a fetch_current_window-like function to count polls and unknown apps and titles."""
+        count = self.count
+
+        def watched(*args, **kwargs):
+            window = fetch_window(*args, **kwargs)
+            count("polls_total")
+            if window is None:
+                count("no_window_total")
+            else:
+                if window.app == "unknown":
+                    count("unknown_total", field="app")
+                if window.title == "unknown":
+                    count("unknown_total", field="title")
+            return window
+
+        return watched
+
+    def render(self) -> str:
+        """All metrics, in the Prometheus text exposition format."""
+        lines: List[str] = []
+        with self._lock:
+            stages = {stage: (h.bounds, list(h.counts), h.count, h.sum) for stage, h in self.stages.items()}
+            counters = dict(self.counters)
+
+        if stages:
+            name = f"{PREFIX}_stage_seconds"
+            lines.append(f"# HELP {name} Time spent per call, by pipeline stage.")
+            lines.append(f"# TYPE {name} histogram")
+            for stage, (bounds, counts, total, seconds) in sorted(stages.items()):
+                cumulative = 0
+                for bound, bucket in zip(bounds, counts):
+                    cumulative += bucket
+                    le = _format_labels((("stage", stage), ("le", repr(bound))))
+                    lines.append(f"{name}_bucket{le} {cumulative}")
+                le = _format_labels((("stage", stage), ("le", "+Inf")))
+                lines.append(f"{name}_bucket{le} {total}")
+                stage_labels = _format_labels((("stage", stage),))
+                lines.append(f"{name}_sum{stage_labels} {seconds}")
+                lines.append(f"{name}_count{stage_labels} {total}")
+
+        by_name: Dict[str, List[Tuple[Labels, float]]] = {}
+        for (counter, labels), value in counters.items():
+            by_name.setdefault(counter, []).append((labels, value))
+        for counter, values in sorted(by_name.items()):
+            name = f"{PREFIX}_{counter}"
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in sorted(values):
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        for collector, stats in self.collectors:
+            name = f"{PREFIX}_{collector}"
+            lines.append(f"# TYPE {name} gauge")
+            try:
+                collected = stats()
+            except Exception:
+                logger.exception(f"Failed to collect {collector} metrics")
+                continue
+            for key, value in sorted(collected.items()):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f'{name}{{stat="{_escape(key)}"}} {value}')
+
+        return "\n".join(lines) + "\n"
+
+
+class InstrumentedClient:
+    """Stands in for the client heartbeats go to, timing heartbeat() as the ``heartbeat`` stage."""
+
+    def __init__(self, client, metrics: Metrics):
+        self.client = client
+        self.heartbeat = metrics.timed("heartbeat", client.heartbeat)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+@contextmanager
+def instrumented_backends(metrics: Metrics) -> Iterator[None]:
+    """
+    Times the calls the backend for this platform makes to the OS while in the block,
+    by wrapping them in place, and puts the originals back on exit. The WindowSource as
+    a whole is timed by the loops (see pipeline.instrument).
+    """
+    # (owner, attribute, original), the original None where the owner had none of its own
+    patched: List[Tuple[Any, str, Any]] = []
+
+    def patch(owner, name: str, replacement) -> None:
+        patched.append((owner, name, vars(owner).get(name)))
+        setattr(owner, name, replacement)
+
+    def wrap(owner, name: str, stage: str) -> None:
+        patch(owner, name, metrics.timed(stage, getattr(owner, name)))
+
+    try:
+        if sys.platform.startswith("linux"):
+            from . import xlib
+
+            connect = xlib.connect
+
+            def connect_timed():
+                # The query of each connection, a new one after a reconnect
+                connection = connect()
+                query = connection.active_window_query
+                if "query" not in vars(query):
+                    wrap(query, "query", "xlib_active_window_query")
+                return connection
+
+            patch(xlib, "connect", connect_timed)
+            wrap(xlib, "get_window_class", "xlib_get_window_class")
+            wrap(xlib, "get_window_name", "xlib_get_window_name")
+            metrics.collect("xlib_window_cache", xlib.window_cache_stats)
+            if xlib.watchdog is not None:
+                metrics.collect("xlib_watchdog", xlib.watchdog.stats)
+        elif sys.platform in ["win32", "cygwin"]:
+            from . import windows
+
+            wrap(windows, "get_active_window_handle", "windows_get_active_window_handle")
+            wrap(windows, "get_window_title", "windows_get_window_title")
+            cache = windows.process_names
+            stages = {
+                windows._get_process_name: "windows_get_process_name",
+                windows._get_process_name_wmi: "windows_get_process_name_wmi",
+            }
+            lookups = [metrics.timed(stages[lookup], lookup) for lookup in cache.lookups]
+            patch(cache, "lookups", lookups)
+            wrap(cache, "start_time", "windows_get_process_start_time")
+            metrics.collect("windows_process_names", cache.stats)
+        elif sys.platform == "darwin":
+            from . import macos_applescript, macos_jxa
+
+            wrap(macos_jxa, "getInfo", "macos_jxa")
+            wrap(macos_applescript, "getInfo", "macos_applescript")
+        yield
+    finally:
+        for owner, name, original in reversed(patched):
+            if original is None:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, original)
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    metrics: Metrics
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.metrics.render().encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) client address
+        return request, ("local", 0)
+
+
+class MetricsServer:
+    """Serves *metrics* at ``/metrics``, on localhost *port* or the Unix socket at *path*."""
+
+    def __init__(self, metrics: Metrics, port: Optional[int] = None, path: Optional[str] = None):
+        if (port is None) == (path is None):
+            raise ValueError("Give either a port or a socket path")
+        handler = type("Handler", (_Handler,), {"metrics": metrics})
+        self.path = path
+        if path is not None:
+            if os.path.exists(path):
+                # Left behind by a previous run
+                os.unlink(path)
+            self.server: socketserver.BaseServer = _UnixHTTPServer(path, handler)
+        elif port is not None:
+            self.server = http.server.ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, name="aw-watcher-window-metrics", daemon=True
+        )
+
+    @property
+    def address(self):
+        return self.server.server_address
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        if self.path is not None and os.path.exists(self.path):
+            os.unlink(self.path)
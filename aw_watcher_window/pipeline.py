@@ -0,0 +1,192 @@
+"""
+The steps a sample goes through on its way to the server, shared by the loops of main,
+aio, seats and replay: fetching the window (fetch_window_from), transforming it for the
+bucket (transform_window) and sending it as a heartbeat (send_sample). assemble() adds
+the optional ones around the fetch (recording, metrics, the window inventory).
+
+Like main, this module imports what the steps use where it's used, so that importing it
+costs next to nothing.
+"""
+
+import logging
+from functools import partial
+
+from .exceptions import FatalError
+
+logger = logging.getLogger(__name__)
+
+
+def compute_pulsetime(poll_time: float) -> float:
+    """Scale pulsetime with poll_time so OS scheduling jitter doesn't break heartbeat chains.
+
+    At poll_time=1s, jitter ~0.15s is well within 1s margin (poll_time+1).
+    At poll_time=5s, jitter ~0.75s exceeds the 1s margin ~10% of the time,
+    causing missing time in the timeline. max(poll_time*1.5, poll_time+1) keeps
+    backward compatibility at poll_time≤2s while fixing the problem at higher
+    polling intervals. See: https://github.com/ActivityWatch/activitywatch/issues/1177
+    """
+    return max(poll_time * 1.5, poll_time + 1.0)
+
+
+def fetch_current_window(source):
+    """
+    Returns the current window of *source* (a WindowSource), or None if it couldn't be
+    fetched this time.
+
+    :raises FatalError: if the watcher should stop
+    """
+    return fetch_window_from(source.get_current_window)
+
+
+def fetch_window_from(get_window):
+    """Like fetch_current_window, with the window from *get_window* (e.g. XConnection's)."""
+    try:
+        current_window = get_window()
+        logger.debug(current_window)
+        return current_window
+    except (FatalError, OSError):
+        # Fatal exceptions should quit the program
+        try:
+            logger.exception("Fatal error, stopping")
+        except OSError:
+            pass
+        raise FatalError()
+    except Exception:
+        # Non-fatal exceptions should be logged
+        try:
+            # If stdout has been closed, this exception-print can cause (I think)
+            #   OSError: [Errno 5] Input/output error
+            # See: https://github.com/ActivityWatch/activitywatch/issues/756#issue-1296352264
+            #
+            # However, I'm unable to reproduce the OSError in a test (where I close stdout before logging),
+            # so I'm in uncharted waters here... but this solution should work.
+            logger.exception("Exception thrown while trying to get active window")
+        except OSError:
+            raise FatalError()
+    return None
+
+
+def recording(fetch_window, recorder):
+    """Wraps *fetch_window* to also write every sample it returns to *recorder*."""
+
+    def fetch():
+        window = fetch_window()
+        try:
+            recorder.write(window)
+        except OSError:
+            logger.exception("Failed to record window sample")
+        return window
+
+    return fetch
+
+
+def inventory_recording(fetch_window, inventory):
+    """Wraps *fetch_window* to also record a window inventory snapshot, when one is due."""
+
+    def fetch():
+        window = fetch_window()
+        try:
+            inventory.maybe_record()
+        except Exception:
+            # The window itself was fetched fine, a broken connection shows up there next time
+            logger.exception("Failed to record window inventory")
+        return window
+
+    return fetch
+
+
+def instrument(metrics, client, transform, source, fetch_window, research_category_map):
+    """
+    Instruments the parts of a loop with *metrics*, returning the client, transform and
+    fetch function to use instead. *transform* (a TransformCache) itself is instrumented
+    in place, so that its cache misses are timed as the transform they run, and so is
+    *source* (a WindowSource), to count the errors by type that fetch_current_window
+    only logs.
+    """
+    from .metrics import InstrumentedClient
+
+    source.get_current_window = metrics.timed("get_window_info", source.get_current_window)
+    stage = "research_transform" if research_category_map is not None else "transform_window"
+    transform.transform = metrics.timed(stage, transform.transform)
+    metrics.collect("transform_cache", transform.stats)
+    return (
+        InstrumentedClient(client, metrics),
+        metrics.timed("transform", transform),
+        metrics.watched(metrics.timed("get_current_window", fetch_window)),
+    )
+
+
+def assemble(
+    client,
+    source,
+    transform,
+    recorder=None,
+    metrics=None,
+    inventory=None,
+    research_category_map=None,
+):
+    """
+    Puts the steps of a loop together: returns the client, transform and fetch function
+    (the window of *source*, like fetch_current_window) that it uses, with every sample
+    written to *recorder*, the steps timed by *metrics* and inventory snapshots recorded
+    with *inventory*, each where given.
+    """
+    fetch_window = partial(fetch_current_window, source)
+    if recorder is not None:
+        fetch_window = recording(fetch_window, recorder)
+    if metrics is not None:
+        client, transform, fetch_window = instrument(
+            metrics, client, transform, source, fetch_window, research_category_map
+        )
+    if inventory is not None:
+        # After instrumenting, so that snapshots aren't timed as window fetches
+        fetch_window = inventory_recording(fetch_window, inventory)
+    return client, transform, fetch_window
+
+
+def send_sample(coalescer, transform, sample, **transform_config):
+    """Sends *sample* (a sampler.Sample) through *coalescer*, its window transformed by *transform*."""
+    from aw_core.models import Event
+
+    current_window = transform(sample.window, **transform_config)
+    current_window_event = Event(
+        timestamp=sample.timestamp, duration=sample.duration, data=current_window
+    )
+    coalescer.heartbeat(current_window_event, sample.pulsetime)
+
+
+def transform_window(
+    current_window,
+    exclude_title=False,
+    exclude_titles=None,
+    research_category_map=None,
+    research_app_category_map=None,
+    research_classifier=None,
+):
+    if research_category_map is not None:
+        from .research_filter import transform as research_transform
+
+        return research_transform(
+            current_window,
+            research_category_map,
+            app_category_map=research_app_category_map,
+            classifier=research_classifier,
+        )
+
+    # exclude_titles is normally a TitleFilter, but a plain list of patterns works too
+    if exclude_titles:
+        from .title_filter import TitleFilter
+
+        if isinstance(exclude_titles, TitleFilter):
+            excluded = exclude_titles.search(current_window["title"])
+        else:
+            excluded = any(
+                pattern.search(current_window["title"]) for pattern in exclude_titles
+            )
+        if excluded:
+            current_window["title"] = "excluded"
+
+    if exclude_title:
+        current_window["title"] = "excluded"
+
+    return current_window
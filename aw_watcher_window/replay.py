@@ -0,0 +1,313 @@
+"""
+Replays a trace of window states through the heartbeat loop, as a benchmark.
+
+The trace is fed to ``_heartbeat_loop`` in place of a WindowSource, on a fake
+clock so that a day of samples replays in seconds. Heartbeats go to a stub client.
+Everything in between is the real thing: the adaptive poll interval, the scheduler,
+transform_window behind its cache and the heartbeat coalescer.
+
+Run as ``python -m aw_watcher_window.replay --output results.json``, on a synthetic
+trace unless ``--trace`` is given. Results are JSON so they can be compared between
+releases.
+"""
+
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, List, Optional
+
+from .exceptions import FatalError
+from .heartbeat import HeartbeatCoalescer
+from .research_filter import ResearchClassifier
+from .main import _heartbeat_loop, compile_exclude_titles
+from .pipeline import compute_pulsetime, transform_window
+from .schedule import AdaptivePollInterval, Scheduler
+from .trace import TraceSample, is_trace_file, read_trace
+from .transform_cache import TransformCache
+from .window import WindowInfo
+
+
+def synthetic_trace(duration: float = 8 * 3600, seed: int = 0) -> List[TraceSample]:
+    """
+    A working day of window switches: mostly long stretches in a few windows, with
+    short visits to many others and titles that change while a window has focus.
+    """
+    rng = random.Random(seed)
+    apps = {
+        "Firefox": ["GitHub - Pull request #{}", "Inbox ({}) - Gmail", "YouTube", "Docs {}"],
+        "Code": ["main.py - project", "test_{}.py - project", "README.md - project"],
+        "Alacritty": ["bash", "vim notes.txt", "htop", "make test #{}"],
+        "Slack": ["general | Team", "dm {} | Team"],
+        "Spotify": ["Spotify Premium", "Song {} - Artist"],
+    }
+    weights = [5, 4, 3, 2, 1]
+    samples = []
+    t = 0.0
+    while t < duration:
+        app = rng.choices(list(apps), weights)[0]
+        title = rng.choice(apps[app]).format(rng.randint(1, 50))
+        url = f"https://example.com/{title.split()[0].lower()}" if app == "Firefox" else ""
+        samples.append(TraceSample(t, app, title, url))
+        # Lognormal dwell times: median ~20s, long tail of minutes
+        t += min(rng.lognormvariate(3, 1.2), 3600)
+    return samples
+
+
+def load_trace(path: str) -> List[TraceSample]:
+    """
+    Reads a trace recorded with ``--record``, or a JSON lines file of
+    ``{timestamp, app, title, url}`` objects.
+    """
+    if is_trace_file(path):
+        return list(read_trace(path))
+    with open(path) as f:
+        return [
+            TraceSample(
+                float(obj["timestamp"]), obj["app"], obj["title"], obj.get("url", "")
+            )
+            for obj in map(json.loads, f)
+            if obj
+        ]
+
+
+class FakeClock:
+    """A monotonic clock that only moves when the scheduler sleeps."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class TraceSource:
+    """
+    Returns the window of the trace at the clock's current time, like the
+    get_current_window of a WindowSource.
+    """
+
+    def __init__(self, samples: Iterable[TraceSample], clock: Callable[[], float]):
+        self.samples = sorted(samples, key=lambda sample: sample.timestamp)
+        if not self.samples:
+            raise ValueError("trace is empty")
+        self.windows = [sample.info() for sample in self.samples]
+        self.start = self.samples[0].timestamp
+        self.end = self.samples[-1].timestamp
+        self.clock = clock
+        self.index = 0
+        self.polls = 0
+
+    def __call__(self) -> WindowInfo:
+        t = self.start + self.clock()
+        if t > self.end:
+            # End of the trace, stops the loop like a fatal error would
+            raise FatalError()
+        while self.index + 1 < len(self.samples) and self.samples[self.index + 1].timestamp <= t:
+            self.index += 1
+        self.polls += 1
+        return self.windows[self.index]
+
+
+class StubClient:
+    """Stands in for ActivityWatchClient, counts (and with *keep*, keeps) the heartbeats it is given."""
+
+    def __init__(self, keep: bool = True):
+        self.keep = keep
+        self.count = 0
+        self.heartbeats: list = []
+
+    def heartbeat(self, bucket_id, event, pulsetime, queued=False):
+        self.count += 1
+        if self.keep:
+            self.heartbeats.append((event, pulsetime))
+
+
+class StageTimer:
+    """Collects wall-clock durations of calls, per stage."""
+
+    def __init__(self):
+        self.durations: Dict[str, List[float]] = {}
+
+    def wrap(self, stage: str, func: Callable) -> Callable:
+        durations = self.durations.setdefault(stage, [])
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                durations.append(time.perf_counter() - start)
+
+        return timed
+
+    def stats(self) -> Dict[str, dict]:
+        return {stage: percentiles(durations) for stage, durations in self.durations.items()}
+
+
+def percentiles(durations: List[float]) -> dict:
+    """Latency percentiles of *durations* (in seconds), in microseconds."""
+    if not durations:
+        return {"count": 0}
+    ordered = sorted(durations)
+
+    def at(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1e6, 3)
+
+    return {
+        "count": len(ordered),
+        "p50_us": at(0.5),
+        "p90_us": at(0.9),
+        "p99_us": at(0.99),
+        "max_us": round(ordered[-1] * 1e6, 3),
+    }
+
+
+def _run(samples, poll_time, max_poll_time, keepalive_time, transform_config, timer):
+    clock = FakeClock()
+    source = TraceSource(samples, clock)
+    # Keeping every heartbeat would show up as retained memory
+    client = StubClient(keep=timer is not None)
+    coalescer = HeartbeatCoalescer(client, "replay", keepalive_time)
+    transform = TransformCache(transform_window)
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+    if timer is not None:
+        coalescer.heartbeat = timer.wrap("heartbeat", coalescer.heartbeat)  # type: ignore
+        fetch_window = timer.wrap("get_current_window", source)
+        transform_stage = timer.wrap("transform_window", transform)
+    else:
+        fetch_window, transform_stage = source, transform
+
+    _heartbeat_loop(
+        coalescer,
+        AdaptivePollInterval(poll_time, max(poll_time, max_poll_time or 0)),
+        Scheduler(clock, clock.sleep),
+        transform_stage,
+        fetch_window,
+        lambda: start + timedelta(seconds=clock.now),
+        **transform_config,
+    )
+    coalescer.flush(compute_pulsetime(poll_time))
+    return source, client, coalescer, transform
+
+
+def replay(
+    samples: Iterable[TraceSample],
+    poll_time: float = 1.0,
+    max_poll_time: Optional[float] = None,
+    keepalive_time: float = 0.0,
+    exclude_titles: Iterable[str] = (),
+    research_category_map: Optional[dict] = None,
+    research_app_category_map: Optional[dict] = None,
+    measure_memory: bool = True,
+) -> dict:
+    """Replays *samples* through the heartbeat loop and returns the benchmark results."""
+    samples = list(samples)
+    transform_config = {
+        "exclude_titles": compile_exclude_titles(exclude_titles),
+        "research_category_map": research_category_map,
+        "research_app_category_map": research_app_category_map,
+        "research_classifier": (
+            ResearchClassifier(research_category_map, research_app_category_map)
+            if research_category_map is not None
+            else None
+        ),
+    }
+
+    timer = StageTimer()
+    start = time.perf_counter()
+    source, client, coalescer, transform = _run(
+        samples, poll_time, max_poll_time, keepalive_time, transform_config, timer
+    )
+    elapsed = time.perf_counter() - start
+
+    results = {
+        "python": platform.python_version(),
+        "platform": sys.platform,
+        "config": {
+            "poll_time": poll_time,
+            "max_poll_time": max_poll_time,
+            "keepalive_time": keepalive_time,
+            "exclude_titles": len(transform_config["exclude_titles"]),
+            "research": research_category_map is not None,
+        },
+        "trace": {
+            "samples": len(samples),
+            "duration_s": source.end - source.start,
+        },
+        "polls": source.polls,
+        "elapsed_s": elapsed,
+        "events_per_second": source.polls / elapsed if elapsed else 0.0,
+        "stages": timer.stats(),
+        "heartbeats": client.count,
+        "coalescing": coalescer.stats(),
+        "transform_cache": transform.stats(),
+    }
+
+    if measure_memory:
+        # A second, untimed run: tracemalloc slows everything down
+        tracemalloc.start()
+        try:
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            memory_source, _, _, _ = _run(
+                samples, poll_time, max_poll_time, keepalive_time, transform_config, None
+            )
+            after, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        retained = after - before
+        results["memory"] = {
+            "peak_bytes": peak - before,
+            "retained_bytes": retained,
+            "retained_bytes_per_poll": retained / memory_source.polls if memory_source.polls else 0.0,
+        }
+
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        "aw-watcher-window replay", description="Replay a window trace as a benchmark."
+    )
+    parser.add_argument(
+        "--trace", help="Trace file (recorded or JSON lines), a synthetic trace if not given"
+    )
+    parser.add_argument("--duration", type=float, default=8 * 3600, help="Synthetic trace length in seconds")
+    parser.add_argument("--seed", type=int, default=0, help="Synthetic trace seed")
+    parser.add_argument("--poll-time", type=float, default=1.0)
+    parser.add_argument("--max-poll-time", type=float, default=None)
+    parser.add_argument("--keepalive-time", type=float, default=0.0)
+    parser.add_argument("--exclude-titles", nargs="*", default=[])
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc run")
+    parser.add_argument("--output", help="Write the results to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    samples = load_trace(args.trace) if args.trace else synthetic_trace(args.duration, args.seed)
+    results = replay(
+        samples,
+        poll_time=args.poll_time,
+        max_poll_time=args.max_poll_time,
+        keepalive_time=args.keepalive_time,
+        exclude_titles=args.exclude_titles,
+        measure_memory=not args.no_memory,
+    )
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -18,10 +18,16 @@ macOS note: on macOS the default ``swift`` strategy captures browser URLs via
 accessibility APIs and includes them in the window dict.  This filter uses those
 URLs for more reliable category classification (``classify_title`` prefers URL
 over title) and strips them from the output before the event is recorded.
+
+Large maps: ``classify_title`` and ``classify_app`` scan the whole map on every
+event.  Build a ``ResearchClassifier`` once instead, it gives the same results
+from a compiled automaton and a pre-normalized dict.
 """
 
 from typing import Optional
 
+from .aho_corasick import AhoCorasick
+
 # Known browser applications (lowercase, for case-insensitive matching)
 BROWSER_APPS = frozenset(
     {
@@ -102,10 +108,55 @@ def classify_app(app: str, app_category_map: dict) -> str:
     return "Excluded"
 
 
+class ResearchClassifier:
+    """
+    ``classify_title`` and ``classify_app`` compiled for a fixed pair of maps.
+
+    Title/URL patterns go into one Aho–Corasick automaton, so classifying costs one
+    pass over the text regardless of the map size; the lowest map index among the
+    matches is used, which keeps "first matching substring wins".  App names are
+    looked up in a dict of normalized keys, where the first of duplicate keys wins
+    like in the linear scan.
+
+    The maps are not copied: build a new classifier when they change.
+    """
+
+    def __init__(self, category_map: dict, app_category_map: Optional[dict] = None):
+        self.category_map = category_map
+        self.app_category_map = app_category_map
+        self._categories = list(category_map.values())
+        self._matcher = AhoCorasick([pattern.lower() for pattern in category_map])
+        self._app_categories: dict = {}
+        for map_app, category in (app_category_map or {}).items():
+            self._app_categories.setdefault(map_app.strip().lower(), category)
+
+    def classify_title(self, title: str, url: str = "") -> str:
+        """Same as ``classify_title(title, category_map, url=url)``."""
+        if url:
+            index = self._matcher.first_match(url.lower())
+            if index is not None:
+                return self._categories[index]
+        index = self._matcher.first_match(title.lower())
+        if index is not None:
+            return self._categories[index]
+        return "excluded"
+
+    def classify_app(self, app: str) -> str:
+        """Same as ``classify_app(app, app_category_map)``."""
+        return self._app_categories.get(app.strip().lower(), "Excluded")
+
+    def transform(self, window: dict) -> dict:
+        """Same as ``transform(window, category_map, app_category_map)``."""
+        return transform(
+            window, self.category_map, self.app_category_map, classifier=self
+        )
+
+
 def transform(
     window: dict,
     category_map: Optional[dict],
     app_category_map: Optional[dict] = None,
+    classifier: Optional[ResearchClassifier] = None,
 ) -> dict:
     """
     Apply Research Edition transforms to a window-data dict.
@@ -116,6 +167,8 @@ def transform(
     *app_category_map*: optional app-name → category mapping for non-browser
     apps.  When supplied, non-browser apps are replaced with their mapped
     category (or ``"Excluded"`` if unmapped) instead of keeping the raw app name.
+    *classifier*: a ``ResearchClassifier`` built from the same maps, used in
+    place of the linear ``classify_title``/``classify_app`` scans.
 
     Returns the transformed window dict (never mutates the input).
     """
@@ -128,7 +181,10 @@ def transform(
         # Browser: replace title with a study category
         title = window.get("title", "")
         url = window.get("url", "")
-        category = classify_title(title, category_map, url=url)
+        if classifier is not None:
+            category = classifier.classify_title(title, url=url)
+        else:
+            category = classify_title(title, category_map, url=url)
         # Don't spread window dict — URLs must not be exposed for privacy
         result = {"app": app, "title": category}
         # Preserve incognito flag if present (metadata, not a privacy concern)
@@ -142,7 +198,10 @@ def transform(
         # no configured app map falls back to legacy behaviour instead of
         # classifying every non-browser app as "Excluded".
         if app_category_map:
-            app_category = classify_app(app, app_category_map)
+            if classifier is not None:
+                app_category = classifier.classify_app(app)
+            else:
+                app_category = classify_app(app, app_category_map)
             # Replace the raw app identity with its category: the app name is
             # the sensitive identifier for non-browser apps (e.g. "Microsoft
             # Outlook", a niche tool, a company-internal app), so it must not
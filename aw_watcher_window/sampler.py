@@ -0,0 +1,191 @@
+"""
+Sampling windows on a thread of its own, decoupled from transforming and sending them.
+
+A slow X call (e.g. a hung client answering BadWindow late) then only delays the samples
+themselves, not the heartbeats of samples already taken, and a slow send doesn't push
+polls off schedule. The two sides are joined by a bounded SampleQueue.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Callable, Deque, Dict, NamedTuple, Optional
+
+from .schedule import Histogram
+from .window import WindowInfo
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = "drop-oldest"
+COALESCE = "coalesce"
+OVERFLOW_POLICIES = (DROP_OLDEST, COALESCE)
+
+
+class Sample(NamedTuple):
+    """A window as sampled at *timestamp*, and seen unchanged for *duration* after it."""
+
+    window: WindowInfo
+    timestamp: datetime
+    pulsetime: float
+    duration: timedelta = timedelta(0)
+    # time.monotonic() when it was queued, to measure the time spent in the queue
+    queued_at: float = 0.0
+
+
+class SampleQueue:
+    """
+    A bounded queue of samples between the sampler thread and the sender.
+
+    When full, the oldest sample is dropped. With the ``coalesce`` policy, a sample of
+    the same window as the newest queued one, and within its pulsetime, extends that one
+    (see Sample.duration) instead of taking a slot, which loses nothing: the server
+    merges the extended heartbeat like it would have merged both. Only window switches
+    and gaps can then overflow.
+    """
+
+    def __init__(self, maxsize: int, policy: str = COALESCE):
+        if maxsize <= 0:
+            raise ValueError("maxsize must be positive")
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {policy!r}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+        self._samples: Deque[Sample] = deque()
+        self._cond = threading.Condition()
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def put(self, sample: Sample) -> None:
+        sample = sample._replace(queued_at=time.monotonic())
+        with self._cond:
+            if self.policy == COALESCE and self._samples:
+                newest = self._samples[-1]
+                if self._merges(newest, sample):
+                    duration = sample.timestamp + sample.duration - newest.timestamp
+                    self._samples[-1] = newest._replace(duration=max(newest.duration, duration))
+                    self.coalesced += 1
+                    return
+            if len(self._samples) >= self.maxsize:
+                self._samples.popleft()
+                self.dropped += 1
+            self._samples.append(sample)
+            self.max_depth = max(self.max_depth, len(self._samples))
+            self._cond.notify()
+
+    @staticmethod
+    def _merges(newest: Sample, sample: Sample) -> bool:
+        # Like aw_transform.heartbeat_merge, so that no span is merged here that the
+        # server would have kept apart
+        pulsetime = timedelta(seconds=min(newest.pulsetime, sample.pulsetime))
+        return (
+            newest.window == sample.window
+            and newest.timestamp <= sample.timestamp <= newest.timestamp + newest.duration + pulsetime
+        )
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Sample]:
+        """Takes the oldest sample, waiting up to *timeout* seconds for one. None if there's none."""
+        with self._cond:
+            if not self._samples:
+                self._cond.wait(timeout)
+            if not self._samples:
+                return None
+            return self._samples.popleft()
+
+    def wake(self) -> None:
+        """Wakes a get() waiting on an empty queue, e.g. to stop."""
+        with self._cond:
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        return {
+            "depth": len(self._samples),
+            "max_depth": self.max_depth,
+            "maxsize": self.maxsize,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+        }
+
+
+class StageTimings:
+    """Histograms of how long each stage of the pipeline takes, in seconds."""
+
+    def __init__(self):
+        self.stages: Dict[str, Histogram] = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = Histogram()
+        histogram.add(seconds)
+
+    def timed(self, stage: str, func: Callable) -> Callable:
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+
+        return timed
+
+    def stats(self) -> dict:
+        return {stage: histogram.stats() for stage, histogram in self.stages.items()}
+
+
+def run_threaded(
+    sample_loop: Callable[[Callable[[Sample], None]], None],
+    send: Callable[[Sample], None],
+    queue: SampleQueue,
+    stop: threading.Event,
+    timings: Optional[StageTimings] = None,
+) -> None:
+    """
+    Runs *sample_loop* on a thread of its own, putting the samples it emits on *queue*,
+    and sends them with *send* on the calling thread, until *stop* is set or the sample
+    loop ends. Samples still queued by then are sent before returning.
+
+    *sample_loop* should return soon after *stop* is set. If it doesn't (stuck in a call
+    that doesn't return), it is left behind as a daemon thread.
+    """
+
+    def send_timed(sample: Sample) -> None:
+        if timings is not None:
+            timings.add("queue_wait", time.monotonic() - sample.queued_at)
+        send(sample)
+
+    def sampler():
+        try:
+            sample_loop(queue.put)
+        except Exception:
+            logger.exception("Sampler thread failed")
+        finally:
+            stop.set()
+            queue.wake()
+
+    thread = threading.Thread(target=sampler, name="aw-watcher-window-sampler", daemon=True)
+    thread.start()
+
+    while True:
+        # Wake up every now and then, signal handlers only run between waits
+        sample = queue.get(timeout=0.5)
+        if sample is None:
+            if stop.is_set():
+                break
+            continue
+        send_timed(sample)
+
+    thread.join(timeout=1.0)
+    if thread.is_alive():
+        logger.warning("Sampler thread didn't stop, leaving it behind")
+    # What the sample loop put while it was stopping, after the last get
+    while True:
+        sample = queue.get(timeout=0.0)
+        if sample is None:
+            break
+        send_timed(sample)
@@ -0,0 +1,137 @@
+import time
+from bisect import bisect_left
+from typing import Callable, Sequence
+
+
+class AdaptivePollInterval:
+    """
+    Polls fast right after the window changed, and backs off geometrically while it stays the same.
+
+    The interval starts at *min_interval*, is multiplied by *backoff* for every poll that saw
+    no change, is capped at *max_interval*, and drops back to *min_interval* on a change.
+    A switch is therefore detected within *max_interval* seconds at worst. With
+    ``min_interval == max_interval`` this is a plain fixed interval.
+    """
+
+    def __init__(self, min_interval: float, max_interval: float, backoff: float = 2.0):
+        if max_interval < min_interval:
+            raise ValueError("max_interval must be at least min_interval")
+        if backoff < 1.0:
+            raise ValueError("backoff must be at least 1")
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+
+    def next(self, changed: bool) -> float:
+        """Returns the interval to wait before the next poll, given whether the last poll saw a change."""
+        if changed:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+        return self.interval
+
+
+class Histogram:
+    """A fixed-bucket histogram, cheap enough to update on every poll."""
+
+    # Upper bounds in seconds, the last bucket catches everything above
+    DEFAULT_BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+
+    def __init__(self, bounds: Sequence[float] = DEFAULT_BOUNDS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """
+        Returns an upper bound for the *q* quantile, i.e. the upper bound of the bucket it falls in.
+
+        Values above the last bucket bound are reported as the largest value seen.
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def stats(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+        }
+
+
+class Scheduler:
+    """
+    Runs ticks on deadlines on a monotonic clock, instead of sleeping a fixed time after the work.
+
+    ``sleep(poll_time)`` after each poll makes every iteration last poll_time plus the time
+    the poll took, which drifts and is what pushes heartbeat gaps past pulsetime on loaded
+    machines (see compute_pulsetime). Here each deadline is the previous deadline plus the
+    interval. If we're already past a deadline we run right away, and if whole intervals
+    were missed (suspend, a hung X call) those ticks are skipped rather than run in a burst.
+
+    How late each tick woke up is recorded in ``lateness``, and pulsetime() uses it.
+    """
+
+    def __init__(
+        self,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.clock = clock
+        self.sleep = sleep
+        self.deadline = clock()
+        self.lateness = Histogram()
+        self.skipped = 0
+
+    def wait(self, interval: float) -> None:
+        """Waits until the next tick, *interval* seconds after the previous one."""
+        delay = self.advance(interval)
+        if delay > 0:
+            self.sleep(delay)
+        self.woke()
+
+    def advance(self, interval: float) -> float:
+        """
+        Moves on to the next tick, *interval* seconds after the previous one, and returns
+        how long to sleep until then. For callers that sleep themselves (e.g. with
+        ``await asyncio.sleep()``), who then call woke().
+        """
+        self.deadline += interval
+        now = self.clock()
+        if now >= self.deadline:
+            missed = int((now - self.deadline) // interval) if interval > 0 else 0
+            self.deadline += missed * interval
+            self.skipped += missed
+            return 0.0
+        return self.deadline - now
+
+    def woke(self) -> None:
+        """Records how late the current tick was woken up."""
+        self.lateness.add(max(0.0, self.clock() - self.deadline))
+
+    def pulsetime(self, interval: float, minimum: float) -> float:
+        """
+        Pulsetime for heartbeats sent *interval* seconds apart by this scheduler.
+
+        Never less than *minimum* (i.e. compute_pulsetime(interval)), but grows when ticks
+        are observed to run late, so that the gap between two heartbeats stays within it.
+        """
+        return max(minimum, interval + 2 * self.lateness.quantile(0.99))
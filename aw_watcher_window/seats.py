@@ -0,0 +1,237 @@
+"""
+Watching several X displays from one process, for hosts with a seat (an X server,
+e.g. of a thin client) per user, configured with ``--displays``.
+
+Every seat gets a connection of its own (XConnection) and a bucket of its own, while
+the interpreter, the client, the transform cache and the interned strings are shared.
+A seat costs a connection and a few small objects rather than a watcher process.
+
+All seats are sampled from one loop: seats_loop polls them on the same ticks, and
+seats_event_loop waits on all their connections at once (see wait_any).
+"""
+
+import logging
+import os
+import re
+from datetime import datetime, timezone
+from functools import partial
+from time import monotonic
+from typing import Callable, Iterable, List, Optional
+
+from .exceptions import FatalError
+from .heartbeat import HeartbeatCoalescer
+from .lib import window_info_from_x
+from .pipeline import compute_pulsetime, fetch_window_from, send_sample, transform_window
+from .sampler import Sample
+from .schedule import AdaptivePollInterval, Scheduler
+from .transform_cache import TransformCache
+from .window import WindowInfo
+from .xlib_events import ActiveWindowWatcher, wait_any
+from .xlib_watchdog import StalledCallError
+
+logger = logging.getLogger(__name__)
+
+_now = partial(datetime.now, timezone.utc)
+
+
+def seat_bucket_id(bucket_id: str, display_name: str) -> str:
+    """The bucket of the seat on *display_name*, e.g. ``<bucket_id>_display-10`` for ":10"."""
+    return f"{bucket_id}_display-{re.sub(r'[^0-9A-Za-z.]+', '-', display_name).strip('-')}"
+
+
+class Seat:
+    """A display, its connection (an XConnection) and the coalescer its heartbeats go through."""
+
+    def __init__(self, connection, coalescer: HeartbeatCoalescer):
+        self.connection = connection
+        self.coalescer = coalescer
+        self.last_window: Optional[WindowInfo] = None
+        self.last_sample = float("-inf")
+        self._watcher: Optional[ActiveWindowWatcher] = None
+
+    @property
+    def name(self) -> str:
+        return self.connection.name
+
+    def fetch_window(self) -> Optional[WindowInfo]:
+        """Like fetch_current_window, for this seat."""
+        return fetch_window_from(
+            lambda: window_info_from_x(self.connection.get_current_window_info())
+        )
+
+    def watcher(self) -> ActiveWindowWatcher:
+        """The watcher of the connection, a new one if it was rebuilt since (see XWatchdog)."""
+        if self._watcher is None or self._watcher.dispatcher is not self.connection.dispatcher:
+            self._watcher = self.connection.active_window_watcher()
+        return self._watcher
+
+
+def open_seats(
+    client,
+    bucket_id: str,
+    event_type: str,
+    display_names: Iterable[str],
+    coalesce_time: float = 0.0,
+    connect: Optional[Callable] = None,
+) -> List[Seat]:
+    """
+    Connects to every display in *display_names*, creating the bucket of each seat.
+    Displays that can't be connected to are logged and left out.
+    """
+    if connect is None:
+        from .xlib import XConnection
+
+        connect = XConnection
+
+    seats = []
+    for name in display_names:
+        try:
+            connection = connect(name)
+        except Exception:
+            logger.exception(f"Unable to connect to display {name}, not watching it")
+            continue
+        seat_bucket = seat_bucket_id(bucket_id, name)
+        client.create_bucket(seat_bucket, event_type, queued=True)
+        seats.append(Seat(connection, HeartbeatCoalescer(client, seat_bucket, coalesce_time)))
+        logger.info(f"Watching display {name} into {seat_bucket}")
+    return seats
+
+
+def _orphaned() -> bool:
+    if os.getppid() == 1:
+        logger.info("window-watcher stopped because parent process died")
+        return True
+    return False
+
+
+def _fetch(seat: Seat, seats: List[Seat]) -> Optional[WindowInfo]:
+    try:
+        return seat.fetch_window()
+    except FatalError:
+        logger.warning(f"Lost the connection to display {seat.name}, no longer watching it")
+        seats.remove(seat)
+        return None
+
+
+def _watch(seat: Seat, seats: List[Seat]) -> Optional[ActiveWindowWatcher]:
+    """Like _fetch, for the watcher of *seat*. None if it was dropped or stalled."""
+    try:
+        return seat.watcher()
+    except StalledCallError:
+        # The watchdog rebuilt the connection, the next round makes a watcher on the new one
+        return None
+    except FatalError:
+        logger.warning(f"Lost the connection to display {seat.name}, no longer watching it")
+        seats.remove(seat)
+        return None
+
+
+def _finish(seats: Iterable[Seat], transform: TransformCache, pulsetime: float) -> None:
+    for seat in seats:
+        seat.coalescer.flush(pulsetime)
+        logger.info(f"Heartbeat coalescing for {seat.name}: {seat.coalescer.stats()}")
+    logger.info(f"Transform cache: {transform.stats()}")
+
+
+def seats_loop(
+    seats: Iterable[Seat],
+    poll_time: float,
+    max_poll_time: Optional[float] = None,
+    scheduler: Optional[Scheduler] = None,
+    now: Callable[[], datetime] = _now,
+    **transform_config,
+) -> None:
+    """
+    Polls the window of every seat every *poll_time* seconds, like heartbeat_loop,
+    backing off towards *max_poll_time* while none of them changes. A seat whose
+    connection is lost is dropped, the loop ends when none are left.
+    """
+    all_seats = list(seats)
+    seats = list(all_seats)
+    poll_interval = AdaptivePollInterval(poll_time, max(poll_time, max_poll_time or 0))
+    if scheduler is None:
+        scheduler = Scheduler()
+    transform = TransformCache(transform_window)
+
+    interval = poll_interval.min_interval
+    try:
+        while seats and not _orphaned():
+            pulsetime = scheduler.pulsetime(interval, compute_pulsetime(interval))
+            changed = False
+            for seat in list(seats):
+                window = _fetch(seat, seats)
+                if window is None:
+                    continue
+                changed = changed or window != seat.last_window
+                seat.last_window = window
+                sample = Sample(window, now(), pulsetime)
+                send_sample(seat.coalescer, transform, sample, **transform_config)
+            if not seats:
+                break
+
+            interval = poll_interval.next(changed)
+            scheduler.wait(interval)
+    finally:
+        _finish(all_seats, transform, compute_pulsetime(poll_time))
+
+
+def seats_event_loop(
+    seats: Iterable[Seat],
+    keepalive_time: float,
+    now: Callable[[], datetime] = _now,
+    clock: Callable[[], float] = monotonic,
+    **transform_config,
+) -> None:
+    """
+    Like event_loop, for every seat: waits on all their connections at once and samples
+    the seats that saw a change, and every seat not sampled for *keepalive_time* seconds.
+    A seat whose connection is lost is dropped, the loop ends when none are left.
+    """
+    all_seats = list(seats)
+    seats = list(all_seats)
+    pulsetime = compute_pulsetime(keepalive_time)
+    transform = TransformCache(transform_window)
+
+    due = list(seats)
+    try:
+        while seats and not _orphaned():
+            for seat in due:
+                seat.last_sample = clock()
+                window = _fetch(seat, seats)
+                if window is None:
+                    continue
+                timestamp = now()
+                if seat.last_window is not None and seat.last_window != window:
+                    # Samples are sparse in this mode, so extend the previous window
+                    # up to the switch before starting the new one.
+                    sample = Sample(seat.last_window, timestamp, pulsetime)
+                    send_sample(seat.coalescer, transform, sample, **transform_config)
+                seat.last_window = window
+                sample = Sample(window, timestamp, pulsetime)
+                send_sample(seat.coalescer, transform, sample, **transform_config)
+            if not seats:
+                break
+
+            watchers = {}
+            # A seat whose watcher stalled may have missed a change, it is sampled right away
+            due = []
+            for seat in list(seats):
+                watcher = _watch(seat, seats)
+                if watcher is not None:
+                    watchers[watcher] = seat
+                elif seat in seats:
+                    due.append(seat)
+            if not seats:
+                break
+
+            next_keepalive = min(seat.last_sample for seat in seats) + keepalive_time
+            timeout = 0.0 if due else max(next_keepalive - clock(), 0.0)
+            changed = wait_any(list(watchers), timeout)
+            due += [watchers[watcher] for watcher in changed]
+            due += [
+                seat
+                for seat in seats
+                if seat not in due and clock() - seat.last_sample >= keepalive_time
+            ]
+    finally:
+        _finish(all_seats, transform, pulsetime)
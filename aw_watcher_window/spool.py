@@ -0,0 +1,354 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import requests
+from aw_core.models import Event
+
+logger = logging.getLogger(__name__)
+
+# Roughly 100 bytes per span, and a span per window switch
+DEFAULT_MAX_SPANS = 100_000
+
+# Without a backlog to drain, the write-ahead log is only checkpointed past this size
+MAX_WAL_BYTES = 4 * 1024 * 1024
+
+# Times are stored as integer microseconds, so they come back exactly as they went in
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+class Span(NamedTuple):
+    id: int
+    bucket_id: str
+    timestamp: int
+    duration: int
+    data: str
+    pulsetime: float
+    sent_duration: Optional[int]
+
+    def to_event(self) -> Event:
+        return Event(
+            timestamp=EPOCH + self.timestamp * MICROSECOND,
+            duration=self.duration * MICROSECOND,
+            data=json.loads(self.data),
+        )
+
+
+class Spool:
+    """
+    Durable store of heartbeats waiting to be sent, in an SQLite database in WAL mode.
+
+    Heartbeats are merged into spans on the way in, by the rules aw-server uses for
+    heartbeats, so being offline for a day costs a row per window switch rather than
+    one per poll. The server gets the same events as it would have made of the
+    heartbeats in each span.
+
+    The last span of each bucket (its tail) can still grow, and stays in the spool until
+    a newer span follows it. At most *max_spans* are kept, the oldest are dropped.
+    """
+
+    def __init__(self, path: str, max_spans: int = DEFAULT_MAX_SPANS):
+        if max_spans <= 0:
+            raise ValueError("max_spans must be positive")
+        self.path = path
+        self.max_spans = max_spans
+        self.dropped = 0
+        # Spans sent and deleted, over the lifetime of this object
+        self.removed = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Durable across a crash of the watcher, only a power loss can lose the last commits
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS spans (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                bucket_id TEXT NOT NULL,
+                timestamp INTEGER NOT NULL,
+                duration INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                pulsetime REAL NOT NULL,
+                sent_duration INTEGER
+            )
+            """
+        )
+        self._conn.commit()
+        self._tails: Dict[str, Span] = {}
+        for row in self._conn.execute(
+            "SELECT * FROM spans WHERE id IN (SELECT MAX(id) FROM spans GROUP BY bucket_id)"
+        ):
+            span = Span(*row)
+            self._tails[span.bucket_id] = span
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM spans").fetchone()[0]
+
+    def add(self, bucket_id: str, event: Event, pulsetime: float) -> None:
+        timestamp = (event.timestamp - EPOCH) // MICROSECOND
+        end = timestamp + event.duration // MICROSECOND
+        data = json.dumps(event.data, sort_keys=True)
+        pulseperiod = timedelta(seconds=pulsetime) // MICROSECOND
+
+        with self._lock:
+            tail = self._tails.get(bucket_id)
+            if (
+                tail is not None
+                and tail.data == data
+                and tail.timestamp <= timestamp <= tail.timestamp + tail.duration + pulseperiod
+            ):
+                duration = max(tail.duration, end - tail.timestamp)
+                if duration != tail.duration:
+                    self._conn.execute("UPDATE spans SET duration = ? WHERE id = ?", (duration, tail.id))
+                    self._tails[bucket_id] = tail._replace(duration=duration)
+            else:
+                cursor = self._conn.execute(
+                    "INSERT INTO spans (bucket_id, timestamp, duration, data, pulsetime) VALUES (?, ?, ?, ?, ?)",
+                    (bucket_id, timestamp, end - timestamp, data, pulsetime),
+                )
+                # Set after every successful INSERT
+                assert cursor.lastrowid is not None
+                self._tails[bucket_id] = Span(
+                    cursor.lastrowid, bucket_id, timestamp, end - timestamp, data, pulsetime, None
+                )
+                self._enforce_cap()
+            self._conn.commit()
+
+    def _tail_ids(self) -> List[int]:
+        return [tail.id for tail in self._tails.values()]
+
+    def _enforce_cap(self) -> None:
+        count = self._conn.execute("SELECT COUNT(*) FROM spans").fetchone()[0]
+        excess = count - self.max_spans
+        if excess > 0:
+            tails = self._tail_ids()
+            self._conn.execute(
+                f"""
+                DELETE FROM spans WHERE id IN (
+                    SELECT id FROM spans WHERE id NOT IN ({",".join("?" * len(tails))})
+                    ORDER BY id LIMIT ?
+                )
+                """,
+                (*tails, excess),
+            )
+            self.dropped += excess
+            logger.warning(f"Spool is full ({self.max_spans} spans), dropped the oldest {excess}")
+
+    def pending(self, limit: int) -> List[Span]:
+        """The oldest *limit* spans that still have to be sent, in order."""
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT * FROM spans
+                WHERE sent_duration IS NULL OR sent_duration != duration
+                ORDER BY id LIMIT ?
+                """,
+                (limit,),
+            ).fetchall()
+        return [Span(*row) for row in rows]
+
+    def is_tail(self, span: Span) -> bool:
+        """Whether *span* is the last of its bucket, and so may still grow."""
+        with self._lock:
+            tail = self._tails.get(span.bucket_id)
+            return tail is not None and tail.id == span.id
+
+    def mark_sent(self, *spans: Span) -> None:
+        """Records that *spans* were sent as they were read. They may have grown since."""
+        with self._lock:
+            for span in spans:
+                tail = self._tails.get(span.bucket_id)
+                if tail is not None and tail.id == span.id:
+                    # Still growing, keep it to send it again when it does
+                    self._conn.execute(
+                        "UPDATE spans SET sent_duration = ? WHERE id = ?", (span.duration, span.id)
+                    )
+                    self._tails[span.bucket_id] = tail._replace(sent_duration=span.duration)
+                else:
+                    # A finished span, unless it was extended after we read it
+                    self.removed += self._conn.execute(
+                        "DELETE FROM spans WHERE id = ? AND duration = ?", (span.id, span.duration)
+                    ).rowcount
+                    self._conn.execute(
+                        "UPDATE spans SET sent_duration = ? WHERE id = ?", (span.duration, span.id)
+                    )
+            self._conn.commit()
+
+    def wal_size(self) -> int:
+        """The size of the write-ahead log in bytes."""
+        try:
+            return os.path.getsize(self.path + "-wal")
+        except OSError:
+            return 0
+
+    def checkpoint(self) -> None:
+        """Writes the write-ahead log into the database file, and empties it."""
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def compact(self) -> None:
+        """Gives space left by sent spans back to the filesystem."""
+        with self._lock:
+            free_pages = self._conn.execute("PRAGMA freelist_count").fetchone()[0]
+            total_pages = self._conn.execute("PRAGMA page_count").fetchone()[0]
+            if free_pages > 100 and free_pages > total_pages // 2:
+                self._conn.execute("VACUUM")
+        # In WAL mode, nothing reaches the database file before a checkpoint
+        self.checkpoint()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class SpoolingClient:
+    """
+    Stands in for ActivityWatchClient where heartbeats are sent (e.g. HeartbeatCoalescer).
+
+    Heartbeats are written to a Spool, and sent from there in batches by a background
+    thread (see start()) while the server is reachable. While it isn't, nothing is lost
+    and memory doesn't grow: the spans wait on disk, also across restarts.
+    """
+
+    def __init__(
+        self,
+        client,
+        spool: Spool,
+        flush_interval: float = 5.0,
+        max_retry_interval: float = 60.0,
+        batch_size: int = 500,
+    ):
+        self.client = client
+        self.spool = spool
+        self.flush_interval = flush_interval
+        self.max_retry_interval = max_retry_interval
+        self.batch_size = batch_size
+        self.sent = 0
+        self.requests = 0
+        self._event_types: Dict[str, str] = {}
+        self._created: set = set()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def create_bucket(self, bucket_id: str, event_type: str, queued: bool = True) -> None:
+        """The bucket is created (if needed) before the first span is sent to it."""
+        self._event_types[bucket_id] = event_type
+
+    def heartbeat(self, bucket_id: str, event: Event, pulsetime: float, queued: bool = True) -> None:
+        self.spool.add(bucket_id, event, pulsetime)
+
+    def _ensure_bucket(self, bucket_id: str) -> None:
+        if bucket_id not in self._created and bucket_id in self._event_types:
+            self.client.create_bucket(bucket_id, self._event_types[bucket_id], queued=False)
+            self._created.add(bucket_id)
+
+    def _deliver(self, send: Callable[[], None], spans: List[Span]) -> bool:
+        """
+        Sends *spans* with *send*, one request. Returns False if the server couldn't be
+        reached, the spans are then left in the spool.
+        """
+        if not spans:
+            return True
+        try:
+            self._ensure_bucket(spans[0].bucket_id)
+            send()
+            self.requests += 1
+        except requests.HTTPError as e:
+            if e.response is not None and 400 <= e.response.status_code < 500:
+                # The server won't take them now or later, don't let them block the rest
+                logger.error(f"Server rejected {len(spans)} spooled event(s), dropping them: {e}")
+            else:
+                self._created.clear()
+                return False
+        except (requests.RequestException, OSError) as e:
+            logger.debug(f"Server unreachable, keeping events spooled: {e}")
+            self._created.clear()
+            return False
+        self.spool.mark_sent(*spans)
+        self.sent += len(spans)
+        return True
+
+    def _insert(self, spans: List[Span]) -> bool:
+        return self._deliver(
+            lambda: self.client.insert_events(spans[0].bucket_id, [span.to_event() for span in spans]),
+            spans,
+        )
+
+    def _heartbeat(self, span: Span) -> bool:
+        return self._deliver(
+            lambda: self.client.heartbeat(
+                span.bucket_id, span.to_event(), pulsetime=span.pulsetime, queued=False
+            ),
+            [span],
+        )
+
+    def _flush_bucket(self, spans: List[Span]) -> bool:
+        """
+        Sends the pending *spans* of one bucket, in order. Finished spans never sent are
+        inserted as they are, in one request. A span partly sent before, or the tail
+        that may still grow, is sent as a heartbeat for the server to merge with what it
+        has; the events before it go first, as the server merges with its newest event.
+        """
+        finished: List[Span] = []
+        for span in spans:
+            if span.sent_duration is None and not self.spool.is_tail(span):
+                finished.append(span)
+                continue
+            if not (self._insert(finished) and self._heartbeat(span)):
+                return False
+            finished = []
+        return self._insert(finished)
+
+    def flush(self) -> bool:
+        """Sends everything pending, in batches. Returns False if the server couldn't be reached."""
+        removed = self.spool.removed
+        try:
+            while True:
+                spans = self.spool.pending(self.batch_size)
+                if not spans:
+                    return True
+                by_bucket: Dict[str, List[Span]] = {}
+                for span in spans:
+                    by_bucket.setdefault(span.bucket_id, []).append(span)
+                for bucket_spans in by_bucket.values():
+                    if not self._flush_bucket(bucket_spans):
+                        return False
+        finally:
+            if self.spool.removed > removed:
+                # Finished spans were sent and deleted, there is space to give back
+                self.spool.compact()
+            elif self.spool.wal_size() > MAX_WAL_BYTES:
+                self.spool.checkpoint()
+
+    def _run(self) -> None:
+        interval = self.flush_interval
+        while not self._stop.wait(interval):
+            if self.flush():
+                interval = self.flush_interval
+            else:
+                interval = min(interval * 2, self.max_retry_interval)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="aw-watcher-window-spool", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops the background thread, after one last attempt to send everything."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self.spool),
+            "sent": self.sent,
+            "requests": self.requests,
+            "dropped": self.spool.dropped,
+        }
@@ -0,0 +1,193 @@
+"""
+A low-frequency sampling profiler for ``--profile``, to find where a long-running
+watcher spends its CPU without restarting it under cProfile.
+
+A thread looks at the stacks of every other thread a few times a second and counts
+them. The counts are written as collapsed stacks (``thread;module:function;... count``
+per line, the input of flamegraph.pl, speedscope and the like) to a new file in the
+profile directory every rotation interval, and on SIGUSR1. Only the newest files are kept.
+
+The cost is one walk over each thread's frames per sample, so it is bounded by the
+sample rate, and the interpreter isn't traced between samples.
+"""
+
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from types import CodeType, FrameType
+from typing import Any, Callable, Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RATE = 5.0
+DEFAULT_ROTATE_INTERVAL = 3600.0
+DEFAULT_KEEP = 24
+# Deeper frames are cut off, so a runaway recursion can't make a sample expensive
+MAX_DEPTH = 128
+
+FILE_PREFIX = "aw-watcher-window-"
+FILE_SUFFIX = ".folded"
+
+
+def _label(code: CodeType, frame: FrameType) -> str:
+    module = frame.f_globals.get("__name__") or os.path.basename(code.co_filename)
+    return f"{module}:{code.co_name}"
+
+
+class StackSampler:
+    """
+    Samples the stacks of all other threads *rate* times a second, writing them to
+    *directory* every *rotate_interval* seconds and keeping the newest *keep* files.
+
+    start() and stop() run the sampling thread, dump() writes what was sampled since
+    the last file right away. With *dump_signal* (SIGUSR1 by default, where there is
+    one), receiving it dumps too.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        rate: float = DEFAULT_RATE,
+        rotate_interval: float = DEFAULT_ROTATE_INTERVAL,
+        keep: int = DEFAULT_KEEP,
+        dump_signal: Optional[int] = getattr(signal, "SIGUSR1", None),
+        clock: Callable[[], float] = time.monotonic,
+        now: Callable[[], datetime] = datetime.now,
+    ):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.directory = directory
+        self.interval = 1.0 / rate
+        self.rotate_interval = rotate_interval
+        self.keep = keep
+        self.dump_signal = dump_signal
+        self.clock = clock
+        self.now = now
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.files_written = 0
+        self._labels: Dict[CodeType, str] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._dump_requested = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._previous_handler: Union[Callable[[int, Optional[FrameType]], Any], int, None] = None
+        self._handling_signal = False
+
+    def sample(self) -> None:
+        """Takes one sample of every thread but the calling one."""
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        labels = self._labels
+        stacks = []
+        frame: Optional[FrameType]
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack: List[str] = []
+            current: Optional[FrameType] = frame
+            while current is not None and len(stack) < MAX_DEPTH:
+                code = current.f_code
+                label = labels.get(code)
+                if label is None:
+                    label = labels[code] = _label(code, current)
+                stack.append(label)
+                current = current.f_back
+            stack.append(names.get(ident, str(ident)))
+            stacks.append(";".join(reversed(stack)))
+        # Frames hold on to their locals, don't keep them alive until the next sample
+        frame = current = None
+        with self._lock:
+            self.stacks.update(stacks)
+            self.samples += 1
+
+    def dump(self) -> Optional[str]:
+        """
+        Writes the stacks sampled since the last file to a new one and starts counting
+        afresh. Returns its path, or None if nothing was sampled.
+        """
+        with self._lock:
+            stacks, self.stacks = self.stacks, Counter()
+        if not stacks:
+            return None
+
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{FILE_PREFIX}{self.now():%Y%m%d-%H%M%S}-{self.files_written:04d}{FILE_SUFFIX}"
+        path = os.path.join(self.directory, name)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf8") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        # Never leave a half-written profile behind
+        os.replace(tmp_path, path)
+        self.files_written += 1
+        self._remove_old_files()
+        logger.info(f"Wrote profile to {path}")
+        return path
+
+    def _remove_old_files(self) -> None:
+        files = sorted(
+            name
+            for name in os.listdir(self.directory)
+            if name.startswith(FILE_PREFIX) and name.endswith(FILE_SUFFIX)
+        )
+        for name in files[: max(len(files) - self.keep, 0)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                logger.warning(f"Failed to remove old profile {name}")
+
+    def run(self) -> None:
+        """Samples until stop(), writing files on rotation and when asked to."""
+        next_sample = next_rotation = self.clock()
+        next_rotation += self.rotate_interval
+        while not self._stop.is_set():
+            self._dump_requested.wait(max(next_sample - self.clock(), 0))
+            now = self.clock()
+            if self._dump_requested.is_set():
+                self._dump_requested.clear()
+                self._dump_safely()
+            if now >= next_sample:
+                self.sample()
+                # Don't catch up on samples missed while suspended, like Scheduler
+                next_sample = max(next_sample + self.interval, now)
+            if now >= next_rotation:
+                self._dump_safely()
+                next_rotation = now + self.rotate_interval
+
+    def _dump_safely(self) -> None:
+        try:
+            self.dump()
+        except OSError:
+            logger.exception("Failed to write profile")
+
+    def request_dump(self) -> None:
+        """Has the sampling thread write a file, e.g. from a signal handler."""
+        self._dump_requested.set()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self.run, name="aw-watcher-window-profiler", daemon=True)
+        self._thread.start()
+        if self.dump_signal is not None and threading.current_thread() is threading.main_thread():
+            self._previous_handler = signal.signal(
+                self.dump_signal, lambda signum, frame: self.request_dump()
+            )
+            self._handling_signal = True
+        logger.info(f"Profiling at {1 / self.interval:g} samples/s into {self.directory}")
+
+    def stop(self) -> None:
+        """Stops sampling and writes what was sampled since the last file."""
+        if self._handling_signal:
+            signal.signal(self.dump_signal, self._previous_handler)  # type: ignore
+            self._handling_signal = False
+        self._stop.set()
+        self._dump_requested.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._dump_safely()
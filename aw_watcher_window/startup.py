@@ -0,0 +1,121 @@
+"""
+Startup profiling for ``--profile-startup``: how long each step of starting the
+watcher takes, and which imports that time went to.
+
+Imports are timed by wrapping ``builtins.__import__``, so only modules imported while
+profiling show up, each with its own time and its time including the imports it
+triggered, like ``python -X importtime``.
+"""
+
+import builtins
+import importlib.util
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, ContextManager, List, NamedTuple, Optional
+
+
+class ImportTiming(NamedTuple):
+    name: str
+    # Nesting depth, 0 for an import made by the profiled code itself
+    depth: int
+    self_seconds: float
+    cumulative_seconds: float
+
+
+def _absolute_name(name: str, globals: Optional[dict], level: int) -> str:
+    if not level:
+        return name
+    package = (globals or {}).get("__package__") or ""
+    try:
+        return importlib.util.resolve_name("." * level + name, package)
+    except (ImportError, ValueError):
+        return "." * level + name
+
+
+class StartupProfiler:
+    """
+    Times the named steps of startup, and the imports made during them.
+
+    Disabled (the default), step() is a no-op and nothing is wrapped, so it can be
+    left in place.
+    """
+
+    def __init__(self, enabled: bool = False, clock: Callable[[], float] = time.perf_counter):
+        self.enabled = enabled
+        self.clock = clock
+        self.steps: List[tuple] = []
+        self.imports: List[ImportTiming] = []
+        self._original_import: Optional[Callable] = None
+        self._stack: List[float] = []  # time spent in nested imports, per level
+
+    def step(self, name: str) -> ContextManager:
+        if not self.enabled:
+            return nullcontext()
+        return self._step(name)
+
+    @contextmanager
+    def _step(self, name: str):
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.steps.append((name, self.clock() - start))
+
+    def start(self) -> None:
+        """Starts timing imports."""
+        if not self.enabled or self._original_import is not None:
+            return
+        self._original_import = original = builtins.__import__
+
+        def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+            if level == 0 and not fromlist and name in sys.modules:
+                return original(name, globals, locals, fromlist, level)
+            loaded = len(sys.modules)
+            self._stack.append(0.0)
+            start = self.clock()
+            try:
+                return original(name, globals, locals, fromlist, level)
+            finally:
+                elapsed = self.clock() - start
+                nested = self._stack.pop()
+                if self._stack:
+                    self._stack[-1] += elapsed
+                # Only imports that loaded something are worth reporting
+                if len(sys.modules) > loaded:
+                    self.imports.append(
+                        ImportTiming(
+                            _absolute_name(name, globals, level),
+                            len(self._stack),
+                            elapsed - nested,
+                            elapsed,
+                        )
+                    )
+
+        builtins.__import__ = timed_import
+
+    def stop(self) -> None:
+        """Stops timing imports."""
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+    def report(self, top: int = 15) -> str:
+        lines = ["Startup steps:"]
+        for name, seconds in self.steps:
+            lines.append(f"  {seconds * 1000:9.1f} ms  {name}")
+        total = sum(seconds for _, seconds in self.steps)
+        lines.append(f"  {total * 1000:9.1f} ms  total")
+
+        slowest = sorted(
+            (timing for timing in self.imports if timing.depth == 0),
+            key=lambda timing: timing.cumulative_seconds,
+            reverse=True,
+        )[:top]
+        if slowest:
+            lines.append("Slowest imports (self, cumulative):")
+            for timing in slowest:
+                lines.append(
+                    f"  {timing.self_seconds * 1000:9.1f} ms {timing.cumulative_seconds * 1000:9.1f} ms  {timing.name}"
+                )
+        return "\n".join(lines)
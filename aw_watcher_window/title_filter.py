@@ -0,0 +1,115 @@
+"""
+Matching window titles against the ``exclude_titles`` patterns in a single scan.
+
+Searching every title with every pattern one by one gets expensive with hundreds of
+patterns, and Python's ``re`` doesn't get any faster when they're simply joined into
+one alternation. What does help is a prefilter: almost every pattern contains a run
+of literal characters that any match must include. Those literals are compiled into
+one trie-shaped regex, which ``re`` can scan in a single pass since every branch
+starts with a different character. Only when the prefilter hits (rare, most titles
+aren't excluded) do we run the actual patterns.
+
+The prefilter is case-insensitive and only looks at literals that are required for a
+match, so it never rejects a title that one of the patterns would have matched.
+"""
+
+import re
+from typing import Dict, List, Optional, Pattern, Sequence
+
+try:
+    from re import _parser as sre_parse  # type: ignore  # Python 3.11+
+except ImportError:
+    import sre_parse  # type: ignore
+
+# Shorter literals would let too many titles through the prefilter to be useful
+MIN_LITERAL_LENGTH = 3
+# Any part of a required literal is required as well, no need for huge tries
+MAX_LITERAL_LENGTH = 32
+
+
+def _longest_literal_run(items) -> str:
+    best = ""
+    run: List[str] = []
+    for op, av in list(items) + [(None, None)]:
+        if op is sre_parse.LITERAL:
+            run.append(chr(av))
+        else:
+            if len(run) > len(best):
+                best = "".join(run)
+            run = []
+    return best
+
+
+def required_literals(pattern: Pattern) -> Optional[List[str]]:
+    """
+    Returns literals of which every match of *pattern* contains at least one, or None
+    if no useful ones could be found.
+    """
+    if not isinstance(pattern.pattern, str):
+        return None
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return None
+
+    items = list(parsed)
+    if len(items) == 1 and items[0][0] is sre_parse.BRANCH:
+        # Top-level alternation: each branch needs a literal of its own
+        _, branches = items[0][1]
+        literals = [_longest_literal_run(branch) for branch in branches]
+    else:
+        literals = [_longest_literal_run(items)]
+
+    if any(len(literal) < MIN_LITERAL_LENGTH for literal in literals):
+        return None
+    return [literal[:MAX_LITERAL_LENGTH] for literal in literals]
+
+
+def _trie_regex(literals: Sequence[str]) -> str:
+    trie: Dict[str, dict] = {}
+    for literal in literals:
+        node = trie
+        for char in literal:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: Dict[str, dict]) -> str:
+        ends_here = "" in node
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        regex = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # A literal ending here is a prefix of the others, the rest is optional
+        return f"(?:{regex})?" if ends_here else regex
+
+    return build(trie)
+
+
+class TitleFilter:
+    """Tells whether a title matches any of a list of compiled patterns."""
+
+    def __init__(self, patterns: Sequence[Pattern]):
+        self.patterns = list(patterns)
+        # Patterns behind the prefilter, and those we have to run on every title
+        self.prefiltered: List[Pattern] = []
+        self.unfiltered: List[Pattern] = []
+
+        literals: List[str] = []
+        for pattern in self.patterns:
+            pattern_literals = required_literals(pattern)
+            if pattern_literals is None:
+                self.unfiltered.append(pattern)
+            else:
+                self.prefiltered.append(pattern)
+                literals.extend(pattern_literals)
+
+        self.prefilter = re.compile(_trie_regex(literals), re.IGNORECASE) if literals else None
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+    def search(self, title: str) -> bool:
+        if self.prefilter is not None and self.prefilter.search(title):
+            if any(pattern.search(title) for pattern in self.prefiltered):
+                return True
+        return any(pattern.search(title) for pattern in self.unfiltered)
@@ -0,0 +1,270 @@
+"""
+A compact, append-only file format for recording window samples, and a streaming reader.
+
+Used by ``--record`` to capture the windows actually seen (before transform_window),
+so that performance issues can be reproduced with ``python -m aw_watcher_window.replay``.
+
+The file starts with ``MAGIC``, followed by records of a tag byte and a payload made of
+varints and length-prefixed strings:
+
+- SESSION ``time``: starts a recording session at *time* (centiseconds since the epoch),
+  and resets the string table. Each process appending to the file starts one.
+- STRING ``length bytes``: adds a UTF-8 string to the string table, as the next id (from 1).
+- WINDOW ``dt app title url``: a sample of a window, as string ids (0 for no url).
+- REPEAT ``dt``: a sample of the same window as the previous sample.
+- NONE ``dt``: a sample where no window could be fetched.
+
+*dt* is how much the time since the previous sample (in centiseconds) differs from that
+of the sample before, zigzag-encoded. Polls are evenly spaced, so this is nearly always
+a 1-byte varint, and at 1 Hz nearly every sample is a 2-byte REPEAT: a day takes a few
+hundred KB. A record cut short by a crash ends the trace when read, and is cut off when
+the file is next opened for writing.
+"""
+
+import os
+import time
+from typing import BinaryIO, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union, cast
+
+from .window import WindowInfo
+
+MAGIC = b"AWWT\x01"
+
+SESSION = 0x01
+STRING = 0x02
+WINDOW = 0x03
+REPEAT = 0x04
+NONE = 0x05
+
+# A new session (and string table) is started when the table gets this big
+MAX_STRINGS = 1 << 16
+
+
+class TraceSample(NamedTuple):
+    """The window at *timestamp* (seconds), until the next sample."""
+
+    timestamp: float
+    app: str
+    title: str
+    url: str = ""
+
+    def window(self) -> dict:
+        window = {"app": self.app, "title": self.title}
+        if self.url:
+            window["url"] = self.url
+        return window
+
+    def info(self) -> WindowInfo:
+        return WindowInfo.from_dict(self.window())
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _zigzag(value: int) -> int:
+    return value << 1 if value >= 0 else (-value << 1) - 1
+
+
+def _unzigzag(value: int) -> int:
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+
+class TraceWriter:
+    """
+    Appends window samples to a trace file.
+
+    Every sample is flushed as it is written, a crash loses at most the sample being written.
+    """
+
+    def __init__(self, path: str, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self._file: BinaryIO = open(path, "a+b")
+        # A record cut short by a crash would end the trace there, so what is appended
+        # now starts where the last complete record ends
+        self._file.truncate(_complete_length(self._file, path))
+        if self._file.seek(0, os.SEEK_END) == 0:
+            self._file.write(MAGIC)
+        self.samples = 0
+        self._start_session()
+
+    def _start_session(self) -> None:
+        self._strings: Dict[str, int] = {}
+        self._last_time = int(self.clock() * 100)
+        self._last_delta = 0
+        self._last_window: Optional[Tuple[str, str, str]] = None
+        self._file.write(bytes([SESSION]) + _varint(self._last_time))
+
+    def _string_id(self, out: bytearray, string: str) -> int:
+        string_id = self._strings.get(string)
+        if string_id is None:
+            string_id = self._strings[string] = len(self._strings) + 1
+            encoded = string.encode("utf8")
+            out += bytes([STRING]) + _varint(len(encoded)) + encoded
+        return string_id
+
+    def write(self, window: Union[WindowInfo, dict, None]) -> None:
+        """Records *window* (as returned by get_window_info or get_current_window) as sampled now."""
+        if len(self._strings) >= MAX_STRINGS:
+            self._start_session()
+
+        now = int(self.clock() * 100)
+        delta = now - self._last_time
+        dt = _varint(_zigzag(delta - self._last_delta))
+        self._last_time, self._last_delta = now, delta
+
+        out = bytearray()
+        if window is None:
+            out += bytes([NONE]) + dt
+            self._last_window = None
+        else:
+            if isinstance(window, WindowInfo):
+                key = (window.app, window.title, window.url or "")
+            else:
+                key = (window.get("app", ""), window.get("title", ""), window.get("url", "") or "")
+            if key == self._last_window:
+                out += bytes([REPEAT]) + dt
+            else:
+                app, title, url = (
+                    self._string_id(out, key[0]),
+                    self._string_id(out, key[1]),
+                    self._string_id(out, key[2]) if key[2] else 0,
+                )
+                out += bytes([WINDOW]) + dt + _varint(app) + _varint(title) + _varint(url)
+                self._last_window = key
+
+        self._file.write(out)
+        self._file.flush()
+        self.samples += 1
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self) -> "TraceWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class TruncatedRecord(Exception):
+    pass
+
+
+def _read_varint(f: BinaryIO) -> int:
+    result = shift = 0
+    while True:
+        byte = f.read(1)
+        if not byte:
+            raise TruncatedRecord()
+        result |= (byte[0] & 0x7F) << shift
+        if byte[0] < 0x80:
+            return result
+        shift += 7
+
+
+# SESSION and REPEAT/NONE carry an int, STRING a str, WINDOW a tuple of ints
+_Payload = Union[int, str, Tuple[int, ...]]
+
+
+def _read_records(f: BinaryIO, path: str) -> Iterator[Tuple[int, _Payload]]:
+    """
+    Streams ``(tag, payload)`` for the records of *f*, positioned after ``MAGIC``, up to the
+    end of the file or the record cut short there. The payload of SESSION is its time, of
+    STRING the string, of WINDOW the dt and three string ids, of REPEAT and NONE the dt.
+    """
+    try:
+        while True:
+            tag_byte = f.read(1)
+            if not tag_byte:
+                return
+            tag = tag_byte[0]
+            if tag == SESSION:
+                yield tag, _read_varint(f)
+            elif tag == STRING:
+                length = _read_varint(f)
+                data = f.read(length)
+                if len(data) < length:
+                    raise TruncatedRecord()
+                yield tag, data.decode("utf8")
+            elif tag == WINDOW:
+                yield tag, tuple(_read_varint(f) for _ in range(4))
+            elif tag in (REPEAT, NONE):
+                yield tag, _read_varint(f)
+            else:
+                raise ValueError(f"Unknown record tag {tag:#x} in {path}")
+    except TruncatedRecord:
+        # The writer was interrupted mid-record, everything before it is fine
+        return
+
+
+def read_samples(path: str) -> Iterator[Tuple[float, Optional[TraceSample]]]:
+    """
+    Streams ``(timestamp, sample)`` pairs from a trace file, *sample* being None where no
+    window could be fetched. Only one record is held in memory at a time.
+    """
+    with open(path, "rb", buffering=64 * 1024) as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a trace file")
+
+        strings: List[str] = [""]
+        now = delta = 0
+        last: Optional[TraceSample] = None
+        for tag, payload in _read_records(f, path):
+            if tag == SESSION:
+                now = cast(int, payload)
+                delta = 0
+                strings = [""]
+                last = None
+            elif tag == STRING:
+                strings.append(cast(str, payload))
+            else:
+                if tag == WINDOW:
+                    dt, *string_ids = cast(Tuple[int, ...], payload)
+                else:
+                    dt = cast(int, payload)
+                delta += _unzigzag(dt)
+                now += delta
+                timestamp = now / 100
+                if tag == WINDOW:
+                    app, title, url = (strings[i] for i in string_ids)
+                    last = TraceSample(timestamp, app, title, url)
+                elif tag == REPEAT and last is not None:
+                    last = last._replace(timestamp=timestamp)
+                else:
+                    last = None
+                yield timestamp, last
+
+
+def _complete_length(f: BinaryIO, path: str) -> int:
+    """The length of the file *f* up to the end of its last complete record."""
+    f.seek(0)
+    magic = f.read(len(MAGIC))
+    if len(magic) < len(MAGIC) and MAGIC.startswith(magic):
+        # Interrupted while writing the header
+        return 0
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a trace file")
+    end = f.tell()
+    for _ in _read_records(f, path):
+        end = f.tell()
+    return end
+
+
+def read_trace(path: str) -> Iterator[TraceSample]:
+    """Streams the samples of a trace file, skipping those where no window was fetched."""
+    for _, sample in read_samples(path):
+        if sample is not None:
+            yield sample
+
+
+def is_trace_file(path: str) -> bool:
+    if not os.path.isfile(path):
+        return False
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
@@ -0,0 +1,78 @@
+import sys
+from typing import Any, Callable, Dict, Hashable, Optional, Union
+
+from .cache import LRUCache
+from .window import WindowInfo
+
+# A day in the same few windows fits in a handful of entries, this is for the long tail
+DEFAULT_MAXSIZE = 1024
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024
+
+
+def _weigh(key: Hashable, value: Any) -> int:
+    """Rough memory held by a cache entry: dominated by the titles and URLs in it."""
+    size = sys.getsizeof(key) + sys.getsizeof(value)
+    for item in key:  # type: ignore
+        size += sys.getsizeof(item)
+        if isinstance(item, tuple):
+            size += sum(sys.getsizeof(part) for part in item)
+    for part in value.values():
+        size += sys.getsizeof(part)
+    return size
+
+
+class TransformCache:
+    """
+    Memoizes a window transform (i.e. transform_window) for windows seen before.
+
+    Called like the transform itself, with the window (a WindowInfo or a dict) and the
+    configuration as keyword arguments. Results are keyed by the WindowInfo, or the
+    dict's (key, value) pairs, and dropped
+    whenever the configuration passed differs from the previous call. Configuration
+    objects compare by identity unless they define equality, so replace exclusion and
+    category configuration rather than changing it in place.
+
+    Entries are bounded both in number and in the (estimated) bytes they hold, so a
+    long session through many unique titles can't grow the cache without limit.
+    """
+
+    def __init__(
+        self,
+        transform: Callable[..., dict],
+        maxsize: int = DEFAULT_MAXSIZE,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ):
+        self.transform = transform
+        self.cache = LRUCache(maxsize, maxweight=max_bytes, weigh=_weigh)
+        self.invalidations = 0
+        self._config: Optional[Dict[str, Any]] = None
+
+    def __call__(self, window: Union[WindowInfo, dict], **config) -> dict:
+        if config != self._config:
+            if self._config is not None:
+                self.invalidations += 1
+            self.cache.clear()
+            self._config = config
+
+        if isinstance(window, WindowInfo):
+            key: Hashable = window
+        else:
+            try:
+                key = tuple(sorted(window.items()))
+                hash(key)
+            except TypeError:
+                # Not a plain window dict, nothing to key it on
+                return self.transform(window, **config)
+
+        result = self.cache.get(key)
+        if result is None:
+            # The transform may modify the window in place
+            result = self.transform(
+                window.to_dict() if isinstance(window, WindowInfo) else dict(window), **config
+            )
+            self.cache.put(key, result)
+        # Becomes the data of an Event, which must not share it with the cache
+        return dict(result)
+
+    def stats(self) -> dict:
+        return {**self.cache.stats(), "invalidations": self.invalidations}
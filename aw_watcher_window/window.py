@@ -0,0 +1,77 @@
+"""
+The window as it goes through the watcher: sampled, compared, queued, cached and
+transformed, until it becomes the data of an Event when sent.
+
+A WindowInfo is a tuple rather than a dict, so that holding on to one costs a fraction
+of the memory, comparing two doesn't walk keys, and it can key a cache as is. Its
+strings are interned, so a window seen again shares them with every earlier sample
+instead of holding freshly decoded copies.
+"""
+
+from typing import Any, Dict, NamedTuple, Optional
+
+# Enough for every app and title of a long session, the table is reset beyond that
+DEFAULT_INTERN_SIZE = 4096
+
+
+class Interner:
+    """
+    Maps equal strings to one shared object, like sys.intern() but bounded: interned
+    strings would otherwise live as long as the process, and titles are unbounded.
+
+    When the table is full it is emptied rather than evicted from one by one, which
+    keeps lookups a single dict access. Strings still in use stay alive, they only
+    stop being shared with new copies until seen again.
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_INTERN_SIZE):
+        if maxsize <= 0:
+            raise ValueError("maxsize must be positive")
+        self.maxsize = maxsize
+        self.resets = 0
+        self._strings: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._strings)
+
+    def __call__(self, string: str) -> str:
+        interned = self._strings.get(string)
+        if interned is None:
+            if len(self._strings) >= self.maxsize:
+                self._strings.clear()
+                self.resets += 1
+            interned = self._strings[string] = string
+        return interned
+
+
+intern = Interner()
+
+
+class WindowInfo(NamedTuple):
+    """The active window. *url* and *incognito* are only known for browsers on macOS (JXA)."""
+
+    app: str
+    title: str
+    url: Optional[str] = None
+    incognito: Optional[bool] = None
+
+    @classmethod
+    def from_dict(cls, window: dict, intern: Interner = intern) -> "WindowInfo":
+        """From a get_current_window() dict, interning its strings. Other keys are dropped."""
+        url = window.get("url")
+        return cls(
+            intern(window["app"]),
+            # The JXA script leaves it out when the app has no main window
+            intern(window.get("title", "")),
+            intern(url) if url is not None else None,
+            window.get("incognito"),
+        )
+
+    def to_dict(self) -> dict:
+        """The dict get_current_window() would have returned, i.e. the Event data."""
+        window: Dict[str, Any] = {"app": self.app, "title": self.title}
+        if self.url is not None:
+            window["url"] = self.url
+        if self.incognito is not None:
+            window["incognito"] = self.incognito
+        return window
@@ -1,11 +1,19 @@
-import os
+import logging
+import ntpath
 import time
-from typing import Optional
+from typing import Callable, Optional, Sequence
 
 import win32api
 import win32gui
 import win32process
-import wmi
+
+from .cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+PROCESS_QUERY_INFORMATION = 0x0400
+# Granted for elevated processes too, where PROCESS_QUERY_INFORMATION is denied
+PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
 
 
 def get_app_path(hwnd) -> Optional[str]:
@@ -13,9 +21,13 @@ def get_app_path(hwnd) -> Optional[str]:
     path = None
 
     _, pid = win32process.GetWindowThreadProcessId(hwnd)
-    process = win32api.OpenProcess(
-        0x0400, False, pid
-    )  # PROCESS_QUERY_INFORMATION = 0x0400
+    return _get_process_path(pid)
+
+
+def _get_process_path(pid: int) -> Optional[str]:
+    path = None
+
+    process = win32api.OpenProcess(PROCESS_QUERY_INFORMATION, False, pid)
 
     try:
         path = win32process.GetModuleFileNameEx(process, 0)
@@ -32,7 +44,7 @@ def get_app_name(hwnd) -> Optional[str]:
     if path is None:
         return None
 
-    return os.path.basename(path)
+    return ntpath.basename(path)
 
 
 def get_window_title(hwnd):
@@ -46,18 +58,32 @@ def get_active_window_handle():
 
 # WMI-version, used as fallback if win32gui/win32process/win32api fails (such as for "run as admin" processes)
 
-c = wmi.WMI()
-
 """
 Much of this derived from: http://stackoverflow.com/a/14973422/965332
 """
 
+# Connecting to WMI is slow and rarely needed, so it's done on first use
+_wmi_connection = None
+
+
+def _wmi():
+    global _wmi_connection
+    if _wmi_connection is None:
+        import wmi
+
+        _wmi_connection = wmi.WMI()
+    return _wmi_connection
+
 
 def get_app_name_wmi(hwnd) -> Optional[str]:
     """Get application filename given hwnd."""
-    name = None
     _, pid = win32process.GetWindowThreadProcessId(hwnd)
-    for p in c.query("SELECT Name FROM Win32_Process WHERE ProcessId = %s" % str(pid)):
+    return _get_process_name_wmi(pid)
+
+
+def _get_process_name_wmi(pid: int) -> Optional[str]:
+    name = None
+    for p in _wmi().query("SELECT Name FROM Win32_Process WHERE ProcessId = %s" % str(pid)):
         name = p.Name
         break
     return name
@@ -68,7 +94,7 @@ def get_app_path_wmi(hwnd) -> Optional[str]:
     path = None
 
     _, pid = win32process.GetWindowThreadProcessId(hwnd)
-    for p in c.query(
+    for p in _wmi().query(
         "SELECT ExecutablePath FROM Win32_Process WHERE ProcessId = %s" % str(pid)
     ):
         path = p.ExecutablePath
@@ -77,6 +103,90 @@ def get_app_path_wmi(hwnd) -> Optional[str]:
     return path
 
 
+def _get_process_name(pid: int) -> Optional[str]:
+    path = _get_process_path(pid)
+    return ntpath.basename(path) if path is not None else None
+
+
+def get_process_start_time(pid: int) -> Optional[int]:
+    """When the process was started, as a FILETIME-like value, or None if it can't be opened."""
+    try:
+        process = win32api.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+    except Exception:
+        return None
+    try:
+        return win32process.GetProcessTimes(process)["CreationTime"]
+    except Exception:
+        return None
+    finally:
+        win32api.CloseHandle(process)
+
+
+class ProcessNameCache:
+    """
+    Executable names by PID, so the foreground process isn't looked up on every poll.
+
+    *lookups* are tried in order until one returns a name. An entry is only used while
+    the process still has the start time it had when it was cached, since PIDs are
+    reused. If no start time can be read, or no lookup found a name (e.g. WMI failing
+    for an elevated process), the result is only trusted for *ttl* seconds.
+    """
+
+    def __init__(
+        self,
+        lookups: Sequence[Callable[[int], Optional[str]]],
+        start_time: Callable[[int], Optional[int]] = get_process_start_time,
+        maxsize: int = 64,
+        ttl: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.lookups = lookups
+        self.start_time = start_time
+        self.ttl = ttl
+        self.clock = clock
+        self.cache = LRUCache(maxsize)
+        self.lookup_count = 0
+
+    def get(self, pid: int) -> Optional[str]:
+        start_time = self.start_time(pid)
+        now = self.clock()
+        entry = self.cache.get(pid)
+        if entry is not None:
+            cached_start_time, name, expires = entry
+            if cached_start_time == start_time and now < expires:
+                return name
+
+        name = self._lookup(pid)
+        trusted = name is not None and start_time is not None
+        self.cache.put(pid, (start_time, name, float("inf") if trusted else now + self.ttl))
+        return name
+
+    def _lookup(self, pid: int) -> Optional[str]:
+        self.lookup_count += 1
+        for lookup in self.lookups:
+            try:
+                name = lookup(pid)
+            except Exception as e:
+                logger.debug(f"{lookup.__name__} failed for pid {pid}: {e}")
+                continue
+            if name:
+                return name
+        return None
+
+    def stats(self) -> dict:
+        return {**self.cache.stats(), "lookups": self.lookup_count}
+
+
+# Falls back to WMI for elevated/admin processes where OpenProcess fails
+process_names = ProcessNameCache([_get_process_name, _get_process_name_wmi])
+
+
+def get_process_name(hwnd) -> Optional[str]:
+    """Get application filename given hwnd, through process_names."""
+    _, pid = win32process.GetWindowThreadProcessId(hwnd)
+    return process_names.get(pid)
+
+
 if __name__ == "__main__":
     while True:
         hwnd = get_active_window_handle()
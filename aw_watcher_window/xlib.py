@@ -1,25 +1,143 @@
 import logging
-from typing import Optional
+from contextlib import contextmanager
+from functools import partial
+from typing import Optional, Tuple
 
 import Xlib
 import Xlib.display
-from Xlib import X
+import Xlib.error
+from Xlib import X, Xatom
 from Xlib.xobject.drawable import Window
 
+from .cache import LRUCache
 from .exceptions import FatalError
+from .xlib_batch import ActiveWindowQuery
+from .xlib_events import WINDOW_EVENT_MASK, ActiveWindowWatcher, EventDispatcher
+from .xlib_watchdog import XWatchdog
 
 logger = logging.getLogger(__name__)
 
-display = Xlib.display.Display()
-screen = display.screen()
+# The connection to $DISPLAY, opened by connect() on first use rather than at import, so
+# that importing this module is cheap and has no side effects. Its parts can be read as
+# module attributes (xlib.display, xlib.dispatcher, ...), which connect if needed.
+_connection: Optional["XConnection"] = None
+_CONNECTION_ATTRIBUTES = (
+    "display",
+    "screen",
+    "dispatcher",
+    "active_window_query",
+    "NET_WM_NAME",
+    "NET_WM_PID",
+    "UTF8_STRING",
+)
 
-NET_WM_NAME = display.intern_atom("_NET_WM_NAME")
-UTF8_STRING = display.intern_atom("UTF8_STRING")
+# WM_CLASS and _NET_WM_PID practically never change over a window's lifetime, so we
+# remember them per (window id, attribute) instead of asking the X server every poll.
+# Entries are dropped on DestroyNotify (X may reuse the id) and when the property changes.
+window_cache = LRUCache(maxsize=256)
+_CACHED_ATTRIBUTES = ("class", "pid")
+_INVALIDATING_ATOMS = {Xatom.WM_CLASS: "class"}
 
 
-def _get_current_window_id() -> Optional[int]:
-    atom = display.get_atom("_NET_ACTIVE_WINDOW")
-    window_prop = screen.root.get_full_property(atom, X.AnyPropertyType)
+def _invalidating_atoms(net_wm_pid: int) -> dict:
+    # _NET_WM_PID is interned per connection, unlike the predefined WM_CLASS
+    return {**_INVALIDATING_ATOMS, net_wm_pid: "pid"}
+
+
+def _invalidate_window_cache(event, cache=window_cache, atoms=_INVALIDATING_ATOMS) -> None:
+    if event.type == X.DestroyNotify:
+        for attr in _CACHED_ATTRIBUTES:
+            cache.pop((event.window.id, attr))
+    elif event.type == X.PropertyNotify and event.atom in atoms:
+        cache.pop((event.window.id, atoms[event.atom]))
+
+
+def connect() -> "XConnection":
+    """Opens the display (from $DISPLAY) and sets up everything that uses it, if not done yet."""
+    global _connection
+    if _connection is None:
+        _connection = XConnection(window_cache=window_cache)
+    return _connection
+
+
+def disconnect() -> None:
+    """Closes the display, if connected. The next use connects again."""
+    global _connection
+    connection, _connection = _connection, None
+    # Windows are subscribed to per connection, a new one wouldn't hear of their destruction
+    window_cache.clear()
+    if connection is not None:
+        connection.close()
+
+
+def reconnect() -> None:
+    """Replaces the connection to the X server with a new one, interning the atoms again."""
+    disconnect()
+    connect()
+
+
+# Set by enable_watchdog()
+watchdog: Optional[XWatchdog] = None
+
+
+def enable_watchdog(deadline: float) -> XWatchdog:
+    """Aborts X calls that take longer than *deadline* seconds and reconnects (see XWatchdog)."""
+    global watchdog
+    if watchdog is None:
+        watchdog = XWatchdog(reconnect, deadline)
+        watchdog.start()
+    return watchdog
+
+
+@contextmanager
+def _watched(display, recover=None):
+    if watchdog is None:
+        yield
+    else:
+        with watchdog.watch(display, recover):
+            yield
+
+
+def active_window_watcher() -> ActiveWindowWatcher:
+    """
+    An ActiveWindowWatcher on the connection, whose requests the watchdog (if enabled)
+    aborts like the others. After a reconnect, it is left on the old connection: make a
+    new one when ``dispatcher`` changed.
+
+    :raises FatalError: if the X server closed the connection
+    :raises StalledCallError: if the watchdog aborted a request
+    """
+    connection = connect()
+    try:
+        return ActiveWindowWatcher(connection.dispatcher, partial(_watched, connection.display))
+    except Xlib.error.ConnectionClosedError:
+        raise _connection_closed()
+
+
+def __getattr__(name: str):
+    if name in _CONNECTION_ATTRIBUTES:
+        return getattr(connect(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _cache_window_attribute(window: Window, attr: str, value, cache: LRUCache = window_cache) -> None:
+    if not any((window.id, a) in cache for a in _CACHED_ATTRIBUTES):
+        # First time we cache anything for this window: subscribe so we hear about its
+        # destruction. This is a one-way request, so it doesn't cost a round-trip.
+        window.change_attributes(
+            event_mask=WINDOW_EVENT_MASK, onerror=Xlib.error.CatchError()
+        )
+    cache.put((window.id, attr), value)
+
+
+def window_cache_stats() -> dict:
+    """Hit/miss counters for the per-window attribute cache."""
+    return window_cache.stats()
+
+
+def _get_current_window_id(connection: "XConnection") -> Optional[int]:
+    atom = connection.display.get_atom("_NET_ACTIVE_WINDOW")
+    window_prop = connection.screen.root.get_full_property(atom, X.AnyPropertyType)
 
     if window_prop is None:
         logger.warning("window_prop was None")
@@ -31,28 +149,141 @@ def _get_current_window_id() -> Optional[int]:
     return window_id if window_id != 0 else None
 
 
-def _get_window(window_id: int) -> Window:
-    return display.create_resource_object("window", window_id)
+def _get_window(connection: "XConnection", window_id: int) -> Window:
+    return connection.display.create_resource_object("window", window_id)
 
 
 def get_current_window() -> Optional[Window]:
     """
     Returns the current window, or None if no window is active.
     """
+    connection = connect()
     try:
-        window_id = _get_current_window_id()
-        if window_id is None:
-            return None
-        else:
-            return _get_window(window_id)
+        with _watched(connection.display):
+            # Apply any pending DestroyNotify/PropertyNotify to the cache before we use it
+            connection.dispatcher.drain()
+            window_id = _get_current_window_id(connection)
+            if window_id is None:
+                return None
+            else:
+                return _get_window(connection, window_id)
+    except Xlib.error.ConnectionClosedError:
+        raise _connection_closed()
+
+
+def get_current_window_info() -> Optional[Tuple[str, str]]:
+    """
+    Returns the class and name of the current window, or None if no window is active.
+
+    Same result as get_current_window() followed by get_window_class() and
+    get_window_name(), but with the requests pipelined (see xlib_batch).
+
+    :raises StalledCallError: if the watchdog (see enable_watchdog) aborted the call
+    """
+    connection = connect()
+    try:
+        with _watched(connection.display):
+            return _query_window_info(
+                connection.display,
+                connection.dispatcher,
+                connection.active_window_query,
+                connection.window_cache,
+            )
     except Xlib.error.ConnectionClosedError:
-        # when the X server closes the connection, we should exit
-        # note that stdio is probably closed at this point, so we can't print anything (causes OSError)
+        raise _connection_closed()
+
+
+def _query_window_info(display, dispatcher, query, cache) -> Optional[Tuple[str, str]]:
+    # Apply any pending DestroyNotify/PropertyNotify to the cache before we use it
+    dispatcher.drain()
+    info = query.query()
+    if info is None:
+        return None
+
+    window = display.create_resource_object("window", info.id)
+    if info.cls is None:
+        cls = get_window_class(window, cache)
+    else:
+        cls = info.cls
+        if (info.id, "class") not in cache:
+            _cache_window_attribute(window, "class", cls, cache)
+    if info.name is not None:
+        name = info.name
+    else:
+        name = get_window_name(window, query.NET_WM_NAME, query.UTF8_STRING)
+    return cls, name
+
+
+class XConnection:
+    """
+    A connection to the X display *name* (default $DISPLAY) with its own atoms, event
+    dispatcher and window cache, for watching several displays from one process (see
+    seats). The functions of this module use the one connect() opens to $DISPLAY.
+    """
+
+    def __init__(self, name: Optional[str] = None, window_cache: Optional[LRUCache] = None):
+        self.name = name
+        self.window_cache = LRUCache(maxsize=256) if window_cache is None else window_cache
+        self._open()
+
+    def _open(self) -> None:
+        self.display = Xlib.display.Display(self.name)
+        self.screen = self.display.screen()
+        self.dispatcher = EventDispatcher(self.display)
+        self.NET_WM_PID: int = self.display.intern_atom("_NET_WM_PID")
+        self.dispatcher.add_listener(
+            partial(
+                _invalidate_window_cache,
+                cache=self.window_cache,
+                atoms=_invalidating_atoms(self.NET_WM_PID),
+            )
+        )
+        self.active_window_query = ActiveWindowQuery(self.display, self.window_cache)
+        self.NET_WM_NAME: int = self.active_window_query.NET_WM_NAME
+        self.UTF8_STRING: int = self.active_window_query.UTF8_STRING
+
+    def close(self) -> None:
         try:
-            logger.warning("X server closed connection, exiting")
-        except OSError:
+            self.display.close()
+        except Exception:
+            # The socket may have been shut down (see xlib_watchdog), there's nothing to flush
             pass
-        raise FatalError()
+
+    def reconnect(self) -> None:
+        """Replaces the connection with a new one, e.g. after the watchdog aborted a call."""
+        self.close()
+        # Windows are subscribed to per connection, a new one wouldn't hear of their destruction
+        self.window_cache.clear()
+        self._open()
+
+    def active_window_watcher(self) -> ActiveWindowWatcher:
+        """Like the module-level active_window_watcher(), on this display."""
+        try:
+            return ActiveWindowWatcher(
+                self.dispatcher, partial(_watched, self.display, self.reconnect)
+            )
+        except Xlib.error.ConnectionClosedError:
+            raise _connection_closed()
+
+    def get_current_window_info(self) -> Optional[Tuple[str, str]]:
+        """Like the module-level get_current_window_info(), on this display."""
+        try:
+            with _watched(self.display, self.reconnect):
+                return _query_window_info(
+                    self.display, self.dispatcher, self.active_window_query, self.window_cache
+                )
+        except Xlib.error.ConnectionClosedError:
+            raise _connection_closed()
+
+
+def _connection_closed() -> FatalError:
+    # when the X server closes the connection, we should exit
+    # note that stdio is probably closed at this point, so we can't print anything (causes OSError)
+    try:
+        logger.warning("X server closed connection, exiting")
+    except OSError:
+        pass
+    return FatalError()
 
 
 # Things that can lead to unknown cls/name:
@@ -60,11 +291,16 @@ def get_current_window() -> Optional[Window]:
 #  - (name) Chrome (fixed, didn't support when WM_NAME was UTF8_STRING)
 
 
-def get_window_name(window: Window) -> str:
+def get_window_name(window: Window, net_wm_name: Optional[int] = None, utf8_string: Optional[int] = None) -> str:
     """After some annoying debugging I resorted to pretty much copying selfspy.
-    Source: https://github.com/gurgeh/selfspy/blob/8a34597f81000b3a1be12f8cde092a40604e49cf/selfspy/sniff_x.py#L165"""
+    Source: https://github.com/gurgeh/selfspy/blob/8a34597f81000b3a1be12f8cde092a40604e49cf/selfspy/sniff_x.py#L165
+
+    The atoms default to those of the $DISPLAY connection."""
+    if net_wm_name is None or utf8_string is None:
+        connection = connect()
+        net_wm_name, utf8_string = connection.NET_WM_NAME, connection.UTF8_STRING
     try:
-        d = window.get_full_property(NET_WM_NAME, UTF8_STRING)
+        d = window.get_full_property(net_wm_name, utf8_string)
     except Xlib.error.XError as e:
         logger.warning(
             f"Unable to get window property NET_WM_NAME, got a {type(e).__name__} exception from Xlib"
@@ -108,7 +344,17 @@ def get_window_name(window: Window) -> str:
                 return d.value.encode("utf8").decode("utf8", "ignore")
 
 
-def get_window_class(window: Window) -> str:
+def get_window_class(window: Window, cache: LRUCache = window_cache) -> str:
+    cls = cache.get((window.id, "class"))
+    if cls is None:
+        cls = _get_window_class(window, cache)
+        # "unknown" is usually a transient failure (e.g. BadWindow), don't remember it
+        if cls != "unknown":
+            _cache_window_attribute(window, "class", cls, cache)
+    return cls
+
+
+def _get_window_class(window: Window, cache: LRUCache) -> str:
     cls = None
 
     try:
@@ -137,7 +383,7 @@ def get_window_class(window: Window) -> str:
             )
             return "unknown"
         if window:
-            return get_window_class(window)
+            return get_window_class(window, cache)
         else:
             return "unknown"
 
@@ -145,11 +391,24 @@ def get_window_class(window: Window) -> str:
     return cls
 
 
-def get_window_pid(window: Window) -> str:
-    atom = display.get_atom("_NET_WM_PID")
-    pid_property = window.get_full_property(atom, X.AnyPropertyType)
+def get_window_pid(
+    window: Window, cache: LRUCache = window_cache, net_wm_pid: Optional[int] = None
+) -> int:
+    """
+    The pid of the process owning *window*, from _NET_WM_PID, remembered per window.
+
+    The atom defaults to that of the $DISPLAY connection.
+    """
+    pid = cache.get((window.id, "pid"))
+    if pid is not None:
+        return pid
+
+    if net_wm_pid is None:
+        net_wm_pid = connect().NET_WM_PID
+    pid_property = window.get_full_property(net_wm_pid, X.AnyPropertyType)
     if pid_property:
         pid = pid_property.value[-1]
+        _cache_window_attribute(window, "pid", pid, cache)
         return pid
     else:
         # TODO: Needed?
@@ -0,0 +1,211 @@
+"""
+Pipelined property queries for the X11 backend.
+
+python-xlib waits for the reply of every request before sending the next one, so
+fetching the active window, its WM_CLASS and its title costs 3-4 round-trips per
+poll. Over a remote X connection (SSH, VNC) that adds up quickly.
+
+Here we send every GetProperty request up front (``defer=True``) and only then read
+the replies. Since the active window rarely changes between two polls, the requests
+for the last seen window go out in the same batch as the ``_NET_ACTIVE_WINDOW``
+request, so in the common case a poll costs a single round-trip. If the active
+window did change, one more batch is needed for the new window.
+"""
+
+import logging
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import Xlib.error
+from Xlib import X, Xatom
+from Xlib.protocol import request
+
+logger = logging.getLogger(__name__)
+
+# In 32-bit units. Large enough for any sane title, so we never need the second
+# request that get_full_property() makes for long values. Longer values are truncated.
+MAX_PROPERTY_LENGTH = 1024
+
+
+def send_get_property(display, window_id: int, atom: int, property_type: int):
+    """Sends a GetProperty request without waiting for its reply."""
+    return request.GetProperty(
+        display=display.display,
+        defer=True,
+        delete=False,
+        window=window_id,
+        property=atom,
+        type=property_type,
+        long_offset=0,
+        long_length=MAX_PROPERTY_LENGTH,
+    )
+
+
+def read_property(req) -> Optional[Tuple[int, Any]]:
+    """
+    Waits for the reply to a deferred GetProperty request.
+
+    Returns ``(format, value)``, or None if the property is not set.
+
+    :raises Xlib.error.XError: if the request failed (e.g. BadWindow)
+    """
+    req.reply()
+    if not req.property_type:
+        return None
+    fmt, value = req.value
+    return fmt, value
+
+
+def decode_utf8(value) -> str:
+    # Fixing utf8 issue on Ubuntu (https://github.com/gurgeh/selfspy/issues/133)
+    # Thanks to https://github.com/gurgeh/selfspy/issues/133#issuecomment-142943681
+    try:
+        return value.decode("utf8")
+    except UnicodeError:
+        logger.warning(
+            f"Failed to decode one or more characters which will be skipped, bytes are: {value}"
+        )
+        return value.decode("utf8", "ignore")
+
+
+def read_property_or_none(req) -> Optional[Tuple[int, Any]]:
+    """Like read_property(), but None if the request failed too, e.g. for a window gone since it was listed."""
+    try:
+        return read_property(req)
+    except Xlib.error.XError:
+        return None
+
+
+def property_str(prop) -> str:
+    """A property as read by read_property(), decoded as UTF-8, "" if unset."""
+    if prop is None:
+        return ""
+    return decode_utf8(prop[1])
+
+
+def property_strlist(prop) -> List[str]:
+    """A list of NUL-separated strings (e.g. WM_CLASS) as read by read_property()."""
+    value = property_str(prop)
+    return value.split("\0")[:-1] if value.endswith("\0") else value.split("\0")
+
+
+class ActiveWindowReply(NamedTuple):
+    """The raw answer of ActiveWindowQuery.query(), turned into a window.WindowInfo by xlib."""
+
+    id: int
+    # None when the batch couldn't resolve it and the caller should take the slow path
+    # (e.g. WM_CLASS unset, so the class has to be looked up on the parent window).
+    cls: Optional[str]
+    name: Optional[str]
+
+
+class ActiveWindowQuery:
+    """Fetches the active window id, class and title in as few round-trips as possible."""
+
+    def __init__(self, display, class_cache, send=send_get_property):
+        self.display = display
+        self.root_id = display.screen().root.id
+        self.class_cache = class_cache
+        self.send = send
+
+        self.NET_ACTIVE_WINDOW = display.intern_atom("_NET_ACTIVE_WINDOW")
+        self.NET_WM_NAME = display.intern_atom("_NET_WM_NAME")
+        self.UTF8_STRING = display.intern_atom("UTF8_STRING")
+
+        self.last_window_id: Optional[int] = None
+        # Number of batches of requests, i.e. round-trips to the X server
+        self.round_trips = 0
+
+    def _send_window_requests(self, window_id: int) -> Dict[str, Any]:
+        requests = {
+            "net_wm_name": self.send(
+                self.display, window_id, self.NET_WM_NAME, self.UTF8_STRING
+            ),
+            "wm_name": self.send(
+                self.display, window_id, Xatom.WM_NAME, X.AnyPropertyType
+            ),
+        }
+        if (window_id, "class") not in self.class_cache:
+            requests["class"] = self.send(
+                self.display, window_id, Xatom.WM_CLASS, Xatom.STRING
+            )
+        return requests
+
+    def _read_active_window_id(self, req) -> Optional[int]:
+        prop = read_property(req)
+        if prop is None or not prop[1]:
+            logger.warning("window_prop was None")
+            return None
+        # The first value is the one we want, see xlib._get_current_window_id
+        window_id = prop[1][0]
+        return window_id if window_id != 0 else None
+
+    def _read_name(self, requests: Dict[str, Any]) -> Optional[str]:
+        try:
+            prop = read_property(requests["net_wm_name"])
+        except Xlib.error.XError:
+            prop = None
+        if prop is not None and prop[0] == 8:
+            return decode_utf8(prop[1])
+
+        # Fallback to WM_NAME, usually of type STRING (latin1)
+        try:
+            req = requests["wm_name"]
+            prop = read_property(req)
+        except Xlib.error.BadWindow:
+            return "unknown"
+        except Xlib.error.XError:
+            return None
+        if prop is None:
+            return "unknown"
+        if req.property_type == self.UTF8_STRING:
+            return decode_utf8(prop[1])
+        if req.property_type == Xatom.STRING:
+            return prop[1].decode("latin1")
+        # Something exotic like COMPOUND_TEXT, let python-xlib deal with it
+        return None
+
+    def _read_class(self, window_id: int, requests: Dict[str, Any]) -> Optional[str]:
+        if "class" not in requests:
+            return self.class_cache.get((window_id, "class"))
+        try:
+            prop = read_property(requests["class"])
+        except Xlib.error.XError:
+            return None
+        if prop is None:
+            return None
+        parts = prop[1].decode("latin1").split("\0")
+        if len(parts) < 2 or not parts[1]:
+            return None
+        return parts[1]
+
+    def query(self) -> Optional[ActiveWindowReply]:
+        """
+        Returns the active window's id, class and name, or None if no window is active.
+
+        :raises Xlib.error.ConnectionClosedError: if the X server closed the connection
+        """
+        self.round_trips += 1
+        active_req = self.send(
+            self.display, self.root_id, self.NET_ACTIVE_WINDOW, X.AnyPropertyType
+        )
+        guess = self.last_window_id
+        requests = self._send_window_requests(guess) if guess is not None else None
+
+        window_id = self._read_active_window_id(active_req)
+        self.last_window_id = window_id
+
+        if requests is not None and window_id != guess:
+            # The active window changed, the speculative replies are of no use.
+            # python-xlib files them away as they arrive, so we can just drop them.
+            requests = None
+        if window_id is None:
+            return None
+        if requests is None:
+            self.round_trips += 1
+            requests = self._send_window_requests(window_id)
+
+        return ActiveWindowReply(
+            id=window_id,
+            cls=self._read_class(window_id, requests),
+            name=self._read_name(requests),
+        )
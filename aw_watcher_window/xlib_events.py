@@ -0,0 +1,247 @@
+"""
+Event-driven change detection for X11.
+
+Instead of asking the X server for the active window on every poll, we select
+PropertyChangeMask on the root window (to hear about ``_NET_ACTIVE_WINDOW``
+changes) and on the currently focused window (to hear about title changes),
+and block on the X connection until something actually happens (or await it on
+an asyncio event loop, see ActiveWindowWatcher.wait_async).
+
+All events read from a connection go through one EventDispatcher, so that the
+watcher and the window attribute cache in xlib.py see the same stream no matter
+who happens to drain the queue.
+"""
+
+import asyncio
+import logging
+import select
+from concurrent.futures import Executor
+from contextlib import contextmanager, nullcontext
+from time import monotonic
+from typing import Callable, ContextManager, List, Optional, Sequence
+
+import Xlib.error
+from Xlib import X, Xatom
+
+from .exceptions import FatalError
+from .xlib_watchdog import StalledCallError
+
+logger = logging.getLogger(__name__)
+
+# Selected on every client window we care about: title/class/pid changes and DestroyNotify.
+WINDOW_EVENT_MASK = X.PropertyChangeMask | X.StructureNotifyMask
+
+# Selected on the root window, by ActiveWindowWatcher (_NET_ACTIVE_WINDOW changes) and by
+# inventory.Inventory (windows coming and going). X keeps one mask per client and window,
+# so both select all of it: whichever is created last, e.g. after a reconnect, would
+# otherwise take the other's events away.
+ROOT_EVENT_MASK = X.SubstructureNotifyMask | X.PropertyChangeMask
+
+
+class EventDispatcher:
+    """Drains the event queue of an X connection and hands each event to every listener."""
+
+    def __init__(self, display):
+        self.display = display
+        self.listeners: List[Callable] = []
+
+    def add_listener(self, listener: Callable) -> None:
+        self.listeners.append(listener)
+
+    def drain(self) -> int:
+        """Dispatches all events that have already arrived, without blocking. Returns the count."""
+        count = 0
+        while self.display.pending_events():
+            event = self.display.next_event()
+            count += 1
+            for listener in self.listeners:
+                listener(event)
+        return count
+
+
+class ActiveWindowWatcher:
+    """
+    Blocks on the X connection until the active window or its title changes.
+
+    The requests it makes to the X server, here and in wait(), are made inside
+    *watched()* (e.g. xlib._watched, so that the watchdog can abort them).
+    """
+
+    def __init__(
+        self, dispatcher: EventDispatcher, watched: Callable[[], ContextManager] = nullcontext
+    ):
+        self.dispatcher = dispatcher
+        self.watched = watched
+        self.display = display = dispatcher.display
+        self.root = display.screen().root
+        self.window = None
+        self.changed = False
+
+        with watched():
+            self.NET_ACTIVE_WINDOW = display.intern_atom("_NET_ACTIVE_WINDOW")
+            self.NET_WM_NAME = display.intern_atom("_NET_WM_NAME")
+            self.title_atoms = {self.NET_WM_NAME, Xatom.WM_NAME}
+
+            dispatcher.add_listener(self.handle_event)
+            self.root.change_attributes(event_mask=ROOT_EVENT_MASK)
+            self._track_active_window()
+            self.display.flush()
+
+    def _get_active_window_id(self) -> Optional[int]:
+        window_prop = self.root.get_full_property(
+            self.NET_ACTIVE_WINDOW, X.AnyPropertyType
+        )
+        if window_prop is None or not window_prop.value:
+            return None
+        window_id = window_prop.value[0]
+        return window_id if window_id != 0 else None
+
+    def _track_active_window(self) -> None:
+        """Moves our title subscription over to the currently active window."""
+        window_id = self._get_active_window_id()
+        if self.window is not None and self.window.id == window_id:
+            return
+
+        self.window = None
+        if window_id is None:
+            return
+
+        window = self.display.create_resource_object("window", window_id)
+        try:
+            # StructureNotifyMask gives us DestroyNotify for the window
+            window.change_attributes(event_mask=WINDOW_EVENT_MASK)
+        except Xlib.error.XError as e:
+            logger.warning(
+                f"Unable to subscribe to window events, got a {type(e).__name__} exception from Xlib"
+            )
+            return
+        self.window = window
+
+    def _is_tracked(self, window) -> bool:
+        return self.window is not None and window is not None and window.id == self.window.id
+
+    def handle_event(self, event) -> None:
+        """Sets ``changed`` if the event means the current window (or its title) changed."""
+        if event.type == X.PropertyNotify:
+            if event.window.id == self.root.id and event.atom == self.NET_ACTIVE_WINDOW:
+                self._track_active_window()
+                self.changed = True
+            elif self._is_tracked(event.window) and event.atom in self.title_atoms:
+                self.changed = True
+        elif event.type == X.DestroyNotify:
+            if self._is_tracked(event.window):
+                self.window = None
+                self.changed = True
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Blocks until the active window or its title changes, or until *timeout* seconds have passed.
+
+        Returns True if a change was seen, False on timeout.
+
+        :raises FatalError: if the X server closed the connection
+        :raises StalledCallError: if the watchdog aborted a request (see *watched*)
+        """
+        with self._connection_closed_is_fatal():
+            return self._wait(timeout)
+
+    async def wait_async(self, timeout: float, executor: Optional[Executor] = None) -> bool:
+        """
+        Like wait(), but awaits the connection becoming readable on the running event loop
+        (through ``loop.add_reader``) instead of blocking in select().
+
+        With *executor*, the events are handled on it, since that may ask the X server
+        for the new active window: a stalled server then holds up a thread of the
+        executor rather than the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        readable = asyncio.Event()
+        fd = self.display.fileno()
+        loop.add_reader(fd, readable.set)
+        try:
+            with self._connection_closed_is_fatal():
+                deadline = loop.time() + timeout
+                while True:
+                    # Cleared first, data arriving while we drain sets it again
+                    readable.clear()
+                    if executor is None:
+                        changed = self._take_change()
+                    else:
+                        changed = await loop.run_in_executor(executor, self._take_change)
+                    if changed:
+                        return True
+
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        return False
+                    try:
+                        await asyncio.wait_for(readable.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        return False
+        finally:
+            loop.remove_reader(fd)
+
+    @contextmanager
+    def _connection_closed_is_fatal(self):
+        try:
+            yield
+        except Xlib.error.ConnectionClosedError:
+            try:
+                logger.warning("X server closed connection, exiting")
+            except OSError:
+                pass
+            raise FatalError()
+
+    def _take_change(self) -> bool:
+        """Dispatches the events that arrived, and returns (and resets) whether they changed anything."""
+        # Drain everything already queued so that a burst of events results in a single change.
+        # Handling them may ask the X server for the new active window.
+        with self.watched():
+            self.dispatcher.drain()
+            if self.changed:
+                self.changed = False
+                self.display.flush()
+                return True
+        return False
+
+    def _wait(self, timeout: float) -> bool:
+        deadline = monotonic() + timeout
+        while True:
+            if self._take_change():
+                return True
+
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                return False
+            readable, _, _ = select.select([self.display.fileno()], [], [], remaining)
+            if not readable:
+                return False
+
+
+def wait_any(watchers: Sequence[ActiveWindowWatcher], timeout: float) -> List[ActiveWindowWatcher]:
+    """
+    Like ActiveWindowWatcher.wait(), on the connections of several watchers at once:
+    blocks until one of them sees a change, or until *timeout* seconds have passed.
+
+    Returns the watchers that saw a change, none on timeout. A watcher whose connection
+    was closed, or rebuilt after a stalled request, is returned as changed too, its
+    owner finds out on its next call.
+    """
+    deadline = monotonic() + timeout
+    while True:
+        changed = []
+        for watcher in watchers:
+            try:
+                if watcher._take_change():
+                    changed.append(watcher)
+            except (Xlib.error.ConnectionClosedError, StalledCallError):
+                changed.append(watcher)
+        if changed:
+            return changed
+
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            return []
+        readable, _, _ = select.select([w.display.fileno() for w in watchers], [], [], remaining)
+        if not readable:
+            return []
@@ -0,0 +1,193 @@
+"""
+A watchdog for calls to the X server, which python-xlib can get stuck in: blocked on a
+reply that never comes, or spinning at 100% CPU (see python-xlib 0.31 in pyproject.toml).
+
+A call is made inside ``watchdog.watch(display)``. If it is still running after the
+deadline, the watchdog thread shuts down the connection's socket, which makes the
+stuck read fail in the calling thread. There the connection is rebuilt (the *recover*
+callback, xlib.reconnect) and StalledCallError raised, so that the poll is given up
+and the next one runs on a fresh connection, instead of the process exiting as it
+does when the server really closed the connection.
+"""
+
+import logging
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+from .exceptions import FatalError
+from .schedule import Histogram
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DEADLINE = 5.0
+
+# A stalled call that used more than this share of its time on the CPU was spinning
+SPIN_CPU_SHARE = 0.5
+
+
+class StalledCallError(Exception):
+    """An X call was aborted by the watchdog. The connection has been rebuilt."""
+
+
+def shutdown_socket(display) -> None:
+    """Makes reads on a python-xlib Display fail, from any thread."""
+    display.display.socket.shutdown(socket.SHUT_RDWR)
+
+
+def thread_cpu_time(ident: int) -> Optional[float]:
+    """CPU seconds used by the thread *ident*, or None where that can't be read."""
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(ident))
+    except (AttributeError, OSError):
+        return None
+
+
+class _Call:
+    def __init__(self, display, recover: Callable[[], None], start: float, cpu_start: Optional[float]):
+        self.display = display
+        self.recover = recover
+        self.start = start
+        self.cpu_start = cpu_start
+        self.tripped_at: Optional[float] = None
+
+
+class XWatchdog:
+    """
+    Aborts X calls running longer than *deadline* seconds, checking every
+    *check_interval* (a quarter of the deadline by default) on a thread of its own.
+
+    *abort* makes the stuck call fail (shutdown_socket), *recover* rebuilds the
+    connection in the calling thread afterwards. A stall is counted as a spin when the
+    stuck thread was mostly on the CPU, as a hang otherwise.
+    """
+
+    def __init__(
+        self,
+        recover: Callable[[], None],
+        deadline: float = DEFAULT_DEADLINE,
+        check_interval: Optional[float] = None,
+        abort: Callable[[object], None] = shutdown_socket,
+        clock: Callable[[], float] = time.monotonic,
+        cpu_time: Callable[[int], Optional[float]] = thread_cpu_time,
+    ):
+        if deadline <= 0:
+            raise ValueError("deadline must be positive")
+        self.recover = recover
+        self.deadline = deadline
+        self.check_interval = check_interval if check_interval is not None else deadline / 4
+        self.abort = abort
+        self.clock = clock
+        self.cpu_time = cpu_time
+        self.hangs = 0
+        self.spins = 0
+        self.recoveries = 0
+        self.recovery_failures = 0
+        self.recovery_seconds = Histogram()
+        self._calls: Dict[int, _Call] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @contextmanager
+    def watch(self, display, recover: Optional[Callable[[], None]] = None):
+        """
+        Runs the block as a call on *display*, aborted if it goes over the deadline.
+        The connection is rebuilt with *recover*, if given, instead of the watchdog's.
+
+        :raises StalledCallError: if it was, once the connection has been rebuilt
+        :raises FatalError: if it couldn't be rebuilt
+        """
+        ident = threading.get_ident()
+        call = _Call(display, recover or self.recover, self.clock(), self.cpu_time(ident))
+        with self._lock:
+            self._calls[ident] = call
+        try:
+            yield
+        except Exception as e:
+            if call.tripped_at is None:
+                raise
+            error: Optional[Exception] = e
+        else:
+            error = None
+        finally:
+            with self._lock:
+                del self._calls[ident]
+
+        # The call may have finished just as it was aborted, the connection is gone all the same
+        if call.tripped_at is not None:
+            self._recover(call)
+            raise StalledCallError(
+                f"X call aborted after {call.tripped_at - call.start:.1f}s"
+            ) from error
+
+    def _recover(self, call: _Call) -> None:
+        try:
+            call.recover()
+        except Exception:
+            self.recovery_failures += 1
+            logger.exception("Failed to reconnect to the X server after a stalled call")
+            raise FatalError()
+        self.recoveries += 1
+        elapsed = self.clock() - call.tripped_at  # type: ignore
+        self.recovery_seconds.add(elapsed)
+        logger.warning(f"Reconnected to the X server {elapsed:.3f}s after aborting a stalled call")
+
+    def check(self) -> None:
+        """Aborts the calls over the deadline. Called periodically by the watchdog thread."""
+        now = self.clock()
+        with self._lock:
+            stalled = [
+                (ident, call)
+                for ident, call in self._calls.items()
+                if call.tripped_at is None and now - call.start > self.deadline
+            ]
+            for _, call in stalled:
+                call.tripped_at = now
+        for ident, call in stalled:
+            cpu_time = self.cpu_time(ident)
+            spinning = (
+                call.cpu_start is not None
+                and cpu_time is not None
+                and cpu_time - call.cpu_start > SPIN_CPU_SHARE * (now - call.start)
+            )
+            if spinning:
+                self.spins += 1
+            else:
+                self.hangs += 1
+            logger.warning(
+                f"X call {'spinning' if spinning else 'hanging'} for {now - call.start:.1f}s, aborting it"
+            )
+            try:
+                self.abort(call.display)
+            except OSError:
+                # Already closed, the call will fail anyway
+                pass
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.check_interval):
+            self.check()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="aw-watcher-window-x-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self) -> dict:
+        recovery = self.recovery_seconds.stats()
+        return {
+            "stalls": self.hangs + self.spins,
+            "hangs": self.hangs,
+            "spins": self.spins,
+            "recoveries": self.recoveries,
+            "recovery_failures": self.recovery_failures,
+            "recovery_seconds_p50": recovery["p50"],
+            "recovery_seconds_max": recovery["max"],
+        }
@@ -120,6 +120,99 @@ def get_windows(wids, active_window_id=None):
     return [get_window(wid, active_window=(wid == active_window_id)) for wid in wids]
 
 
+# Batched backend: instead of forking `xprop -root` once and `xprop -id` for every window,
+# fetch the same properties over a python-xlib connection. All requests go out before any
+# reply is read (see xlib_batch), so listing every window costs two round-trips and no forks.
+# python-xlib is only imported in here: the subprocess functions above are the fallback for
+# when it is missing or can't connect.
+
+
+def _property_int(prop) -> int:
+    if prop is None or not prop[1]:
+        return -1
+    # Same as get_xprop_field_int, which treats 0 as unset
+    return prop[1][0] or -1
+
+
+def get_windows_batched(display=None, send=None):
+    """
+    Returns get_window() dicts for every window in _NET_CLIENT_LIST, without forking xprop.
+
+    *display* defaults to the connection of the xlib module, *send* to send_get_property.
+    """
+    from Xlib import X, Xatom
+
+    from .xlib_batch import property_str, property_strlist, read_property_or_none, send_get_property
+
+    if send is None:
+        send = send_get_property
+    if display is None:
+        from . import xlib
+
+        display = xlib.display
+
+    atoms = {
+        name: display.intern_atom(name)
+        for name in [
+            "_NET_CLIENT_LIST",
+            "_NET_ACTIVE_WINDOW",
+            "_NET_WM_NAME",
+            "_NET_WM_DESKTOP",
+            "_NET_WM_PID",
+            "WM_WINDOW_ROLE",
+            "UTF8_STRING",
+        ]
+    }
+    root_id = display.screen().root.id
+
+    client_list_req = send(display, root_id, atoms["_NET_CLIENT_LIST"], X.AnyPropertyType)
+    active_req = send(display, root_id, atoms["_NET_ACTIVE_WINDOW"], X.AnyPropertyType)
+    client_list = read_property_or_none(client_list_req)
+    active = read_property_or_none(active_req)
+    window_ids = list(client_list[1]) if client_list else []
+    active_window_id = active[1][0] if active and active[1] else None
+
+    properties = {
+        "net_wm_name": (atoms["_NET_WM_NAME"], atoms["UTF8_STRING"]),
+        "wm_name": (Xatom.WM_NAME, X.AnyPropertyType),
+        "class": (Xatom.WM_CLASS, X.AnyPropertyType),
+        "desktop": (atoms["_NET_WM_DESKTOP"], X.AnyPropertyType),
+        "command": (Xatom.WM_COMMAND, X.AnyPropertyType),
+        "role": (atoms["WM_WINDOW_ROLE"], X.AnyPropertyType),
+        "pid": (atoms["_NET_WM_PID"], X.AnyPropertyType),
+    }
+    requests = [
+        {
+            key: send(display, window_id, atom, property_type)
+            for key, (atom, property_type) in properties.items()
+        }
+        for window_id in window_ids
+    ]
+
+    windows = []
+    for window_id, reqs in zip(window_ids, requests):
+        props = {key: read_property_or_none(req) for key, req in reqs.items()}
+        name = property_str(props["net_wm_name"]) or property_str(props["wm_name"])
+        command = property_strlist(props["command"])
+        role = property_str(props["role"])
+        windows.append(
+            {
+                "id": hex(window_id),
+                "active": window_id == active_window_id,
+                "name": name or "unknown",
+                "class": property_strlist(props["class"]) if props["class"] else ["unknown"],
+                "desktop": _property_int(props["desktop"]),
+                # Formatted like xprop prints it, which is what get_window() returns
+                "command": ["{ " + ", ".join(f'"{c}"' for c in command) + " }"]
+                if props["command"]
+                else [],
+                "role": [role] if props["role"] else [],
+                "pid": _property_int(props["pid"]),
+            }
+        )
+    return windows
+
+
 if __name__ == "__main__":
     from time import sleep
     logging.basicConfig(level=logging.INFO)
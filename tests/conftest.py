@@ -0,0 +1,64 @@
+import pytest
+from aw_core.models import Event
+from aw_transform.heartbeats import heartbeat_merge
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--benchmark",
+        action="store_true",
+        help="Also run the tests marked benchmark, which time or measure the watcher (make benchmark)",
+    )
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "benchmark: timing or memory measurement, only run with --benchmark"
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--benchmark"):
+        return
+    skip = pytest.mark.skip(reason="benchmark, run with --benchmark")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
+
+
+class FakeServer:
+    """Stores heartbeats the way aw-server does (see aw_transform.heartbeat_merge)."""
+
+    def __init__(self):
+        self.events = []
+        self.requests = 0
+
+    def heartbeat(self, bucket_id, event, pulsetime, queued=False):
+        self.requests += 1
+        # Copy, the server doesn't share objects with the client
+        event = Event(timestamp=event.timestamp, duration=event.duration, data=dict(event.data))
+        if not self.events or not heartbeat_merge(self.events[-1], event, pulsetime):
+            self.events.append(event)
+
+    def timeline(self):
+        return [(e.timestamp, e.duration, dict(e.data)) for e in self.events]
+
+
+class FakeClock:
+    """A monotonic clock that only moves when slept on or told to."""
+
+    def __init__(self, now=100.0):
+        self.now = now
+        self.sleeps = []
+        # extra time each sleep overshoots by, to simulate a loaded machine
+        self.oversleep = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds + self.oversleep
+
+    def work(self, seconds):
+        self.now += seconds
@@ -0,0 +1,320 @@
+import asyncio
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+import Xlib.error
+
+from aw_watcher_window import aio
+from aw_watcher_window.exceptions import FatalError
+from aw_watcher_window.lib import FakeWindowSource
+from aw_watcher_window.pipeline import compute_pulsetime
+from aw_watcher_window.sampler import Sample, SampleQueue
+from aw_watcher_window.window import WindowInfo
+from aw_watcher_window.xlib_events import ActiveWindowWatcher, EventDispatcher
+
+from conftest import FakeServer
+from test_xlib_events import FakeDisplay
+
+WINDOWS = {
+    0x100: WindowInfo("Firefox", "a"),
+    0x200: WindowInfo("Terminal", "b"),
+}
+
+
+class PipeDisplay(FakeDisplay):
+    """A FakeDisplay whose events also make its fd readable, like a real X connection."""
+
+    closed = False
+
+    def notify(self):
+        os.write(self._write_fd, b"x")
+
+    def pending_events(self):
+        if self.closed:
+            raise Xlib.error.ConnectionClosedError("server")
+        os.set_blocking(self._read_fd, False)
+        try:
+            os.read(self._read_fd, 4096)
+        except BlockingIOError:
+            pass
+        return super().pending_events()
+
+    def switch_to(self, window_id):
+        self.set_active_window(window_id)
+        self.notify()
+
+
+@pytest.fixture
+def display():
+    d = PipeDisplay()
+    yield d
+    d.close()
+
+
+def xlib_source(display):
+    """The parts of an XlibSource that event_samples uses, around *display*."""
+    watcher = ActiveWindowWatcher(EventDispatcher(display))
+    return SimpleNamespace(wait_async=watcher.wait_async)
+
+
+def fetcher(display):
+    return lambda: WINDOWS[display.active_window_id]
+
+
+async def take(agen, n):
+    return [await agen.__anext__() for _ in range(n)]
+
+
+def test_event_samples_wake_up_on_events(display):
+    async def run():
+        loop = asyncio.get_running_loop()
+        agen = aio.event_samples(xlib_source(display), fetcher(display), keepalive_time=10.0)
+        first = await agen.__anext__()
+        start = time.monotonic()
+        loop.call_later(0.01, display.switch_to, 0x200)
+        closing, switched = await take(agen, 2)
+        elapsed = time.monotonic() - start
+        await agen.aclose()
+        # The reader is gone once the generator is closed
+        assert not loop.remove_reader(display.fileno())
+        return first, closing, switched, elapsed
+
+    first, closing, switched, elapsed = asyncio.run(run())
+
+    assert first.window == WINDOWS[0x100]
+    # the previous window is extended up to the switch
+    assert closing.window == WINDOWS[0x100]
+    assert switched.window == WINDOWS[0x200]
+    assert closing.timestamp == switched.timestamp
+    assert elapsed < 5.0
+    assert {first.pulsetime, switched.pulsetime} == {compute_pulsetime(10.0)}
+
+
+def test_event_samples_keep_alive_without_events(display):
+    async def run():
+        agen = aio.event_samples(xlib_source(display), fetcher(display), keepalive_time=0.02)
+        samples = await take(agen, 3)
+        await agen.aclose()
+        return samples
+
+    samples = asyncio.run(run())
+
+    assert [s.window for s in samples] == [WINDOWS[0x100]] * 3
+    assert samples[0].timestamp < samples[1].timestamp < samples[2].timestamp
+
+
+def test_event_samples_end_when_connection_closes(display):
+    async def run():
+        loop = asyncio.get_running_loop()
+
+        def close():
+            display.closed = True
+            display.notify()
+
+        loop.call_later(0.01, close)
+        source = xlib_source(display)
+        return [s async for s in aio.event_samples(source, fetcher(display), keepalive_time=10.0)]
+
+    samples = asyncio.run(asyncio.wait_for(run(), 5.0))
+
+    assert [s.window for s in samples] == [WINDOWS[0x100]]
+
+
+def test_event_samples_extend_the_last_window_when_cancelled(display):
+    server = FakeServer()
+
+    async def run():
+        samples = aio.event_samples(xlib_source(display), fetcher(display), keepalive_time=10.0)
+        task = asyncio.ensure_future(aio.watch(samples, aio.AsyncSender(server, "bucket")))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(asyncio.wait_for(run(), 5.0))
+
+    [(_, duration, data)] = server.timeline()
+    assert data == {"app": "Firefox", "title": "a"}
+    assert duration >= timedelta(seconds=0.05)
+
+
+def test_wait_async_removes_its_reader(display):
+    watcher = ActiveWindowWatcher(EventDispatcher(display))
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.01, display.switch_to, 0x200)
+        changed = await watcher.wait_async(10.0)
+        assert not loop.remove_reader(display.fileno())
+        return changed
+
+    assert asyncio.run(asyncio.wait_for(run(), 5.0)) is True
+    assert watcher.window.id == 0x200
+
+
+def test_poll_samples_run_fetch_off_the_event_loop():
+    windows = [WindowInfo("Firefox", "a")] * 3 + [WindowInfo("Terminal", "b"), None]
+    threads = []
+
+    def fetch():
+        threads.append(threading.current_thread())
+        if not windows:
+            raise FatalError()
+        return windows.pop(0)
+
+    async def run():
+        return [s async for s in aio.poll_samples(fetch, poll_time=0.005)]
+
+    samples = asyncio.run(asyncio.wait_for(run(), 5.0))
+
+    assert [s.window.app for s in samples] == ["Firefox"] * 3 + ["Terminal"]
+    assert all(s.pulsetime >= compute_pulsetime(0.005) for s in samples)
+    # all on one thread, that isn't the event loop's
+    assert len(set(threads)) == 1
+    assert threads[0] is not threading.main_thread()
+
+
+async def from_list(samples):
+    for sample in samples:
+        yield sample
+
+
+def sample(seconds, title, app="Firefox"):
+    timestamp = datetime(2020, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=seconds)
+    return Sample(WindowInfo(app, title), timestamp, 2.0)
+
+
+def test_watch_transforms_and_sends_heartbeats():
+    server = FakeServer()
+    sender = aio.AsyncSender(server, "bucket", exclude_title=True)
+
+    asyncio.run(aio.watch(from_list([sample(0, "a"), sample(1, "b", app="Terminal")]), sender))
+
+    assert [data for _, _, data in server.timeline()] == [
+        {"app": "Firefox", "title": "excluded"},
+        {"app": "Terminal", "title": "excluded"},
+    ]
+
+
+def test_watch_flushes_coalesced_heartbeats_when_done():
+    server = FakeServer()
+    sender = aio.AsyncSender(server, "bucket", coalesce_time=60.0)
+
+    asyncio.run(aio.watch(from_list([sample(t, "a") for t in range(5)]), sender))
+
+    # the first one is sent right away, the rest is held back until the end
+    assert server.requests == 2
+    [(timestamp, duration, _)] = server.timeline()
+    assert timestamp + duration == sample(4, "a").timestamp
+
+
+def test_sender_sends_on_executor():
+    threads = []
+
+    class ThreadServer(FakeServer):
+        def heartbeat(self, *args, **kwargs):
+            threads.append(threading.current_thread())
+            super().heartbeat(*args, **kwargs)
+
+    server = ThreadServer()
+
+    async def run():
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            sender = aio.AsyncSender(server, "bucket", executor=executor)
+            await aio.watch(from_list([sample(0, "a")]), sender)
+
+    asyncio.run(run())
+
+    assert server.requests == 1
+    assert threads[0] is not threading.main_thread()
+
+
+def test_watch_through_a_queue_sends_every_sample():
+    server = FakeServer()
+    samples = [sample(t, str(t)) for t in range(5)]
+
+    asyncio.run(aio.watch(from_list(samples), aio.AsyncSender(server, "bucket"), SampleQueue(10)))
+
+    assert [data["title"] for _, _, data in server.timeline()] == ["0", "1", "2", "3", "4"]
+
+
+def test_run_swift_returns_exit_code():
+    command = [sys.executable, "-c", "import sys; sys.exit(3)"]
+
+    assert asyncio.run(aio.run_swift(command)) == 3
+
+
+def test_run_swift_terminates_process_when_cancelled():
+    command = [sys.executable, "-c", "import time; time.sleep(60)"]
+
+    async def run():
+        task = asyncio.ensure_future(aio.run_swift(command))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        start = time.monotonic()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return time.monotonic() - start
+
+    assert asyncio.run(run()) < 5.0
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="no SIGTERM handlers on Windows")
+def test_sigterm_stops_the_loop_and_flushes():
+    server = FakeServer()
+    source = FakeWindowSource([WindowInfo("Firefox", "a")] * 10000)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.1, os.kill, os.getpid(), signal.SIGTERM)
+        watching = aio.poll_loop(server, "bucket", source, poll_time=0.01, coalesce_time=60.0)
+        return await aio.until_sigterm(watching)
+
+    previous = signal.getsignal(signal.SIGTERM)
+
+    assert asyncio.run(asyncio.wait_for(run(), 5.0)) is None
+    assert signal.getsignal(signal.SIGTERM) is previous
+    # held back by the coalescer, but flushed on the way out
+    assert server.requests == 2
+    [(_, duration, _)] = server.timeline()
+    assert duration >= timedelta(seconds=0.05)
+
+
+def test_until_sigterm_returns_the_result():
+    async def work():
+        return 3
+
+    assert asyncio.run(aio.until_sigterm(work())) == 3
+
+
+def test_poll_loop_sends_the_windows_of_the_source():
+    server = FakeServer()
+    windows = [WindowInfo("Firefox", "a")] * 3 + [WindowInfo("Terminal", "b")]
+
+    watching = aio.poll_loop(server, "bucket", FakeWindowSource(windows), poll_time=0.001)
+    asyncio.run(asyncio.wait_for(watching, 5.0))
+
+    assert [data for _, _, data in server.timeline()] == [
+        {"app": "Firefox", "title": "a"},
+        {"app": "Terminal", "title": "b"},
+    ]
+
+
+def test_event_loop_sends_the_windows_of_the_source():
+    server = FakeServer()
+    source = FakeWindowSource([WindowInfo("Firefox", "a"), WindowInfo("Terminal", "b")])
+
+    watching = aio.event_loop(server, "bucket", source, keepalive_time=10.0, exclude_title=True)
+    asyncio.run(asyncio.wait_for(watching, 5.0))
+
+    assert [data for _, _, data in server.timeline()] == [
+        {"app": "Firefox", "title": "excluded"},
+        {"app": "Terminal", "title": "excluded"},
+    ]
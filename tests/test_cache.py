@@ -0,0 +1,121 @@
+from types import SimpleNamespace
+
+import pytest
+from Xlib import X
+
+from aw_watcher_window import xlib
+from aw_watcher_window.cache import LRUCache
+
+
+def test_get_counts_hits_and_misses():
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("b", "default") == "default"
+
+    assert cache.stats() == {
+        "hits": 1,
+        "misses": 2,
+        "hit_rate": 1 / 3,
+        "size": 1,
+        "maxsize": 2,
+    }
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")  # "b" is now the least recently used
+    cache.put("c", 3)
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+    assert len(cache) == 2
+
+
+def test_pop_and_clear():
+    cache = LRUCache()
+    cache.put("a", 1)
+    cache.put("b", 2)
+
+    assert cache.pop("a") == 1
+    assert cache.pop("a") is None
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_maxsize_must_be_positive():
+    with pytest.raises(ValueError):
+        LRUCache(maxsize=0)
+
+
+def test_evicts_by_weight():
+    cache = LRUCache(maxsize=10, maxweight=10, weigh=lambda key, value: len(value))
+    cache.put("a", "xxxx")
+    cache.put("b", "xxxx")
+    cache.put("c", "xxxx")  # 12 > 10, "a" has to go
+
+    assert "a" not in cache
+    assert cache.weight == 8
+
+    cache.put("b", "x")  # replacing an entry replaces its weight
+    assert cache.weight == 5
+    cache.pop("c")
+    assert cache.weight == 1
+    assert cache.stats()["weight"] == 1
+    assert cache.stats()["maxweight"] == 10
+
+
+def test_entry_heavier_than_maxweight_is_not_kept():
+    cache = LRUCache(maxsize=10, maxweight=3, weigh=lambda key, value: len(value))
+    cache.put("a", "xxxx")
+
+    assert len(cache) == 0
+    assert cache.weight == 0
+
+
+def test_weight_requires_weigh():
+    with pytest.raises(ValueError):
+        LRUCache(maxweight=10)
+
+
+class FakeWindow:
+    NET_WM_PID = 400
+
+    def __init__(self, window_id, pid):
+        self.id = window_id
+        self.pid = pid
+        self.requests = 0
+        self.event_mask = None
+
+    def get_full_property(self, atom, property_type):
+        assert atom == self.NET_WM_PID
+        self.requests += 1
+        return SimpleNamespace(value=[self.pid])
+
+    def change_attributes(self, event_mask, onerror=None):
+        self.event_mask = event_mask
+
+
+def test_window_pid_is_cached_until_it_changes():
+    cache = LRUCache()
+    window = FakeWindow(0x100, 4242)
+
+    assert xlib.get_window_pid(window, cache, FakeWindow.NET_WM_PID) == 4242
+    assert xlib.get_window_pid(window, cache, FakeWindow.NET_WM_PID) == 4242
+    assert window.requests == 1
+    # subscribed, to hear of its destruction and property changes
+    assert window.event_mask is not None
+
+    window.pid = 4343
+    xlib._invalidate_window_cache(
+        SimpleNamespace(type=X.PropertyNotify, window=window, atom=FakeWindow.NET_WM_PID),
+        cache,
+        xlib._invalidating_atoms(FakeWindow.NET_WM_PID),
+    )
+    assert xlib.get_window_pid(window, cache, FakeWindow.NET_WM_PID) == 4343
+    assert window.requests == 2
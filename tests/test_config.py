@@ -2,6 +2,7 @@ import pathlib
 import re
 import sys
 
+import pytest
 import tomlkit
 
 from aw_watcher_window import config as config_module
@@ -143,3 +144,48 @@ def test_no_research_overrides_config_enabled(monkeypatch):
     args = config_module.parse_args()
 
     assert args.research_enabled is False
+
+
+def _load_config():
+    return {
+        "exclude_title": False,
+        "exclude_titles": [],
+        "poll_time": 1.0,
+        "strategy_macos": "swift",
+    }
+
+
+@pytest.mark.parametrize(
+    "option", [["--record", "trace"], ["--inventory-interval", "60"], ["--metrics-port", "9100"]]
+)
+def test_displays_reject_options_the_seats_dont_have(monkeypatch, capsys, option):
+    monkeypatch.setattr(config_module, "load_config", _load_config)
+    monkeypatch.setattr(sys, "argv", ["aw-watcher-window", "--displays", ":10", *option])
+
+    with pytest.raises(SystemExit):
+        config_module.parse_args()
+
+    assert f"{option[0]} is not supported with --displays" in capsys.readouterr().err
+
+
+def test_displays_take_the_spool_and_merging(monkeypatch):
+    monkeypatch.setattr(config_module, "load_config", _load_config)
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["aw-watcher-window", "--displays", ":10", "--spool", "spool.db", "--merge-interval", "60"],
+    )
+
+    args = config_module.parse_args()
+
+    assert (args.displays, args.spool, args.merge_interval) == ([":10"], "spool.db", 60.0)
+
+
+def test_keepalive_and_coalescing_are_separate(monkeypatch):
+    monkeypatch.setattr(config_module, "load_config", _load_config)
+    monkeypatch.setattr(sys, "argv", ["aw-watcher-window"])
+
+    args = config_module.parse_args()
+
+    # a low-rate keep-alive for the events strategy, and no coalescing of polls
+    assert (args.keepalive_time, args.coalesce_time) == (10.0, 0.0)
@@ -0,0 +1,147 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import requests
+from aw_core.models import Event
+
+from aw_watcher_window.heartbeat import EventMerger, HeartbeatCoalescer
+
+from conftest import FakeServer
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def replay(samples, keepalive_time, pulsetime):
+    server = FakeServer()
+    coalescer = HeartbeatCoalescer(server, "bucket", keepalive_time)
+    for t, data in samples:
+        coalescer.heartbeat(Event(timestamp=START + timedelta(seconds=t), data=data), pulsetime)
+    coalescer.flush(pulsetime)
+    return server, coalescer
+
+
+def random_samples(rng, n, poll_time):
+    apps = [{"app": "Firefox", "title": "a"}, {"app": "Firefox", "title": "b"}, {"app": "Code", "title": "c"}]
+    t = 0.0
+    data = apps[0]
+    samples = []
+    for _ in range(n):
+        if rng.random() < 0.05:
+            data = rng.choice(apps)
+        # jitter, and the occasional long stall (suspend, loaded machine)
+        t += poll_time * rng.uniform(0.9, 1.3) + (rng.uniform(0, 20) if rng.random() < 0.02 else 0)
+        samples.append((t, dict(data)))
+    return samples
+
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("keepalive_time", [0.0, 3.0, 10.0, 60.0])
+def test_timeline_identical_to_uncoalesced(seed, keepalive_time):
+    rng = random.Random(seed)
+    poll_time = rng.choice([1.0, 2.0, 5.0])
+    pulsetime = max(poll_time * 1.5, poll_time + 1.0)
+    samples = random_samples(rng, 500, poll_time)
+
+    expected, _ = replay(samples, 0.0, pulsetime)
+    actual, coalescer = replay(samples, keepalive_time, pulsetime)
+
+    assert actual.timeline() == expected.timeline()
+    assert coalescer.sent == actual.requests
+
+
+def test_unchanged_window_is_forwarded_at_keepalive_rate():
+    samples = [(float(t), {"app": "Firefox", "title": "a"}) for t in range(100)]
+
+    server, coalescer = replay(samples, keepalive_time=10.0, pulsetime=2.0)
+
+    assert server.timeline() == [(START, timedelta(seconds=99), {"app": "Firefox", "title": "a"})]
+    # first heartbeat, one every 10s after that, and the final flush
+    assert server.requests == 11
+    assert coalescer.stats()["suppressed"] == 89
+
+
+def test_window_change_sends_held_back_heartbeat_first():
+    samples = [(0.0, {"app": "a"}), (1.0, {"app": "a"}), (2.0, {"app": "a"}), (3.0, {"app": "b"})]
+
+    server, _ = replay(samples, keepalive_time=10.0, pulsetime=2.0)
+
+    assert server.timeline() == [
+        (START, timedelta(seconds=2), {"app": "a"}),
+        (START + timedelta(seconds=3), timedelta(0), {"app": "b"}),
+    ]
+
+
+class FakeBulkServer(FakeServer):
+    """Also takes events in bulk, and can be made to fail like an unreachable server."""
+
+    def __init__(self):
+        super().__init__()
+        self.down = False
+
+    def _check(self):
+        if self.down:
+            raise requests.ConnectionError("server is down")
+
+    def heartbeat(self, bucket_id, event, pulsetime, queued=False):
+        assert not queued
+        self._check()
+        super().heartbeat(bucket_id, event, pulsetime)
+
+    def insert_events(self, bucket_id, events):
+        self._check()
+        self.requests += 1
+        self.events.extend(Event(timestamp=e.timestamp, duration=e.duration, data=e.data) for e in events)
+
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("flush_interval", [1.0, 30.0, 600.0])
+def test_merged_timeline_identical_to_heartbeats(seed, flush_interval):
+    rng = random.Random(seed)
+    poll_time = rng.choice([1.0, 2.0, 5.0])
+    pulsetime = max(poll_time * 1.5, poll_time + 1.0)
+    samples = random_samples(rng, 500, poll_time)
+    expected, _ = replay(samples, 0.0, pulsetime)
+
+    server = FakeBulkServer()
+    merger = EventMerger(server, flush_interval)
+    for t, data in samples:
+        # The server goes away every now and then
+        server.down = rng.random() < 0.1
+        merger.heartbeat("bucket", Event(timestamp=START + timedelta(seconds=t), data=data), pulsetime)
+    server.down = False
+    assert merger.flush()
+
+    assert server.timeline() == expected.timeline()
+    # Per flush at most: the end of the previous span, an insert, and the current span.
+    # Failed requests don't reach the server.
+    duration = samples[-1][0] - samples[0][0]
+    assert server.requests <= 3 * (duration / flush_interval + 2)
+
+
+def test_merger_behind_coalescer():
+    samples = [(float(t), {"app": "Firefox", "title": "a" if t < 50 else "b"}) for t in range(100)]
+    expected, _ = replay(samples, 0.0, 2.0)
+
+    server = FakeBulkServer()
+    merger = EventMerger(server, 60.0)
+    coalescer = HeartbeatCoalescer(merger, "bucket", 10.0)
+    for t, data in samples:
+        coalescer.heartbeat(Event(timestamp=START + timedelta(seconds=t), data=data), 2.0)
+    coalescer.flush(2.0)
+    merger.flush()
+
+    assert server.timeline() == expected.timeline()
+    # Two flushes at most, each an insert and a heartbeat
+    assert server.requests <= 4
+
+
+def test_crash_loses_at_most_one_flush_interval():
+    server = FakeBulkServer()
+    merger = EventMerger(server, 60.0)
+    for t in range(3600):
+        merger.heartbeat("bucket", Event(timestamp=START + timedelta(seconds=t), data={"app": "kiosk"}), 2.0)
+    # No final flush: the process died
+
+    (event,) = server.events
+    assert event.duration >= timedelta(seconds=3599 - 60)
@@ -0,0 +1,327 @@
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+from Xlib import X, Xatom
+
+import aw_watcher_window.main as main_module
+from aw_watcher_window import pipeline
+from aw_watcher_window.inventory import Inventory, InventoryRecorder, apply
+from aw_watcher_window.xlib_events import (
+    ROOT_EVENT_MASK,
+    WINDOW_EVENT_MASK,
+    ActiveWindowWatcher,
+    EventDispatcher,
+)
+
+from test_xprop import ATOMS, ROOT
+from test_xprop import FakeDisplay as PropertyDisplay
+
+
+class FakeWindow:
+    def __init__(self, window_id):
+        self.id = window_id
+        self.event_mask = None
+
+    def change_attributes(self, event_mask, onerror=None):
+        self.event_mask = event_mask
+
+
+class FakeDisplay(PropertyDisplay):
+    """Windows with properties, and the events of their creation, destruction and changes."""
+
+    def __init__(self, n_windows):
+        super().__init__(n_windows)
+        self.root = FakeWindow(ROOT)
+        self.windows = {}
+        self.events = []
+        # window_ids stays as created
+        self.properties[(ROOT, ATOMS["_NET_CLIENT_LIST"])] = (32, list(self.window_ids))
+
+    def screen(self):
+        return SimpleNamespace(root=self.root)
+
+    def create_resource_object(self, kind, window_id):
+        return self.windows.setdefault(window_id, FakeWindow(window_id))
+
+    def flush(self):
+        pass
+
+    def pending_events(self):
+        return len(self.events)
+
+    def next_event(self):
+        return self.events.pop(0)
+
+    # Helpers for tests
+
+    @property
+    def client_list(self):
+        return self.properties[(ROOT, ATOMS["_NET_CLIENT_LIST"])][1]
+
+    def create_window(self, window_id, cls="New", desktop=0, pid=5000):
+        self.properties[(window_id, Xatom.WM_CLASS)] = (8, f"{cls.lower()}\0{cls}\0".encode())
+        self.properties[(window_id, ATOMS["_NET_WM_DESKTOP"])] = (32, [desktop])
+        self.properties[(window_id, ATOMS["_NET_WM_PID"])] = (32, [pid])
+        self.events.append(
+            SimpleNamespace(type=X.CreateNotify, parent=self.root, window=FakeWindow(window_id))
+        )
+        self.client_list.append(window_id)
+        self.property_notify(ROOT, ATOMS["_NET_CLIENT_LIST"])
+
+    def destroy_window(self, window_id):
+        for key in [key for key in self.properties if key[0] == window_id]:
+            del self.properties[key]
+        self.client_list.remove(window_id)
+        self.events.append(
+            SimpleNamespace(type=X.DestroyNotify, event=FakeWindow(window_id), window=FakeWindow(window_id))
+        )
+        self.property_notify(ROOT, ATOMS["_NET_CLIENT_LIST"])
+
+    def set_desktop(self, window_id, desktop):
+        self.properties[(window_id, ATOMS["_NET_WM_DESKTOP"])] = (32, [desktop])
+        self.property_notify(window_id, ATOMS["_NET_WM_DESKTOP"])
+
+    def property_notify(self, window_id, atom):
+        self.events.append(
+            SimpleNamespace(type=X.PropertyNotify, window=FakeWindow(window_id), atom=atom)
+        )
+
+
+def open_inventory(display):
+    return Inventory(display, EventDispatcher(display), send=display.send)
+
+
+def test_first_snapshot_is_full():
+    display = FakeDisplay(3)
+    inventory = open_inventory(display)
+
+    inventory.update()
+
+    assert inventory.snapshot(full=True) == {
+        "snapshot": "full",
+        "count": 3,
+        "windows": [
+            {"id": hex(0x1000000 + i), "class": f"App{i}", "desktop": i % 3, "pid": 1000 + i}
+            for i in range(3)
+        ],
+    }
+    # the client list, then the properties of every window in one batch
+    assert inventory.round_trips == 2
+    assert display.requests == 1 + 3 * 3
+    assert display.root.event_mask == ROOT_EVENT_MASK
+    assert all(display.windows[w].event_mask == WINDOW_EVENT_MASK for w in display.window_ids)
+
+
+def test_watcher_created_after_the_inventory_keeps_its_events():
+    # the order after a reconnect: the inventory on the first fetch, the watcher after
+    display = FakeDisplay(2)
+    dispatcher = EventDispatcher(display)
+    Inventory(display, dispatcher, send=display.send).update()
+    display.root.get_full_property = lambda atom, property_type: None
+
+    ActiveWindowWatcher(dispatcher)
+
+    assert display.root.event_mask == ROOT_EVENT_MASK
+
+
+def test_nothing_is_asked_for_without_events():
+    display = FakeDisplay(3)
+    inventory = open_inventory(display)
+    inventory.update()
+    inventory.snapshot(full=True)
+    requests = display.requests
+
+    inventory.update()
+
+    assert inventory.snapshot() is None
+    assert display.requests == requests
+
+
+def test_delta_of_created_window():
+    display = FakeDisplay(3)
+    inventory = open_inventory(display)
+    inventory.update()
+    inventory.snapshot(full=True)
+    requests = display.requests
+
+    display.create_window(0x2000000, cls="Terminal", desktop=1, pid=4242)
+    inventory.update()
+
+    assert inventory.snapshot() == {
+        "snapshot": "delta",
+        "count": 4,
+        "added": [{"id": "0x2000000", "class": "Terminal", "desktop": 1, "pid": 4242}],
+        "removed": [],
+        "changed": [],
+    }
+    # the client list and the new window only
+    assert display.requests - requests == 1 + 3
+
+
+def test_delta_of_destroyed_window():
+    display = FakeDisplay(3)
+    inventory = open_inventory(display)
+    inventory.update()
+    inventory.snapshot(full=True)
+
+    display.destroy_window(display.window_ids[1])
+    inventory.update()
+
+    assert inventory.snapshot() == {
+        "snapshot": "delta",
+        "count": 2,
+        "added": [],
+        "removed": [hex(display.window_ids[1])],
+        "changed": [],
+    }
+
+
+def test_destroy_notify_alone_removes_window():
+    display = FakeDisplay(2)
+    inventory = open_inventory(display)
+    inventory.update()
+    requests = display.requests
+
+    window_id = display.window_ids[0]
+    display.events.append(
+        SimpleNamespace(type=X.DestroyNotify, event=FakeWindow(window_id), window=FakeWindow(window_id))
+    )
+    inventory.update()
+
+    assert window_id not in inventory.windows
+    assert display.requests == requests
+
+
+def test_delta_of_changed_window():
+    display = FakeDisplay(3)
+    inventory = open_inventory(display)
+    inventory.update()
+    inventory.snapshot(full=True)
+    requests = display.requests
+
+    display.set_desktop(display.window_ids[0], 2)
+    # not a property we keep
+    display.property_notify(display.window_ids[1], ATOMS["_NET_WM_NAME"])
+    inventory.update()
+
+    assert inventory.snapshot() == {
+        "snapshot": "delta",
+        "count": 3,
+        "added": [],
+        "removed": [],
+        "changed": [{"id": hex(display.window_ids[0]), "class": "App0", "desktop": 2, "pid": 1000}],
+    }
+    assert display.requests - requests == 3
+
+
+def test_window_gone_between_snapshots_is_left_out():
+    display = FakeDisplay(1)
+    inventory = open_inventory(display)
+    inventory.update()
+    inventory.snapshot(full=True)
+
+    display.create_window(0x2000000)
+    inventory.update()
+    display.destroy_window(0x2000000)
+    inventory.update()
+
+    assert inventory.snapshot() is None
+
+
+def test_deltas_apply_to_the_inventory():
+    display = FakeDisplay(4)
+    inventory = open_inventory(display)
+    inventory.update()
+    windows = apply({}, inventory.snapshot(full=True))
+
+    display.create_window(0x2000000)
+    display.destroy_window(display.window_ids[0])
+    display.set_desktop(display.window_ids[1], 2)
+    inventory.update()
+    windows = apply(windows, inventory.snapshot())
+    display.create_window(0x3000000, cls="Other")
+    display.set_desktop(0x2000000, 1)
+    inventory.update()
+    windows = apply(windows, inventory.snapshot())
+
+    assert windows == {hex(w.id): w.to_dict() for w in inventory.windows.values()}
+    assert len(windows) == 5
+
+
+def test_requests_are_made_while_watched():
+    display = FakeDisplay(3)
+    watching = []
+
+    @contextmanager
+    def watched():
+        watching.append(display.requests)
+        yield
+        watching[-1] = display.requests - watching[-1]
+
+    inventory = Inventory(display, EventDispatcher(display), send=display.send, watched=watched)
+    inventory.update()
+
+    assert sum(watching) == display.requests == 1 + 3 * 3
+
+
+class FakeClient:
+    def __init__(self):
+        self.heartbeats = []
+
+    def heartbeat(self, bucket_id, event, pulsetime, queued=False):
+        assert pulsetime == 0.0
+        self.heartbeats.append((bucket_id, event.data))
+
+
+def test_recorder_sends_keyframes_and_deltas():
+    display = FakeDisplay(2)
+    inventory = open_inventory(display)
+    client = FakeClient()
+    now = [0.0]
+    recorder = InventoryRecorder(
+        client, "inventory", 10.0, lambda: inventory, keyframe_every=3, clock=lambda: now[0]
+    )
+
+    for t in range(0, 60, 5):
+        now[0] = t
+        if t == 10:
+            display.create_window(0x2000000)
+        recorder.maybe_record()
+
+    # every 10s, with a full snapshot every third one and nothing sent when nothing changed
+    assert [data["snapshot"] for _, data in client.heartbeats] == ["full", "delta", "full"]
+    assert {bucket for bucket, _ in client.heartbeats} == {"inventory"}
+    assert recorder.stats()["snapshots"] == 6
+
+
+def test_recorder_starts_over_on_a_new_connection():
+    displays = [FakeDisplay(2), FakeDisplay(3)]
+    inventories = [open_inventory(d) for d in displays]
+    current = [inventories[0]]
+    client = FakeClient()
+    recorder = InventoryRecorder(client, "inventory", 0.0, lambda: current[0])
+
+    recorder.record()
+    recorder.record()
+    current[0] = inventories[1]
+    recorder.record()
+
+    assert [(data["snapshot"], data["count"]) for _, data in client.heartbeats] == [
+        ("full", 2),
+        ("full", 3),
+    ]
+
+
+def test_inventory_errors_dont_stop_sampling():
+    def maybe_record():
+        raise ConnectionResetError()
+
+    fetch = pipeline.inventory_recording(lambda: "window", SimpleNamespace(maybe_record=maybe_record))
+
+    assert fetch() == "window"
+
+
+@pytest.mark.parametrize("interval", [0.0, None])
+def test_no_recorder_without_interval(interval):
+    assert main_module.open_inventory_recorder(None, interval) is None
@@ -0,0 +1,119 @@
+import sys
+
+import pytest
+
+from aw_watcher_window import lib, xprop
+from aw_watcher_window.exceptions import FatalError
+from aw_watcher_window.lib import (
+    FakeWindowSource,
+    MacOSSource,
+    WindowChange,
+    WindowsSource,
+    XlibSource,
+    XpropSource,
+    get_window_source,
+)
+from aw_watcher_window.window import WindowInfo
+
+FIREFOX = WindowInfo("Firefox", "a")
+TERMINAL = WindowInfo("Terminal", "b")
+
+
+def test_changes_yields_only_changes():
+    source = FakeWindowSource([FIREFOX, FIREFOX, TERMINAL, None, None, FIREFOX])
+
+    changes = list(source.changes(poll_time=1.0))
+
+    assert [change.window for change in changes] == [FIREFOX, TERMINAL, None, FIREFOX]
+    assert source.polls == 6
+
+
+def test_changes_carry_timestamp_and_latency():
+    source = FakeWindowSource([FIREFOX, FIREFOX, TERMINAL], latency=0.25)
+
+    changes = list(source.changes(poll_time=1.0))
+
+    # each poll takes 0.25s, and 1s passes between polls
+    assert changes == [
+        WindowChange(FIREFOX, 0.25, 0.25),
+        WindowChange(TERMINAL, 2.75, 0.25),
+    ]
+
+
+def test_changes_with_a_real_clock_are_monotonic():
+    source = FakeWindowSource([FIREFOX, TERMINAL, FIREFOX], clock=lambda: next(ticks))
+    ticks = iter(range(100))
+
+    changes = list(source.changes())
+
+    assert [change.timestamp for change in changes] == [1, 3, 5]
+    assert {change.latency for change in changes} == {1}
+
+
+def test_first_window_is_yielded_even_if_none():
+    assert [c.window for c in FakeWindowSource([None]).changes()] == [None]
+
+
+def test_changes_end_when_wait_fails():
+    class Closing(FakeWindowSource):
+        def wait(self, timeout):
+            raise FatalError()
+
+    assert [c.window for c in Closing([FIREFOX, TERMINAL]).changes()] == [FIREFOX]
+
+
+def test_fake_source_takes_dicts():
+    source = FakeWindowSource([{"app": "Firefox", "title": "a"}])
+
+    assert source.get_current_window() == FIREFOX
+
+
+def test_xprop_source(monkeypatch):
+    monkeypatch.setattr(xprop, "get_active_window_id", lambda: "0x2a00003")
+    monkeypatch.setattr(
+        xprop,
+        "get_window",
+        lambda wid, active_window=False: {"name": f"title of {wid}", "class": ["navigator", "Firefox"]},
+    )
+
+    assert XpropSource().get_current_window() == WindowInfo("Firefox", "title of 0x2a00003")
+
+
+def test_xprop_source_without_active_window(monkeypatch):
+    monkeypatch.setattr(xprop, "get_active_window_id", lambda: "0x0")
+
+    assert XpropSource().get_current_window() is None
+
+
+@pytest.mark.parametrize(
+    "platform, strategy, expected",
+    [
+        ("linux", None, XlibSource),
+        ("linux", "xprop", XpropSource),
+        ("darwin", "jxa", MacOSSource),
+        ("darwin", "applescript", MacOSSource),
+        ("win32", None, WindowsSource),
+    ],
+)
+def test_get_window_source(monkeypatch, platform, strategy, expected):
+    monkeypatch.setattr(sys, "platform", platform)
+
+    assert type(get_window_source(strategy)) is expected
+
+
+@pytest.mark.parametrize("platform, strategy", [("darwin", None), ("darwin", "swift"), ("sunos5", None)])
+def test_get_window_source_unsupported(monkeypatch, platform, strategy):
+    monkeypatch.setattr(sys, "platform", platform)
+
+    with pytest.raises(FatalError):
+        get_window_source(strategy)
+
+
+def test_sources_delegate_to_platform_functions(monkeypatch):
+    monkeypatch.setattr(lib, "get_current_window_windows", lambda: FIREFOX._asdict())
+    monkeypatch.setattr(lib, "get_current_window_macos", lambda strategy: {"app": strategy, "title": ""})
+    monkeypatch.setattr(lib, "get_window_info_linux", lambda: TERMINAL)
+
+    assert WindowsSource().get_current_window() == FIREFOX
+    assert MacOSSource("applescript").get_current_window() == WindowInfo("applescript", "")
+    assert XlibSource().get_current_window() == TERMINAL
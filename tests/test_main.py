@@ -1,20 +1,21 @@
+import os
 import re
+import signal
 from types import SimpleNamespace
 
 import pytest
 
 import aw_watcher_window.main as main_module
+from aw_watcher_window import aio
 from aw_watcher_window.macos_cli import build_swift_command
 
 
 def test_research_mode_passes_map_to_macos_swift_strategy(monkeypatch):
     commands = []
 
-    class FakeProcess:
-        pid = 123
-
-        def wait(self):
-            return None
+    async def run_swift(command):
+        commands.append(command)
+        return 0
 
     class FakeClient:
         client_name = "aw-watcher-window"
@@ -37,18 +38,15 @@ def test_research_mode_passes_map_to_macos_swift_strategy(monkeypatch):
             return False
 
     monkeypatch.setattr(main_module.sys, "platform", "darwin")
-    monkeypatch.setattr(main_module, "background_ensure_permissions", lambda: None)
-    monkeypatch.setattr(main_module, "setup_logging", lambda **kwargs: None)
-    monkeypatch.setattr(main_module, "ActivityWatchClient", FakeClient)
-    monkeypatch.setattr(main_module.signal, "signal", lambda *args, **kwargs: None)
     monkeypatch.setattr(
-        main_module.subprocess,
-        "Popen",
-        lambda command: commands.append(command) or FakeProcess(),
+        "aw_watcher_window.macos_permissions.background_ensure_permissions", lambda: None
     )
+    monkeypatch.setattr("aw_core.log.setup_logging", lambda **kwargs: None)
+    monkeypatch.setattr("aw_client.ActivityWatchClient", FakeClient)
+    monkeypatch.setattr(main_module.signal, "signal", lambda *args, **kwargs: None)
+    monkeypatch.setattr(aio, "run_swift", run_swift)
     monkeypatch.setattr(
-        main_module,
-        "parse_args",
+        "aw_watcher_window.config.parse_args",
         lambda: SimpleNamespace(
             testing=True,
             verbose=False,
@@ -60,6 +58,12 @@ def test_research_mode_passes_map_to_macos_swift_strategy(monkeypatch):
             research_enabled=True,
             research_category_map={"youtube": "Youtube"},
             research_app_category_map={},
+            metrics_port=None,
+            metrics_socket=None,
+            profile=None,
+            profile_rate=5.0,
+            profile_rotate=3600.0,
+            displays=[],
         ),
     )
 
@@ -213,3 +217,41 @@ def test_pulsetime_scales_with_poll_time(
     poll_time: float, expected_pulsetime: float
 ):
     assert main_module.compute_pulsetime(poll_time) == expected_pulsetime
+
+
+def test_window_cache_stats_are_logged_on_exit(monkeypatch, caplog):
+    monkeypatch.setattr(main_module.sys, "platform", "linux")
+
+    with caplog.at_level("DEBUG", logger=main_module.__name__):
+        main_module.log_backend_stats()
+
+    assert "X window cache: {'hits'" in caplog.text
+
+
+def test_sigterm_exits_through_finally_blocks():
+    previous = signal.getsignal(signal.SIGTERM)
+    flushed = []
+
+    with pytest.raises(SystemExit):
+        with main_module.exit_on_sigterm():
+            try:
+                os.kill(os.getpid(), signal.SIGTERM)
+            finally:
+                flushed.append(True)
+
+    assert flushed == [True]
+    assert signal.getsignal(signal.SIGTERM) is previous
+
+
+def test_recorder_is_closed_when_the_loop_stops(tmp_path):
+    with pytest.raises(KeyboardInterrupt):
+        with main_module.open_recorder(str(tmp_path / "trace.awwt")) as recorder:
+            recorder.write({"app": "a", "title": "x"})
+            raise KeyboardInterrupt()
+
+    assert recorder._file.closed
+
+
+def test_no_recorder_without_path():
+    with main_module.open_recorder(None) as recorder:
+        assert recorder is None
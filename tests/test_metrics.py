@@ -0,0 +1,280 @@
+import http.client
+import socket
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import aw_watcher_window.main as main_module
+from aw_watcher_window import xlib
+from aw_watcher_window.lib import WindowSource
+from aw_watcher_window.metrics import InstrumentedClient, Metrics, MetricsServer, instrumented_backends
+from aw_watcher_window.window import WindowInfo
+
+
+def parse(text):
+    """{(name, labels): value} of every sample in Prometheus text, labels as a frozenset of pairs."""
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        series, value = line.rsplit(" ", 1)
+        name, _, labels = series.partition("{")
+        pairs = frozenset(
+            tuple(pair.split("=", 1)) for pair in labels.rstrip("}").split(",") if pair
+        )
+        samples[(name, frozenset((k, v.strip('"')) for k, v in pairs))] = float(value)
+    return samples
+
+
+def test_timed_records_histogram():
+    metrics = Metrics()
+    timed = metrics.timed("fetch", lambda x: x * 2)
+
+    assert [timed(i) for i in range(3)] == [0, 2, 4]
+
+    text = metrics.render()
+    samples = parse(text)
+    assert "# TYPE aw_watcher_window_stage_seconds histogram" in text
+    assert samples[("aw_watcher_window_stage_seconds_count", frozenset({("stage", "fetch")}))] == 3
+    inf = ("aw_watcher_window_stage_seconds_bucket", frozenset({("stage", "fetch"), ("le", "+Inf")}))
+    assert samples[inf] == 3
+    buckets = [
+        value
+        for (name, labels), value in samples.items()
+        if name == "aw_watcher_window_stage_seconds_bucket"
+    ]
+    # cumulative
+    assert buckets == sorted(buckets)
+
+
+def test_timed_counts_errors_by_type():
+    metrics = Metrics()
+
+    def fail(error):
+        raise error
+
+    timed = metrics.timed("fetch", fail)
+    for error in [ValueError(), ValueError(), KeyError()]:
+        with pytest.raises(type(error)):
+            timed(error)
+
+    samples = parse(metrics.render())
+    errors = "aw_watcher_window_errors_total"
+    assert samples[(errors, frozenset({("stage", "fetch"), ("type", "ValueError")}))] == 2
+    assert samples[(errors, frozenset({("stage", "fetch"), ("type", "KeyError")}))] == 1
+    # failed calls are timed too
+    assert samples[("aw_watcher_window_stage_seconds_count", frozenset({("stage", "fetch")}))] == 3
+
+
+def test_watched_counts_polls_and_unknowns():
+    windows = [
+        WindowInfo("Firefox", "a"),
+        WindowInfo("unknown", "unknown"),
+        WindowInfo("Terminal", "unknown"),
+        None,
+    ]
+    metrics = Metrics()
+    fetch = metrics.watched(lambda: windows.pop(0))
+
+    assert [fetch() for _ in range(4)][-1] is None
+
+    samples = parse(metrics.render())
+    assert samples[("aw_watcher_window_polls_total", frozenset())] == 4
+    assert samples[("aw_watcher_window_no_window_total", frozenset())] == 1
+    assert samples[("aw_watcher_window_unknown_total", frozenset({("field", "app")}))] == 1
+    assert samples[("aw_watcher_window_unknown_total", frozenset({("field", "title")}))] == 2
+
+
+def test_collected_stats_are_gauges():
+    metrics = Metrics()
+    stats = {"depth": 3, "max_depth": 7, "overflow": "coalesce", "full": True}
+    metrics.collect("sample_queue", lambda: stats)
+    metrics.collect("broken", lambda: 1 / 0)
+
+    text = metrics.render()
+    samples = parse(text)
+    assert "# TYPE aw_watcher_window_sample_queue gauge" in text
+    assert samples[("aw_watcher_window_sample_queue", frozenset({("stat", "depth")}))] == 3
+    stats["depth"] = 0
+    assert parse(metrics.render())[("aw_watcher_window_sample_queue", frozenset({("stat", "depth")}))] == 0
+    # only numbers
+    assert {labels for name, labels in samples if name == "aw_watcher_window_sample_queue"} == {
+        frozenset({("stat", "depth")}),
+        frozenset({("stat", "max_depth")}),
+    }
+
+
+def test_label_values_are_escaped():
+    metrics = Metrics()
+    metrics.count("errors_total", stage='a"b\\c\nd')
+
+    assert 'stage="a\\"b\\\\c\\nd"' in metrics.render()
+
+
+def test_heartbeat_loop_is_instrumented(monkeypatch):
+    polls = []
+
+    class Source(WindowSource):
+        def get_current_window(self):
+            polls.append(1)
+            if len(polls) == 5:
+                monkeypatch.setattr(main_module.os, "getppid", lambda: 1)
+            return WindowInfo("app", str(len(polls) % 2))
+
+    class Client:
+        def heartbeat(self, bucket_id, event, pulsetime, queued=False):
+            pass
+
+    metrics = Metrics()
+    main_module.heartbeat_loop(
+        Client(),
+        "bucket",
+        poll_time=0.001,
+        strategy=None,
+        queue_size=10,
+        metrics=metrics,
+        source=Source(),
+    )
+
+    samples = parse(metrics.render())
+
+    def count(stage):
+        return samples[("aw_watcher_window_stage_seconds_count", frozenset({("stage", stage)}))]
+
+    assert samples[("aw_watcher_window_polls_total", frozenset())] == 5
+    assert count("get_current_window") == 5
+    assert count("get_window_info") == 5
+    assert count("transform") == 5
+    # two distinct windows, transformed once each
+    assert count("transform_window") == 2
+    assert count("heartbeat") == 5
+    assert samples[("aw_watcher_window_sample_queue", frozenset({("stat", "depth")}))] == 0
+    assert samples[("aw_watcher_window_transform_cache", frozenset({("stat", "hits")}))] == 3
+    assert ("aw_watcher_window_heartbeat_coalescer", frozenset({("stat", "suppressed")})) in samples
+
+
+def test_instrumented_backends_xlib(monkeypatch):
+    class Query:
+        def query(self):
+            raise xlib.Xlib.error.ConnectionClosedError("server")
+
+    connection = SimpleNamespace(active_window_query=Query())
+    monkeypatch.setattr(main_module.sys, "platform", "linux")
+    monkeypatch.setattr(xlib, "connect", lambda: connection)
+    get_window_class = xlib.get_window_class
+    query = Query.query
+    metrics = Metrics()
+
+    with instrumented_backends(metrics):
+        with pytest.raises(xlib.Xlib.error.ConnectionClosedError):
+            xlib.connect().active_window_query.query()
+        # only the query of the connection is timed
+        assert Query.query is query
+        assert "query" in vars(connection.active_window_query)
+        assert xlib.get_window_class is not get_window_class
+
+    samples = parse(metrics.render())
+    errors = frozenset({("stage", "xlib_active_window_query"), ("type", "ConnectionClosedError")})
+    assert samples[("aw_watcher_window_errors_total", errors)] == 1
+    assert ("aw_watcher_window_xlib_window_cache", frozenset({("stat", "hits")})) in samples
+    # put back on exit
+    assert "query" not in vars(connection.active_window_query)
+    assert xlib.connect() is connection
+    assert xlib.get_window_class is get_window_class
+
+
+def test_instrumented_client_passes_through():
+    class Client:
+        server_address = "http://localhost:5600"
+
+        def heartbeat(self, *args, **kwargs):
+            return "queued"
+
+    metrics = Metrics()
+    client = InstrumentedClient(Client(), metrics)
+
+    assert client.heartbeat("bucket", None, pulsetime=1.0) == "queued"
+    assert client.server_address == "http://localhost:5600"
+    assert "heartbeat" in metrics.stages
+
+
+def test_serves_over_http():
+    metrics = Metrics()
+    metrics.count("polls_total")
+    server = MetricsServer(metrics, port=0)
+    server.start()
+    try:
+        host, port = server.address
+        assert host == "127.0.0.1"
+        connection = http.client.HTTPConnection(host, port, timeout=5)
+        connection.request("GET", "/metrics")
+        response = connection.getresponse()
+        body = response.read().decode()
+        connection.request("GET", "/other")
+        missing = connection.getresponse()
+        missing.read()
+    finally:
+        server.stop()
+
+    assert response.status == 200
+    assert response.getheader("Content-Type").startswith("text/plain; version=0.0.4")
+    assert "aw_watcher_window_polls_total 1" in body
+    assert missing.status == 404
+
+
+def test_serves_over_unix_socket(tmp_path):
+    path = str(tmp_path / "metrics.sock")
+    (tmp_path / "metrics.sock").write_text("stale")
+    metrics = Metrics()
+    metrics.count("polls_total", 2)
+    server = MetricsServer(metrics, path=path)
+    server.start()
+    try:
+        with socket.socket(socket.AF_UNIX) as sock:
+            sock.settimeout(5)
+            sock.connect(path)
+            sock.sendall(b"GET /metrics HTTP/1.0\r\n\r\n")
+            response = b""
+            while True:
+                data = sock.recv(4096)
+                if not data:
+                    break
+                response += data
+    finally:
+        server.stop()
+
+    assert response.startswith(b"HTTP/1.0 200")
+    assert b"aw_watcher_window_polls_total 2" in response
+    assert not (tmp_path / "metrics.sock").exists()
+
+
+def test_server_needs_one_address():
+    with pytest.raises(ValueError):
+        MetricsServer(Metrics())
+
+
+def per_call(func, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        func()
+    return (time.perf_counter() - start) / n
+
+
+@pytest.mark.benchmark
+def test_benchmark_overhead():
+    """What instrumenting costs per call, against the milliseconds a poll takes."""
+    n = 100_000
+    metrics = Metrics()
+
+    def fetch():
+        return None
+
+    bare = min(per_call(fetch, n) for _ in range(3))
+    timed = metrics.timed("fetch", fetch)
+    instrumented = min(per_call(timed, n) for _ in range(3))
+
+    print(f"\nper call: bare {bare * 1e9:.0f} ns, timed {instrumented * 1e9:.0f} ns")
+    # Disabled there is no wrapper at all (see test_startup for the import), enabled it
+    # is a couple of microseconds, well under a millisecond poll
+    assert instrumented - bare < 20e-6
@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+from aw_watcher_window.replay import (
+    FakeClock,
+    TraceSample,
+    TraceSource,
+    main,
+    percentiles,
+    replay,
+    synthetic_trace,
+)
+from aw_watcher_window.exceptions import FatalError
+from aw_watcher_window.window import WindowInfo
+
+
+TRACE = [
+    TraceSample(0.0, "Firefox", "YouTube", "https://youtube.com"),
+    TraceSample(10.0, "Code", "main.py"),
+    TraceSample(25.0, "Firefox", "My bank"),
+    TraceSample(30.0, "Code", "main.py"),
+]
+
+
+def test_trace_source_follows_clock():
+    clock = FakeClock()
+    source = TraceSource(TRACE, clock)
+
+    assert source() == WindowInfo("Firefox", "YouTube", "https://youtube.com")
+    clock.sleep(10)
+    assert source() == WindowInfo("Code", "main.py")
+    clock.sleep(17)
+    assert source().title == "My bank"
+    clock.sleep(3)
+    assert source().title == "main.py"
+    clock.sleep(0.1)
+    with pytest.raises(FatalError):
+        source()
+
+
+def test_replay_results():
+    results = replay(TRACE, poll_time=1.0, exclude_titles=["bank"])
+
+    assert results["trace"] == {"samples": 4, "duration_s": 30.0}
+    assert results["polls"] == 31
+    assert results["heartbeats"] == 31
+    assert set(results["stages"]) == {"get_current_window", "transform_window", "heartbeat"}
+    for stage in results["stages"].values():
+        assert stage["count"] >= 31
+        assert 0 <= stage["p50_us"] <= stage["p99_us"] <= stage["max_us"]
+    assert results["transform_cache"]["misses"] == 3
+    assert results["memory"]["peak_bytes"] > 0
+
+
+def test_replay_counts_coalesced_heartbeats():
+    results = replay(synthetic_trace(3600), poll_time=1.0, keepalive_time=10.0, measure_memory=False)
+
+    assert "memory" not in results
+    assert results["heartbeats"] < results["polls"] / 2
+    assert results["heartbeats"] == results["coalescing"]["sent"]
+
+
+def test_percentiles():
+    stats = percentiles([i / 1e6 for i in range(1, 101)])
+
+    assert stats["count"] == 100
+    assert stats["p50_us"] == pytest.approx(51)
+    assert stats["p99_us"] == pytest.approx(100)
+    assert percentiles([]) == {"count": 0}
+
+
+def test_main_writes_json(tmp_path):
+    trace_file = tmp_path / "trace.jsonl"
+    trace_file.write_text(
+        "\n".join(json.dumps(sample._asdict()) for sample in TRACE) + "\n"
+    )
+    output = tmp_path / "results.json"
+
+    main(["--trace", str(trace_file), "--no-memory", "--output", str(output)])
+
+    results = json.loads(output.read_text())
+    assert results["polls"] == 31
+    assert results["events_per_second"] > 0
@@ -1,9 +1,14 @@
 """Tests for aw-watcher-window Research Edition filter."""
 
+import random
+import time
 import unittest
 
+import pytest
+
 from aw_watcher_window.research_filter import (
     BROWSER_APPS,
+    ResearchClassifier,
     classify_app,
     classify_title,
     is_browser,
@@ -342,5 +347,111 @@ class TestTransformWithAppMap(unittest.TestCase):
         self.assertEqual(window, original)
 
 
+class TestResearchClassifier(unittest.TestCase):
+    # Small alphabet with mixed case, so that random patterns overlap, repeat and
+    # nest in each other, and random texts contain several of them at once.
+    ALPHABET = "abAB.c/ "
+
+    def random_string(self, rng, max_length):
+        return "".join(rng.choice(self.ALPHABET) for _ in range(rng.randint(0, max_length)))
+
+    def random_map(self, rng, size, max_length):
+        return {
+            self.random_string(rng, max_length): f"category {i}" for i in range(size)
+        }
+
+    def test_classify_title_equivalent_on_random_maps(self):
+        rng = random.Random(0)
+        for _ in range(200):
+            category_map = self.random_map(rng, rng.randint(0, 30), 5)
+            classifier = ResearchClassifier(category_map)
+            for _ in range(20):
+                title = self.random_string(rng, 30)
+                url = self.random_string(rng, 30) if rng.random() < 0.5 else ""
+                self.assertEqual(
+                    classifier.classify_title(title, url=url),
+                    classify_title(title, category_map, url=url),
+                    (category_map, title, url),
+                )
+
+    def test_classify_app_equivalent_on_random_maps(self):
+        rng = random.Random(1)
+        for _ in range(200):
+            # Keys that only differ in case/whitespace: the first one has to win
+            app_category_map = {
+                rng.choice(["", " "]) + self.random_string(rng, 3) + rng.choice(["", " "]): f"category {i}"
+                for i in range(rng.randint(0, 20))
+            }
+            classifier = ResearchClassifier({}, app_category_map)
+            for _ in range(20):
+                app = self.random_string(rng, 4)
+                self.assertEqual(
+                    classifier.classify_app(app),
+                    classify_app(app, app_category_map),
+                    (app_category_map, app),
+                )
+
+    def test_transform_equivalent(self):
+        category_map = {"youtube": "Youtube", "gmail": "Email"}
+        app_category_map = {"Microsoft Outlook": "Email", "Spotify": "Music"}
+        classifier = ResearchClassifier(category_map, app_category_map)
+        for window in (
+            {"app": "Firefox", "title": "YouTube", "url": "https://gmail.com", "incognito": True},
+            {"app": "Firefox", "title": "Nothing"},
+            {"app": "microsoft outlook", "title": "Inbox"},
+            {"app": "Terminal", "title": "bash"},
+        ):
+            self.assertEqual(
+                classifier.transform(window),
+                transform(window, category_map, app_category_map),
+            )
+
+    def test_empty_pattern_matches_everything(self):
+        classifier = ResearchClassifier({"youtube": "Youtube", "": "Other"})
+        self.assertEqual(classifier.classify_title("YouTube"), "Youtube")
+        self.assertEqual(classifier.classify_title(""), "Other")
+
+    def test_large_map_matches_linear(self):
+        category_map, titles = large_map_case()
+        classifier = ResearchClassifier(category_map)
+        self.assertEqual(
+            [classifier.classify_title(title) for title in titles],
+            [classify_title(title, category_map) for title in titles],
+        )
+
+    @pytest.mark.benchmark
+    def test_benchmark_large_map(self):
+        """A compiled classifier should not slow down with thousands of map entries."""
+        category_map, titles = large_map_case()
+        classifier = ResearchClassifier(category_map)
+
+        start = time.perf_counter()
+        for title in titles:
+            classify_title(title, category_map)
+        linear_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for title in titles:
+            classifier.classify_title(title)
+        compiled_time = time.perf_counter() - start
+
+        self.assertLess(compiled_time, linear_time)
+        print(
+            f"\n{len(category_map)} patterns: linear {linear_time / len(titles) * 1e6:.0f}us/title, "
+            f"compiled {compiled_time / len(titles) * 1e6:.0f}us/title"
+        )
+
+
+def large_map_case():
+    rng = random.Random(2)
+    words = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(8)) for _ in range(5000)]
+    category_map = {word: f"category {i % 20}" for i, word in enumerate(words)}
+    titles = [
+        " ".join(rng.choice(words) if rng.random() < 0.1 else "lorem" for _ in range(6))
+        for _ in range(200)
+    ]
+    return category_map, titles
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,199 @@
+import itertools
+import os
+import signal
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from aw_core.models import Event
+
+import aw_watcher_window.main as main_module
+from aw_watcher_window.exceptions import FatalError
+from aw_watcher_window.lib import FakeWindowSource, WindowSource
+from aw_watcher_window.window import WindowInfo
+from aw_watcher_window.sampler import Sample, SampleQueue, StageTimings, run_threaded
+
+from conftest import FakeServer
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def sample(t, title="a", pulsetime=2.0):
+    return Sample(WindowInfo("app", title), START + timedelta(seconds=t), pulsetime)
+
+
+def send_all(server, samples):
+    for s in samples:
+        server.heartbeat("bucket", Event(timestamp=s.timestamp, duration=s.duration, data=s.window.to_dict()), s.pulsetime)
+
+
+def drain(queue):
+    samples = []
+    while len(queue):
+        samples.append(queue.get())
+    return samples
+
+
+def test_drop_oldest():
+    queue = SampleQueue(3, "drop-oldest")
+    for t in range(5):
+        queue.put(sample(t))
+
+    assert [s.timestamp for s in drain(queue)] == [START + timedelta(seconds=t) for t in (2, 3, 4)]
+    assert queue.stats()["dropped"] == 2
+    assert queue.stats()["max_depth"] == 3
+
+
+def test_coalesce_is_lossless():
+    titles = "aaaaabbbaaaaaaaacc"
+    samples = [sample(t, title) for t, title in enumerate(titles)]
+    queue = SampleQueue(3, "coalesce")
+    for s in samples:
+        queue.put(s)
+
+    coalesced = drain(queue)
+    assert [s.window.title for s in coalesced] == ["b", "a", "c"]
+    assert queue.stats()["dropped"] == 1
+    assert queue.stats()["coalesced"] == len(titles) - 4
+
+    # What got through is the same on the server as sending every sample
+    expected, actual = FakeServer(), FakeServer()
+    send_all(expected, samples[5:])
+    send_all(actual, coalesced)
+    assert actual.timeline() == expected.timeline()
+
+
+def test_coalesce_keeps_gaps_longer_than_pulsetime():
+    # polled every second, then the machine was suspended for a minute
+    samples = [sample(t) for t in (0, 1, 2, 62, 63)]
+    queue = SampleQueue(10, "coalesce")
+    for s in samples:
+        queue.put(s)
+
+    coalesced = drain(queue)
+    assert [(s.timestamp, s.duration) for s in coalesced] == [
+        (START, timedelta(seconds=2)),
+        (START + timedelta(seconds=62), timedelta(seconds=1)),
+    ]
+    expected, actual = FakeServer(), FakeServer()
+    send_all(expected, samples)
+    send_all(actual, coalesced)
+    assert actual.timeline() == expected.timeline()
+
+
+def test_get_times_out():
+    assert SampleQueue(1).get(timeout=0.01) is None
+
+
+def test_rejects_unknown_policy():
+    with pytest.raises(ValueError):
+        SampleQueue(1, "drop-newest")
+
+
+def test_run_threaded_sends_everything_then_stops():
+    stop = threading.Event()
+    sent = []
+
+    def sample_loop(emit):
+        for t in range(20):
+            emit(sample(t, title=str(t)))
+
+    timings = StageTimings()
+    run_threaded(sample_loop, sent.append, SampleQueue(100), stop, timings)
+
+    assert [s.window.title for s in sent] == [str(t) for t in range(20)]
+    assert timings.stats()["queue_wait"]["count"] == 20
+
+
+def test_run_threaded_sends_samples_put_while_stopping():
+    stop = threading.Event()
+    queue = SampleQueue(10)
+    sent = []
+
+    def sample_loop(emit):
+        emit(sample(0, title="a"))
+        # the sender has sent it and waits for the next one
+        time.sleep(0.1)
+        stop.set()
+        queue.wake()
+        # and has seen the stop by now, like after a SIGTERM in the middle of a poll
+        time.sleep(0.1)
+        emit(sample(1, title="b"))
+
+    run_threaded(sample_loop, sent.append, queue, stop)
+
+    assert [s.window.title for s in sent] == ["a", "b"]
+
+
+def test_slow_sample_does_not_hold_back_sending(monkeypatch):
+    """While one X call hangs, heartbeats of the samples taken before it still go out."""
+    hang = threading.Event()
+    hanging = threading.Event()
+    sent = threading.Event()
+    calls = []
+
+    class Source(WindowSource):
+        def get_current_window(self):
+            calls.append(1)
+            if len(calls) == 3:
+                hanging.set()
+                hang.wait(5)
+                raise FatalError()
+            return WindowInfo("app", str(len(calls)))
+
+    class Client:
+        def heartbeat(self, bucket_id, event, pulsetime, queued=False):
+            if event.data["title"] == "2":
+                sent.set()
+
+    thread = threading.Thread(
+        target=main_module.heartbeat_loop,
+        args=(Client(), "bucket"),
+        kwargs=dict(poll_time=0.01, strategy=None, queue_size=10, source=Source()),
+    )
+    thread.start()
+    try:
+        assert hanging.wait(2)
+        assert sent.wait(2)
+        assert not hang.is_set()
+    finally:
+        hang.set()
+        thread.join(5)
+    assert not thread.is_alive()
+
+
+def test_sigterm_stops_cleanly(monkeypatch):
+    source = FakeWindowSource(itertools.repeat(WindowInfo("app", "x")))
+    server = FakeServer()
+    timer = threading.Timer(0.3, os.kill, (os.getpid(), signal.SIGTERM))
+    previous = signal.getsignal(signal.SIGTERM)
+
+    timer.start()
+    start = time.monotonic()
+    main_module.heartbeat_loop(
+        server, "bucket", poll_time=0.01, strategy=None, coalesce_time=60.0, queue_size=10, source=source
+    )
+
+    assert time.monotonic() - start < 3
+    # The coalesced heartbeats were flushed: the event covers the whole run
+    (event,) = server.events
+    assert event.duration >= timedelta(seconds=0.2)
+    assert signal.getsignal(signal.SIGTERM) is previous
+
+
+def test_parent_death_stops_sampler(monkeypatch):
+    polls = []
+
+    class Source(WindowSource):
+        def get_current_window(self):
+            polls.append(1)
+            if len(polls) == 5:
+                monkeypatch.setattr(main_module.os, "getppid", lambda: 1)
+            return WindowInfo("app", "x")
+
+    server = FakeServer()
+    main_module.heartbeat_loop(server, "bucket", poll_time=0.01, strategy=None, queue_size=10, source=Source())
+
+    assert len(polls) == 5
+    assert len(server.events) == 1
@@ -0,0 +1,139 @@
+import random
+
+import pytest
+
+import aw_watcher_window.main as main_module
+from aw_watcher_window.lib import FakeWindowSource
+from aw_watcher_window.window import WindowInfo
+from aw_watcher_window.schedule import AdaptivePollInterval, Histogram, Scheduler
+
+from conftest import FakeClock
+
+
+def test_backs_off_geometrically_up_to_ceiling():
+    interval = AdaptivePollInterval(1.0, 10.0, backoff=2.0)
+
+    assert [interval.next(False) for _ in range(6)] == [2.0, 4.0, 8.0, 10.0, 10.0, 10.0]
+    assert interval.next(True) == 1.0
+    assert interval.next(False) == 2.0
+
+
+def test_fixed_interval_when_min_equals_max():
+    interval = AdaptivePollInterval(1.0, 1.0)
+
+    assert {interval.next(changed) for changed in [False, True, False]} == {1.0}
+
+
+def test_rejects_invalid_bounds():
+    with pytest.raises(ValueError):
+        AdaptivePollInterval(5.0, 1.0)
+    with pytest.raises(ValueError):
+        AdaptivePollInterval(1.0, 5.0, backoff=0.5)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_switch_detection_latency_is_bounded(seed):
+    rng = random.Random(seed)
+    min_interval, max_interval = 0.5, 8.0
+    interval = AdaptivePollInterval(min_interval, max_interval)
+
+    switches = sorted(rng.uniform(0, 3600) for _ in range(200))
+    t = 0.0
+    seen = 0
+    latencies = []
+    polls = 0
+    while t < 3600:
+        changed = False
+        while seen < len(switches) and switches[seen] <= t:
+            latencies.append(t - switches[seen])
+            seen += 1
+            changed = True
+        polls += 1
+        t += interval.next(changed)
+
+    assert max(latencies) <= max_interval
+    # much fewer polls than polling at min_interval all the time
+    assert polls < 3600 / min_interval / 2
+
+
+def test_pulsetime_follows_interval_actually_used():
+    windows = [WindowInfo("a", "x")] * 5 + [WindowInfo("b", "y")] * 2
+    clock = FakeClock()
+    heartbeats = []
+
+    class FakeClient:
+        def heartbeat(self, bucket_id, event, pulsetime, queued=False):
+            heartbeats.append(pulsetime)
+
+    main_module.heartbeat_loop(
+        FakeClient(),
+        "bucket",
+        poll_time=1.0,
+        strategy=None,
+        max_poll_time=4.0,
+        scheduler=Scheduler(clock=clock, sleep=clock.sleep),
+        source=FakeWindowSource(windows),
+    )
+
+    sleeps = clock.sleeps
+    assert sleeps == [1.0, 2.0, 4.0, 4.0, 4.0, 1.0, 2.0]
+    intervals_used = [1.0] + sleeps[:6]
+    assert heartbeats == [main_module.compute_pulsetime(i) for i in intervals_used]
+
+
+def test_scheduler_does_not_drift_with_work():
+    clock = FakeClock()
+    scheduler = Scheduler(clock=clock, sleep=clock.sleep)
+    start = clock.now
+
+    for _ in range(100):
+        clock.work(0.3)
+        scheduler.wait(1.0)
+
+    # sleep(poll_time) after the work would end at start + 130
+    assert clock.now == pytest.approx(start + 100.0)
+    assert clock.sleeps == [pytest.approx(0.7)] * 100
+    assert scheduler.skipped == 0
+
+
+def test_scheduler_skips_missed_ticks_instead_of_bursting():
+    clock = FakeClock()
+    scheduler = Scheduler(clock=clock, sleep=clock.sleep)
+    start = clock.now
+
+    clock.work(3.5)  # e.g. a hung X call
+    scheduler.wait(1.0)
+    # runs right away, on the latest missed tick
+    assert clock.sleeps == []
+    assert scheduler.skipped == 2
+    assert scheduler.deadline == pytest.approx(start + 3.0)
+
+    scheduler.wait(1.0)
+    assert clock.now == pytest.approx(start + 4.0)
+
+
+def test_scheduler_pulsetime_grows_with_lateness():
+    clock = FakeClock()
+    scheduler = Scheduler(clock=clock, sleep=clock.sleep)
+    minimum = main_module.compute_pulsetime(5.0)
+
+    assert scheduler.pulsetime(5.0, minimum) == minimum
+
+    clock.oversleep = 2.0
+    for _ in range(10):
+        scheduler.wait(5.0)
+
+    assert scheduler.lateness.quantile(0.99) == 2.0
+    assert scheduler.pulsetime(5.0, minimum) == 9.0
+
+
+def test_histogram_quantiles():
+    histogram = Histogram(bounds=(0.01, 0.1, 1.0))
+    for value in [0.005] * 90 + [0.05] * 9 + [3.0]:
+        histogram.add(value)
+
+    assert histogram.quantile(0.5) == 0.01
+    assert histogram.quantile(0.99) == 0.1
+    assert histogram.quantile(1.0) == 3.0
+    assert histogram.stats()["count"] == 100
+    assert Histogram().quantile(0.99) == 0.0
@@ -0,0 +1,293 @@
+from types import SimpleNamespace
+
+import pytest
+
+import aw_watcher_window.main as main_module
+from aw_watcher_window import seats as seats_module
+from aw_watcher_window.exceptions import FatalError
+from aw_watcher_window.schedule import Scheduler
+from aw_watcher_window.seats import (
+    open_seats,
+    seat_bucket_id,
+    seats_event_loop,
+    seats_loop,
+)
+from aw_watcher_window.xlib_events import ActiveWindowWatcher, EventDispatcher, wait_any
+from aw_watcher_window.xlib_watchdog import StalledCallError
+
+from conftest import FakeClock
+from test_xlib_events import FakeDisplay
+
+
+class FakeClient:
+    def __init__(self):
+        self.buckets = []
+        self.heartbeats = []
+
+    def create_bucket(self, bucket_id, event_type, queued=False):
+        self.buckets.append(bucket_id)
+
+    def heartbeat(self, bucket_id, event, pulsetime, queued=False):
+        self.heartbeats.append((bucket_id, dict(event.data)))
+
+    def sent(self, bucket_id):
+        return [data for bucket, data in self.heartbeats if bucket == bucket_id]
+
+
+class FakeConnection:
+    """An XConnection whose windows come from a list, closing when it runs out."""
+
+    def __init__(self, name, windows):
+        self.name = name
+        self.windows = list(windows)
+
+    def get_current_window_info(self):
+        if not self.windows:
+            raise FatalError()
+        return self.windows.pop(0)
+
+
+def test_seat_bucket_id():
+    assert seat_bucket_id("aw-watcher-window_host", ":10") == "aw-watcher-window_host_display-10"
+    assert seat_bucket_id("b", ":10.1") == "b_display-10.1"
+    assert seat_bucket_id("b", "thin-client:3") == "b_display-thin-client-3"
+
+
+def test_open_seats_skips_unreachable_displays():
+    client = FakeClient()
+
+    def connect(name):
+        if name == ":12":
+            raise ConnectionRefusedError()
+        return FakeConnection(name, [])
+
+    seats = open_seats(client, "bucket", "currentwindow", [":10", ":11", ":12"], connect=connect)
+
+    assert [seat.name for seat in seats] == [":10", ":11"]
+    assert client.buckets == ["bucket_display-10", "bucket_display-11"]
+
+
+def test_seats_loop_reports_into_seat_buckets(monkeypatch):
+    monkeypatch.setattr(seats_module.os, "getppid", lambda: 1000)
+    client = FakeClient()
+    connections = {
+        ":10": FakeConnection(":10", [("Firefox", "a")] * 3),
+        ":11": FakeConnection(":11", [("Firefox", "a"), ("Terminal", "b"), None, ("Terminal", "b")]),
+    }
+    seats = open_seats(client, "bucket", "currentwindow", connections, connect=connections.get)
+    transformed = []
+
+    def transform_window(window, **config):
+        transformed.append(window)
+        return main_module.transform_window(window, **config)
+
+    monkeypatch.setattr(seats_module, "transform_window", transform_window)
+    clock = FakeClock()
+    seats_loop(
+        seats, poll_time=1.0, scheduler=Scheduler(clock=clock, sleep=clock.sleep), exclude_title=True
+    )
+
+    assert client.sent("bucket_display-10") == [{"app": "Firefox", "title": "excluded"}] * 3
+    assert client.sent("bucket_display-11") == [
+        {"app": "Firefox", "title": "excluded"},
+        {"app": "Terminal", "title": "excluded"},
+        {"app": "unknown", "title": "excluded"},
+        {"app": "Terminal", "title": "excluded"},
+    ]
+    # one transform pipeline for all seats: each window is transformed once
+    assert len(transformed) == 3
+    # ran until the last seat was gone
+    assert len(clock.sleeps) == 4
+
+
+def test_seats_share_interned_strings(monkeypatch):
+    monkeypatch.setattr(seats_module.os, "getppid", lambda: 1000)
+    # equal, but not the same objects, like titles decoded from two connections
+    title_a, title_b = "".join(["Fire", "fox"]), "".join(["Firef", "ox"])
+    assert title_a is not title_b
+    connections = {":10": FakeConnection(":10", []), ":11": FakeConnection(":11", [])}
+    seats = open_seats(FakeClient(), "bucket", "currentwindow", connections, connect=connections.get)
+    connections[":10"].windows.append(("app", title_a))
+    connections[":11"].windows.append(("app", title_b))
+
+    assert seats[0].fetch_window().title is seats[1].fetch_window().title
+
+
+class DisplayConnection:
+    """An XConnection on a FakeDisplay, with the window name per window id."""
+
+    def __init__(self, name, titles, max_fetches=100):
+        self.name = name
+        self.display = FakeDisplay()
+        self.dispatcher = EventDispatcher(self.display)
+        self.titles = titles
+        self.fetches = 0
+        self.max_fetches = max_fetches
+
+    def get_current_window_info(self):
+        self.fetches += 1
+        if self.fetches > self.max_fetches:
+            raise FatalError()
+        return ("app", self.titles[self.display.active_window_id])
+
+    def active_window_watcher(self):
+        return ActiveWindowWatcher(self.dispatcher)
+
+
+@pytest.fixture
+def display_connections():
+    connections = {
+        ":10": DisplayConnection(":10", {0x100: "a", 0x200: "b"}, max_fetches=3),
+        ":11": DisplayConnection(":11", {0x100: "c"}, max_fetches=1),
+    }
+    yield connections
+    for connection in connections.values():
+        connection.display.close()
+
+
+def test_seats_event_loop_samples_seats_that_changed(monkeypatch, display_connections):
+    monkeypatch.setattr(seats_module.os, "getppid", lambda: 1000)
+    client = FakeClient()
+    seats = open_seats(
+        client, "bucket", "currentwindow", display_connections, connect=display_connections.get
+    )
+    now = [0.0]
+    waits = []
+
+    def wait(watchers, timeout):
+        waits.append(timeout)
+        if len(waits) == 1:
+            display_connections[":10"].display.set_active_window(0x200)
+            return wait_any(watchers, timeout)
+        # nothing happens until the keep-alive
+        now[0] += timeout
+        return wait_any(watchers, 0.0)
+
+    monkeypatch.setattr(seats_module, "wait_any", wait)
+    seats_event_loop(seats, keepalive_time=60.0, clock=lambda: now[0])
+
+    assert client.sent("bucket_display-10") == [
+        {"app": "app", "title": "a"},
+        # the previous window, extended up to the switch
+        {"app": "app", "title": "a"},
+        {"app": "app", "title": "b"},
+        # keep-alive
+        {"app": "app", "title": "b"},
+    ]
+    # not sampled for the switch on :10, then dropped at the keep-alive as its connection failed
+    assert client.sent("bucket_display-11") == [{"app": "app", "title": "c"}]
+    assert display_connections[":11"].fetches == 2
+    assert waits == [60.0, 60.0, 60.0]
+
+
+def test_seats_event_loop_keeps_alive(monkeypatch, display_connections):
+    monkeypatch.setattr(seats_module.os, "getppid", lambda: 1000)
+    client = FakeClient()
+    seats = open_seats(
+        client, "bucket", "currentwindow", display_connections, connect=display_connections.get
+    )
+
+    seats_event_loop(seats, keepalive_time=0.01)
+
+    assert client.sent("bucket_display-10") == [{"app": "app", "title": "a"}] * 3
+    assert client.sent("bucket_display-11") == [{"app": "app", "title": "c"}]
+
+
+def test_wait_any_returns_the_watchers_that_changed():
+    displays = [FakeDisplay(), FakeDisplay()]
+    try:
+        watchers = [ActiveWindowWatcher(EventDispatcher(d)) for d in displays]
+
+        assert wait_any(watchers, 0.01) == []
+        displays[1].set_active_window(0x200)
+        assert wait_any(watchers, 1.0) == [watchers[1]]
+        assert wait_any(watchers, 0.01) == []
+    finally:
+        for d in displays:
+            d.close()
+
+
+def test_seat_watcher_follows_reconnects():
+    connection = SimpleNamespace(name=":10", dispatcher=EventDispatcher(FakeDisplay()))
+    connection.active_window_watcher = lambda: ActiveWindowWatcher(connection.dispatcher)
+    seat = seats_module.Seat(connection, coalescer=None)
+
+    first = seat.watcher()
+    assert seat.watcher() is first
+    old_display = connection.dispatcher.display
+    connection.dispatcher = EventDispatcher(FakeDisplay())
+    assert seat.watcher() is not first
+    assert seat.watcher().dispatcher is connection.dispatcher
+
+    old_display.close()
+    connection.dispatcher.display.close()
+
+
+class FailingConnection(DisplayConnection):
+    """A DisplayConnection whose watchers fail with *errors*, one per watcher made."""
+
+    def __init__(self, name, titles, errors, max_fetches=100):
+        super().__init__(name, titles, max_fetches)
+        self.errors = list(errors)
+
+    def active_window_watcher(self):
+        if self.errors:
+            raise self.errors.pop(0)
+        return super().active_window_watcher()
+
+
+def test_seats_event_loop_drops_only_the_seat_whose_watcher_failed(monkeypatch):
+    monkeypatch.setattr(seats_module.os, "getppid", lambda: 1000)
+    connections = {
+        ":10": DisplayConnection(":10", {0x100: "a"}, max_fetches=3),
+        ":11": FailingConnection(":11", {0x100: "c"}, [FatalError()]),
+    }
+    client = FakeClient()
+    seats = open_seats(client, "bucket", "currentwindow", connections, connect=connections.get)
+
+    seats_event_loop(seats, keepalive_time=0.01)
+
+    assert client.sent("bucket_display-10") == [{"app": "app", "title": "a"}] * 3
+    assert client.sent("bucket_display-11") == [{"app": "app", "title": "c"}]
+    for connection in connections.values():
+        connection.display.close()
+
+
+def test_seats_event_loop_samples_a_stalled_seat_again(monkeypatch):
+    monkeypatch.setattr(seats_module.os, "getppid", lambda: 1000)
+    connection = FailingConnection(
+        ":10", {0x100: "a"}, [StalledCallError("aborted")], max_fetches=2
+    )
+    client = FakeClient()
+    seats = open_seats(
+        client, "bucket", "currentwindow", [":10"], connect=lambda name: connection
+    )
+    now = [0.0]
+    waits = []
+
+    def wait(watchers, timeout):
+        waits.append(timeout)
+        now[0] += timeout
+        return wait_any(watchers, 0.0)
+
+    monkeypatch.setattr(seats_module, "wait_any", wait)
+    seats_event_loop(seats, keepalive_time=60.0, clock=lambda: now[0])
+
+    # sampled again without waiting for the keep-alive, then watched on the new connection
+    # until the keep-alive, when its connection failed
+    assert client.sent("bucket_display-10") == [{"app": "app", "title": "a"}] * 2
+    assert waits == [0.0, 60.0]
+    connection.display.close()
+
+
+def test_seats_send_through_a_merger(monkeypatch):
+    monkeypatch.setattr(seats_module.os, "getppid", lambda: 1000)
+    client = FakeClient()
+    connections = {":10": FakeConnection(":10", [("Firefox", "a")] * 2)}
+    with main_module.merging(client, 60.0) as sink:
+        seats = open_seats(sink, "bucket", "currentwindow", connections, connect=connections.get)
+        clock = FakeClock()
+        seats_loop(seats, poll_time=1.0, scheduler=Scheduler(clock=clock, sleep=clock.sleep))
+
+    assert client.buckets == ["bucket_display-10"]
+    assert client.sent("bucket_display-10")
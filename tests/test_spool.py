@@ -0,0 +1,266 @@
+import json
+import random
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from aw_client import ActivityWatchClient
+from aw_core.models import Event
+from aw_transform.heartbeats import heartbeat_merge
+
+from aw_watcher_window.heartbeat import HeartbeatCoalescer
+from aw_watcher_window.spool import Spool, SpoolingClient
+
+from conftest import FakeServer
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class FakeAWServer:
+    """Just enough of aw-server's REST API to create buckets and merge heartbeats."""
+
+    def __init__(self):
+        self.up = True
+        self.buckets = {}
+        self.requests = 0
+        self.inserts = 0
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                fake.requests += 1
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                url = urlparse(self.path)
+                parts = url.path.strip("/").split("/")
+                if not fake.up:
+                    self.send_response(503)
+                elif parts[:3] == ["api", "0", "buckets"] and len(parts) == 4:
+                    self.send_response(304 if parts[3] in fake.buckets else 200)
+                    fake.buckets.setdefault(parts[3], [])
+                elif parts[4:] == ["heartbeat"] and parts[3] in fake.buckets:
+                    pulsetime = float(parse_qs(url.query)["pulsetime"][0])
+                    fake.heartbeat(parts[3], Event(**body), pulsetime)
+                    self.send_response(200)
+                elif parts[4:] == ["events"] and parts[3] in fake.buckets:
+                    fake.inserts += 1
+                    fake.buckets[parts[3]].extend(Event(**e) for e in body)
+                    self.send_response(200)
+                else:
+                    self.send_response(404)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"{}")
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def heartbeat(self, bucket_id, event, pulsetime):
+        events = self.buckets[bucket_id]
+        if events and heartbeat_merge(events[-1], event, pulsetime):
+            return
+        events.append(event)
+
+    def timeline(self, bucket_id):
+        return [(e.timestamp, e.duration, dict(e.data)) for e in self.buckets[bucket_id]]
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def server():
+    s = FakeAWServer()
+    yield s
+    s.close()
+
+
+def make_client(port):
+    return ActivityWatchClient("aw-watcher-window-test", host="127.0.0.1", port=str(port), testing=True)
+
+
+def heartbeats(n, seed=0, start=START):
+    rng = random.Random(seed)
+    windows = [{"app": "Firefox", "title": "a"}, {"app": "Code", "title": "b"}, {"app": "Slack", "title": "c"}]
+    data = windows[0]
+    t = 0.0
+    for _ in range(n):
+        if rng.random() < 0.05:
+            data = rng.choice(windows)
+        t += rng.uniform(0.9, 1.3) + (rng.uniform(0, 10) if rng.random() < 0.02 else 0)
+        yield Event(timestamp=start + timedelta(seconds=t), data=dict(data)), 2.0
+
+
+def test_merges_into_spans(tmp_path):
+    spool = Spool(str(tmp_path / "spool.db"))
+    for i in range(10):
+        spool.add("bucket", Event(timestamp=START + timedelta(seconds=i), data={"a": 1}), 2.0)
+    spool.add("bucket", Event(timestamp=START + timedelta(seconds=10), data={"a": 2}), 2.0)
+    # A gap longer than pulsetime starts a new span even with the same data
+    spool.add("bucket", Event(timestamp=START + timedelta(seconds=20), data={"a": 2}), 2.0)
+
+    spans = spool.pending(100)
+    assert [(s.to_event().timestamp, s.to_event().duration, s.to_event().data) for s in spans] == [
+        (START, timedelta(seconds=9), {"a": 1}),
+        (START + timedelta(seconds=10), timedelta(0), {"a": 2}),
+        (START + timedelta(seconds=20), timedelta(0), {"a": 2}),
+    ]
+
+
+def test_timeline_identical_after_outage(server, tmp_path):
+    client = make_client(server.port)
+    sink = SpoolingClient(client, Spool(str(tmp_path / "spool.db")), batch_size=7)
+    sink.create_bucket("bucket", "currentwindow")
+    reference = FakeServer()
+    samples = list(heartbeats(600))
+
+    for i, (event, pulsetime) in enumerate(samples):
+        # The server is down for the middle third, and flushed every 50 heartbeats
+        server.up = not (200 <= i < 400)
+        sink.heartbeat("bucket", event, pulsetime)
+        reference.heartbeat("bucket", event, pulsetime)
+        if i % 50 == 49:
+            assert sink.flush() == server.up
+    server.up = True
+    assert sink.flush()
+
+    assert server.timeline("bucket") == reference.timeline()
+    # Only the growing tail of the bucket is left
+    assert len(sink.spool) == 1
+    # Spans were sent, not every heartbeat
+    assert sink.sent < len(samples) / 4
+
+
+def test_backlog_is_inserted_in_pages(server, tmp_path):
+    sink = SpoolingClient(make_client(server.port), Spool(str(tmp_path / "spool.db")), batch_size=10)
+    sink.create_bucket("bucket", "currentwindow")
+    reference = FakeServer()
+    server.up = False
+    for event, pulsetime in heartbeats(600, seed=3):
+        sink.heartbeat("bucket", event, pulsetime)
+        reference.heartbeat("bucket", event, pulsetime)
+    pending = len(sink.spool)
+    server.up = True
+
+    assert sink.flush()
+
+    assert server.timeline("bucket") == reference.timeline()
+    # A request per page of finished spans, and a heartbeat for the tail
+    assert server.inserts == -(-(pending - 1) // 10)
+    assert sink.requests == server.inserts + 1
+
+
+def test_survives_restart(server, tmp_path):
+    path = str(tmp_path / "spool.db")
+    reference = FakeServer()
+    samples = list(heartbeats(300, seed=1))
+    server.up = False
+
+    sink = SpoolingClient(make_client(server.port), Spool(path))
+    sink.create_bucket("bucket", "currentwindow")
+    for event, pulsetime in samples[:150]:
+        sink.heartbeat("bucket", event, pulsetime)
+        reference.heartbeat("bucket", event, pulsetime)
+    assert not sink.flush()
+    sink.spool.close()
+
+    server.up = True
+    sink = SpoolingClient(make_client(server.port), Spool(path))
+    sink.create_bucket("bucket", "currentwindow")
+    for event, pulsetime in samples[150:]:
+        sink.heartbeat("bucket", event, pulsetime)
+        reference.heartbeat("bucket", event, pulsetime)
+    assert sink.flush()
+
+    assert server.timeline("bucket") == reference.timeline()
+
+
+def test_unreachable_server(tmp_path):
+    # Nothing listens on this port once the server is closed
+    closed = FakeAWServer()
+    closed.close()
+    sink = SpoolingClient(make_client(closed.port), Spool(str(tmp_path / "spool.db")))
+    for event, pulsetime in heartbeats(50):
+        sink.heartbeat("bucket", event, pulsetime)
+
+    assert not sink.flush()
+    assert len(sink.spool) > 0
+
+
+def test_size_cap_drops_oldest(tmp_path):
+    spool = Spool(str(tmp_path / "spool.db"), max_spans=5)
+    for i in range(20):
+        spool.add("bucket", Event(timestamp=START + timedelta(seconds=i), data={"i": i}), 2.0)
+
+    spans = spool.pending(100)
+    assert [json.loads(s.data)["i"] for s in spans] == [15, 16, 17, 18, 19]
+    assert spool.dropped == 15
+
+
+def test_compaction_shrinks_file(server, tmp_path):
+    path = tmp_path / "spool.db"
+    spool = Spool(str(path))
+    for i in range(300):
+        spool.add("bucket", Event(timestamp=START + timedelta(seconds=i), data={"title": "x" * 4000 + str(i)}), 2.0)
+    sink = SpoolingClient(make_client(server.port), spool, batch_size=1000)
+    sink.create_bucket("bucket", "currentwindow")
+    spool.compact()
+    full_size = path.stat().st_size
+
+    assert sink.flush()
+
+    assert len(spool) == 1
+    assert path.stat().st_size < full_size / 10
+    assert not (tmp_path / "spool.db-wal").exists() or (tmp_path / "spool.db-wal").stat().st_size == 0
+
+
+def test_wal_is_left_alone_without_a_backlog(server, tmp_path):
+    path = tmp_path / "spool.db"
+    sink = SpoolingClient(make_client(server.port), Spool(str(path)))
+    sink.create_bucket("bucket", "currentwindow")
+
+    for i in range(5):
+        sink.heartbeat("bucket", Event(timestamp=START + timedelta(seconds=i), data={"a": 1}), 2.0)
+        assert sink.flush()
+
+    # Only the tail went out, every time: nothing to checkpoint for
+    assert (tmp_path / "spool.db-wal").stat().st_size > 0
+
+
+def test_span_extended_while_being_sent_is_kept(tmp_path):
+    spool = Spool(str(tmp_path / "spool.db"))
+    spool.add("bucket", Event(timestamp=START, data={"a": 1}), 2.0)
+    (span,) = spool.pending(10)
+    # Meanwhile the span grows, and then a new one follows it
+    spool.add("bucket", Event(timestamp=START + timedelta(seconds=1), data={"a": 1}), 2.0)
+    spool.add("bucket", Event(timestamp=START + timedelta(seconds=2), data={"a": 2}), 2.0)
+
+    spool.mark_sent(span)
+
+    assert [(s.id, s.duration) for s in spool.pending(10)][0] == (span.id, 1_000_000)
+
+
+def test_behind_coalescer_with_background_thread(server, tmp_path):
+    sink = SpoolingClient(make_client(server.port), Spool(str(tmp_path / "spool.db")), flush_interval=0.01)
+    sink.create_bucket("bucket", "currentwindow")
+    reference = FakeServer()
+    coalescer = HeartbeatCoalescer(sink, "bucket", keepalive_time=10.0)
+    reference_coalescer = HeartbeatCoalescer(reference, "bucket", keepalive_time=10.0)
+
+    sink.start()
+    for event, pulsetime in heartbeats(300, seed=2):
+        coalescer.heartbeat(event, pulsetime)
+        reference_coalescer.heartbeat(event, pulsetime)
+    coalescer.flush(2.0)
+    reference_coalescer.flush(2.0)
+    sink.stop()
+
+    assert server.timeline("bucket") == reference.timeline()
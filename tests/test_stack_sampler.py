@@ -0,0 +1,120 @@
+import os
+import signal
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from aw_watcher_window.stack_sampler import StackSampler
+
+
+def read(path):
+    with open(path) as f:
+        return dict(line.rsplit(" ", 1) for line in f.read().splitlines())
+
+
+def waiting_in_poll(ready, release):
+    ready.set()
+    release.wait(5)
+
+
+@pytest.fixture
+def busy_thread():
+    ready, release = threading.Event(), threading.Event()
+    thread = threading.Thread(target=waiting_in_poll, args=(ready, release), name="sampler-test")
+    thread.start()
+    ready.wait(5)
+    yield thread
+    release.set()
+    thread.join(5)
+
+
+def fake_now():
+    times = iter(datetime(2026, 1, 1) + timedelta(hours=h) for h in range(100))
+    return lambda: next(times)
+
+
+def test_sample_collapses_stacks_of_other_threads(tmp_path, busy_thread):
+    sampler = StackSampler(str(tmp_path), dump_signal=None, now=fake_now())
+    for _ in range(3):
+        sampler.sample()
+
+    path = sampler.dump()
+
+    assert os.path.basename(path) == "aw-watcher-window-20260101-000000-0000.folded"
+    stacks = read(path)
+    (stack,) = [s for s in stacks if s.startswith("sampler-test;")]
+    frames = stack.split(";")
+    # root first, the innermost frame last
+    assert "test_stack_sampler:waiting_in_poll" in frames
+    assert frames.index("threading:run") < frames.index("test_stack_sampler:waiting_in_poll")
+    assert stacks[stack] == "3"
+    # the calling thread isn't sampled
+    assert not any("test_sample_collapses_stacks" in s for s in stacks)
+
+
+def test_dump_starts_counting_afresh(tmp_path, busy_thread):
+    sampler = StackSampler(str(tmp_path), dump_signal=None, now=fake_now())
+    sampler.sample()
+    sampler.dump()
+
+    assert sampler.dump() is None
+    sampler.sample()
+    assert all(count == "1" for count in read(sampler.dump()).values())
+
+
+def test_only_newest_files_are_kept(tmp_path, busy_thread):
+    sampler = StackSampler(str(tmp_path), keep=3, dump_signal=None, now=fake_now())
+    (tmp_path / "unrelated.txt").write_text("")
+    paths = []
+    for _ in range(5):
+        sampler.sample()
+        paths.append(sampler.dump())
+
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        [os.path.basename(p) for p in paths[-3:]] + ["unrelated.txt"]
+    )
+
+
+def test_rotates_on_interval(tmp_path, busy_thread):
+    sampler = StackSampler(str(tmp_path), rate=200, rotate_interval=0.05, dump_signal=None)
+    sampler.start()
+    time.sleep(0.5)
+    sampler.stop()
+
+    files = os.listdir(tmp_path)
+    assert 3 <= len(files)
+    assert not [f for f in files if f.endswith(".tmp")]
+
+
+def test_sample_rate_bounds_samples(tmp_path, busy_thread):
+    sampler = StackSampler(str(tmp_path), rate=20, dump_signal=None)
+    sampler.start()
+    time.sleep(0.5)
+    sampler.stop()
+
+    # ~10, however fast sampling is
+    assert 5 <= sampler.samples <= 12
+
+
+def test_dumps_on_signal(tmp_path, busy_thread):
+    previous = signal.getsignal(signal.SIGUSR1)
+    sampler = StackSampler(str(tmp_path), rate=100)
+    sampler.start()
+    try:
+        time.sleep(0.1)
+        os.kill(os.getpid(), signal.SIGUSR1)
+        deadline = time.monotonic() + 5
+        while not os.listdir(tmp_path) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(os.listdir(tmp_path)) == 1
+    finally:
+        sampler.stop()
+
+    assert signal.getsignal(signal.SIGUSR1) is previous
+
+
+def test_rate_must_be_positive(tmp_path):
+    with pytest.raises(ValueError):
+        StackSampler(str(tmp_path), rate=0)
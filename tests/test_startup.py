@@ -0,0 +1,130 @@
+import builtins
+import json
+import os
+import subprocess
+import sys
+
+from aw_watcher_window.startup import StartupProfiler
+
+IMPORT_ALL = """
+import json, logging, os, signal, sys, threading
+
+threads = threading.active_count()
+files = sorted(os.listdir("."))
+sigterm = signal.getsignal(signal.SIGTERM)
+
+import aw_watcher_window
+import aw_watcher_window.lib
+import aw_watcher_window.main
+
+modules = sorted(sys.modules)
+
+import aw_watcher_window.aio
+import aw_watcher_window.replay
+import aw_watcher_window.xlib
+import aw_watcher_window.xlib_events
+import aw_watcher_window.xprop
+
+print(json.dumps({
+    "threads": threading.active_count() - threads,
+    "new_files": sorted(set(os.listdir(".")) - set(files)),
+    "sigterm_changed": signal.getsignal(signal.SIGTERM) is not sigterm,
+    "log_handlers": len(logging.getLogger().handlers),
+    "connected": aw_watcher_window.xlib._connection is not None,
+    "modules": modules,
+}))
+"""
+
+
+def test_imports_have_no_side_effects(tmp_path):
+    """Importing must not connect to anything, start threads or touch files, even without a display."""
+    env = {k: v for k, v in os.environ.items() if k != "DISPLAY"}
+    env["PYTHONPATH"] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env["HOME"] = str(tmp_path)
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_ALL],
+        cwd=tmp_path,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    report = json.loads(result.stdout)
+
+    assert report["threads"] == 0
+    assert report["new_files"] == []
+    assert not report["sigterm_changed"]
+    assert report["log_handlers"] == 0
+    assert not report["connected"]
+    assert list(tmp_path.iterdir()) == []
+    # Only loaded for the configurations that need them
+    lazy = {
+        "aw_client",
+        "aw_core",
+        "requests",
+        "sqlite3",
+        "aw_watcher_window.config",
+        "aw_watcher_window.heartbeat",
+        "aw_watcher_window.inventory",
+        "aw_watcher_window.macos_cli",
+        "aw_watcher_window.macos_permissions",
+        "aw_watcher_window.metrics",
+        "aw_watcher_window.research_filter",
+        "aw_watcher_window.seats",
+        "aw_watcher_window.spool",
+        "aw_watcher_window.stack_sampler",
+        "aw_watcher_window.title_filter",
+        "aw_watcher_window.transform_cache",
+    }
+    assert lazy.isdisjoint(report["modules"])
+
+
+def test_disabled_profiler_does_nothing():
+    original = builtins.__import__
+    profiler = StartupProfiler()
+
+    profiler.start()
+    assert builtins.__import__ is original
+    with profiler.step("step"):
+        pass
+    profiler.stop()
+
+    assert profiler.steps == []
+    assert profiler.imports == []
+
+
+def test_profiler_times_steps_and_imports(tmp_path, monkeypatch):
+    (tmp_path / "startup_outer.py").write_text("import startup_inner\nimport time\ntime.sleep(0.01)\n")
+    (tmp_path / "startup_inner.py").write_text("import time\ntime.sleep(0.02)\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    for name in ("startup_outer", "startup_inner"):
+        monkeypatch.delitem(sys.modules, name, raising=False)
+    original = builtins.__import__
+
+    profiler = StartupProfiler(enabled=True)
+    profiler.start()
+    try:
+        with profiler.step("import outer"):
+            import startup_outer  # noqa: F401
+        with profiler.step("nothing to import"):
+            import startup_outer  # noqa: F401,F811
+    finally:
+        profiler.stop()
+
+    assert builtins.__import__ is original
+    assert [name for name, _ in profiler.steps] == ["import outer", "nothing to import"]
+    assert profiler.steps[0][1] >= 0.03
+
+    timings = {timing.name: timing for timing in profiler.imports}
+    assert set(timings) == {"startup_outer", "startup_inner"}
+    outer, inner = timings["startup_outer"], timings["startup_inner"]
+    assert (outer.depth, inner.depth) == (0, 1)
+    assert inner.self_seconds >= 0.02
+    assert outer.cumulative_seconds >= inner.cumulative_seconds + 0.01
+    assert 0.01 <= outer.self_seconds < outer.cumulative_seconds
+
+    report = profiler.report()
+    assert "import outer" in report
+    assert "startup_outer" in report
+    # only imports made by the profiled code itself are listed
+    assert "startup_inner" not in report
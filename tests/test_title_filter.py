@@ -0,0 +1,150 @@
+import random
+import re
+import string
+import time
+
+import pytest
+
+import aw_watcher_window.main as main_module
+from aw_watcher_window.title_filter import TitleFilter, required_literals
+
+
+def compile_all(patterns):
+    return [re.compile(p, re.IGNORECASE) for p in patterns]
+
+
+@pytest.mark.parametrize(
+    "pattern,literals",
+    [
+        ("zoom meeting", ["zoom meeting"]),
+        (r"Slack.*huddle", ["huddle"]),
+        (r"bank(ing)? - \d+", ["bank"]),
+        (r"gmail|outlook", ["gmail", "outlook"]),
+        (r"(?x) private \s+ window", ["private"]),
+        (r"a.b", None),
+        (r"[a-z]+", None),
+        (r"foo|x", None),
+    ],
+)
+def test_required_literals(pattern, literals):
+    assert required_literals(re.compile(pattern, re.IGNORECASE)) == literals
+
+
+@pytest.mark.parametrize(
+    "title,excluded",
+    [
+        ("Zoom Meeting", True),
+        ("ZOOM MEETING - participants", True),
+        ("Slack | general huddle", True),
+        ("Slack | general", False),
+        ("My bank - 1234", True),
+        ("Inbox - Outlook", True),
+        ("ÉCOLE", True),
+        ("école", True),
+        ("", False),
+        ("Terminal", False),
+    ],
+)
+def test_matches_like_separate_patterns(title, excluded):
+    patterns = compile_all(
+        ["zoom meeting", r"Slack.*huddle", r"bank - \d+", "gmail|outlook", "école", "^$x"]
+    )
+
+    assert TitleFilter(patterns).search(title) is excluded
+    assert any(p.search(title) for p in patterns) is excluded
+
+
+def random_pattern(rng, alphabet):
+    word = "".join(rng.choice(alphabet) for _ in range(rng.randint(2, 8)))
+    kind = rng.randrange(6)
+    if kind == 0:
+        return re.escape(word)
+    if kind == 1:
+        return re.escape(word) + r"\s*-\s*\d+"
+    if kind == 2:
+        return "^" + re.escape(word[:2]) + ".*" + re.escape(word[2:]) + "$"
+    if kind == 3:
+        return re.escape(word) + "|" + re.escape(word[::-1])
+    if kind == 4:
+        return "[" + re.escape(word[:3]) + "]+" + re.escape(word)
+    return "(" + re.escape(word) + ")+"
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_randomized_equivalence(seed):
+    rng = random.Random(seed)
+    alphabet = string.ascii_letters + "äöüßİı -"
+    patterns = compile_all([random_pattern(rng, alphabet) for _ in range(200)])
+    title_filter = TitleFilter(patterns)
+
+    for _ in range(1000):
+        title = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+        if rng.random() < 0.2:
+            # make sure there are some hits
+            title += rng.choice(patterns).pattern.replace("\\", "").strip("^$()+|")
+        assert title_filter.search(title) == any(p.search(title) for p in patterns), title
+
+
+def test_transform_window_accepts_title_filter():
+    window = {"app": "Chrome", "title": "YouTube - Google Chrome"}
+
+    transformed = main_module.transform_window(
+        window, exclude_titles=main_module.compile_exclude_titles(["youtube"])
+    )
+
+    assert transformed == {"app": "Chrome", "title": "excluded"}
+
+
+def random_word(rng):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 10)))
+
+
+def realistic_case(n_patterns):
+    """Patterns and titles shaped like real ones: words, with a few regex bits thrown in."""
+    rng = random.Random(n_patterns)
+    shapes = ["{}", r"{}\s*-\s*\d+", "{}|{}", "{}.*{}", r"\b{}\b", "[a-z]+ {}"]
+    patterns = compile_all(
+        [rng.choice(shapes).format(random_word(rng), random_word(rng)) for _ in range(n_patterns)]
+    )
+    titles = []
+    for _ in range(500):
+        words = [random_word(rng) for _ in range(rng.randint(2, 8))]
+        if rng.random() < 0.05:
+            words.append(rng.choice(patterns).pattern.split("|")[0].strip("\\b"))
+        titles.append(" - ".join(words))
+    return patterns, titles
+
+
+@pytest.mark.parametrize("n_patterns", [10, 100, 300, 1000])
+def test_matches_loop_on_realistic_patterns(n_patterns):
+    patterns, titles = realistic_case(n_patterns)
+    title_filter = TitleFilter(patterns)
+
+    assert [title_filter.search(title) for title in titles] == [
+        any(p.search(title) for p in patterns) for title in titles
+    ]
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("n_patterns", [10, 100, 300, 1000])
+def test_benchmark_scaling_with_pattern_count(n_patterns):
+    patterns, titles = realistic_case(n_patterns)
+    title_filter = TitleFilter(patterns)
+
+    start = time.perf_counter()
+    for title in titles:
+        any(p.search(title) for p in patterns)
+    loop = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for title in titles:
+        title_filter.search(title)
+    filtered = time.perf_counter() - start
+
+    print(
+        f"\n{n_patterns} patterns: loop {loop / len(titles) * 1e6:.1f}us/title, "
+        f"TitleFilter {filtered / len(titles) * 1e6:.1f}us/title "
+        f"({len(title_filter.unfiltered)} patterns not prefiltered)"
+    )
+    if n_patterns >= 300:
+        assert filtered < loop
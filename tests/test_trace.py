@@ -0,0 +1,161 @@
+import itertools
+
+import pytest
+
+import aw_watcher_window.trace as trace_module
+from aw_watcher_window.replay import load_trace, synthetic_trace
+from aw_watcher_window.trace import TraceSample, TraceWriter, read_samples, read_trace
+
+from conftest import FakeClock
+
+
+def write(path, samples, clock):
+    with TraceWriter(str(path), clock=clock) as writer:
+        for t, window in samples:
+            clock.now = t
+            writer.write(window)
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / "trace.awwt"
+    clock = FakeClock(1000.0)
+    write(
+        path,
+        [
+            (1000.0, {"app": "Firefox", "title": "YouTube", "url": "https://youtube.com"}),
+            (1001.0, {"app": "Firefox", "title": "YouTube", "url": "https://youtube.com"}),
+            (1002.5, None),
+            (1003.0, {"app": "Code", "title": "Café ☕"}),
+            (1004.0, {"app": "Firefox", "title": "YouTube", "url": "https://youtube.com"}),
+            # The wall clock can jump backwards
+            (990.0, {"app": "Firefox", "title": "YouTube", "url": "https://youtube.com"}),
+        ],
+        clock,
+    )
+
+    assert list(read_samples(str(path))) == [
+        (1000.0, TraceSample(1000.0, "Firefox", "YouTube", "https://youtube.com")),
+        (1001.0, TraceSample(1001.0, "Firefox", "YouTube", "https://youtube.com")),
+        (1002.5, None),
+        (1003.0, TraceSample(1003.0, "Code", "Café ☕")),
+        (1004.0, TraceSample(1004.0, "Firefox", "YouTube", "https://youtube.com")),
+        (990.0, TraceSample(990.0, "Firefox", "YouTube", "https://youtube.com")),
+    ]
+
+
+def test_appending_starts_a_new_session(tmp_path):
+    path = tmp_path / "trace.awwt"
+    clock = FakeClock()
+    write(path, [(100.0, {"app": "a", "title": "x"})], clock)
+    write(path, [(200.0, {"app": "b", "title": "x"}), (201.0, {"app": "b", "title": "x"})], clock)
+
+    assert [(s.timestamp, s.app) for s in read_trace(str(path))] == [
+        (100.0, "a"),
+        (200.0, "b"),
+        (201.0, "b"),
+    ]
+
+
+def test_string_table_is_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(trace_module, "MAX_STRINGS", 4)
+    path = tmp_path / "trace.awwt"
+    clock = FakeClock()
+    windows = [(100.0 + i, {"app": "app", "title": f"title {i}"}) for i in range(10)]
+    write(path, windows, clock)
+
+    assert [s.window() for s in read_trace(str(path))] == [w for _, w in windows]
+
+
+def test_truncated_record_ends_trace(tmp_path):
+    path = tmp_path / "trace.awwt"
+    clock = FakeClock()
+    write(path, [(100.0, {"app": "a", "title": "x"}), (101.0, {"app": "b", "title": "a long title"})], clock)
+    data = path.read_bytes()
+    path.write_bytes(data[:-3])
+
+    assert [s.app for s in read_trace(str(path))] == ["a"]
+
+
+def test_session_after_truncated_record_is_read(tmp_path):
+    path = tmp_path / "trace.awwt"
+    clock = FakeClock()
+    write(path, [(100.0, {"app": "a", "title": "x"}), (101.0, {"app": "b", "title": "a long title"})], clock)
+    path.write_bytes(path.read_bytes()[:-3])
+
+    write(path, [(200.0, {"app": "c", "title": "y"})], clock)
+
+    assert [(s.timestamp, s.app) for s in read_trace(str(path))] == [(100.0, "a"), (200.0, "c")]
+
+
+def test_truncated_header_is_rewritten(tmp_path):
+    path = tmp_path / "trace.awwt"
+    path.write_bytes(trace_module.MAGIC[:2])
+
+    write(path, [(100.0, {"app": "a", "title": "x"})], FakeClock())
+
+    assert [s.app for s in read_trace(str(path))] == ["a"]
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "trace.jsonl"
+    path.write_text("{}\n")
+
+    with pytest.raises(ValueError):
+        list(read_trace(str(path)))
+
+
+def test_a_day_at_1hz_fits_in_a_few_hundred_kb(tmp_path):
+    path = tmp_path / "day.awwt"
+    clock = FakeClock(0.0)
+    day = synthetic_trace(24 * 3600)
+    with TraceWriter(str(path), clock=clock) as writer:
+        index = 0
+        for second in range(24 * 3600):
+            while index + 1 < len(day) and day[index + 1].timestamp <= second:
+                index += 1
+            # Poll times jitter by a few milliseconds
+            clock.now = second + (second % 7) / 1000
+            writer.write(day[index].window())
+
+    # Deterministic for a given trace and clock, so no flakiness in bounding it
+    assert path.stat().st_size < 300 * 1024
+
+    # Streamed lazily: the first samples come back without reading the rest
+    first = list(itertools.islice(read_trace(str(path)), 3))
+    assert [s.window() for s in first] == [day[0].window()] * 3
+    assert sum(1 for _ in read_trace(str(path))) == 24 * 3600
+
+
+def test_replay_loads_recorded_traces(tmp_path):
+    path = tmp_path / "trace.awwt"
+    clock = FakeClock()
+    write(path, [(100.0, {"app": "a", "title": "x"}), (101.0, None), (102.0, {"app": "b", "title": "y"})], clock)
+
+    assert load_trace(str(path)) == [TraceSample(100.0, "a", "x"), TraceSample(102.0, "b", "y")]
+
+
+def test_recording_writes_samples_before_transforms(tmp_path):
+    from aw_watcher_window.pipeline import recording
+
+    path = tmp_path / "trace.awwt"
+    windows = iter([{"app": "a", "title": "secret"}, None])
+    with TraceWriter(str(path), clock=FakeClock(1_600_000_000.0)) as writer:
+        fetch = recording(lambda: next(windows), writer)
+        assert fetch() == {"app": "a", "title": "secret"}
+        assert fetch() is None
+
+    assert [sample for _, sample in read_samples(str(path))] == [
+        TraceSample(1_600_000_000.0, "a", "secret"),
+        None,
+    ]
+
+
+def test_recording_survives_write_errors():
+    from aw_watcher_window.pipeline import recording
+
+    class FullDisk:
+        def write(self, window):
+            raise OSError(28, "No space left on device")
+
+    fetch = recording(lambda: {"app": "a", "title": "x"}, FullDisk())
+    assert fetch() == {"app": "a", "title": "x"}
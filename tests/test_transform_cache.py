@@ -0,0 +1,105 @@
+import random
+
+from aw_watcher_window.main import compile_exclude_titles, transform_window
+from aw_watcher_window.research_filter import ResearchClassifier
+from aw_watcher_window.transform_cache import TransformCache
+from aw_watcher_window.window import WindowInfo
+
+
+class CountingTransform:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, window, **config):
+        self.calls += 1
+        return transform_window(window, **config)
+
+
+def test_repeated_window_is_transformed_once():
+    counting = CountingTransform()
+    transform = TransformCache(counting)
+    exclude_titles = compile_exclude_titles(["secret"])
+
+    for _ in range(10):
+        result = transform({"app": "Firefox", "title": "Secret stuff"}, exclude_titles=exclude_titles)
+        assert result == {"app": "Firefox", "title": "excluded"}
+
+    assert counting.calls == 1
+    stats = transform.stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (9, 1, 1)
+    assert stats["hit_rate"] == 0.9
+
+
+def test_input_and_cached_result_are_not_shared():
+    transform = TransformCache(transform_window)
+    window = {"app": "Firefox", "title": "Secret"}
+
+    result = transform(window, exclude_title=True)
+    result["title"] = "modified by caller"
+
+    assert window == {"app": "Firefox", "title": "Secret"}
+    assert transform(window, exclude_title=True)["title"] == "excluded"
+
+
+def test_config_change_invalidates():
+    counting = CountingTransform()
+    transform = TransformCache(counting)
+    window = {"app": "Firefox", "title": "YouTube"}
+
+    assert transform(window, exclude_title=False)["title"] == "YouTube"
+    assert transform(window, exclude_title=True)["title"] == "excluded"
+    category_map = {"youtube": "Video"}
+    assert transform(window, research_category_map=category_map)["title"] == "Video"
+    # A new map object is a new configuration, even if equal to the old one in content
+    category_map = {"youtube": "Youtube"}
+    assert transform(window, research_category_map=category_map)["title"] == "Youtube"
+    assert transform(window, research_category_map=category_map)["title"] == "Youtube"
+
+    assert counting.calls == 4
+    assert transform.stats()["invalidations"] == 3
+
+
+def test_memory_is_bounded():
+    transform = TransformCache(transform_window, maxsize=100000, max_bytes=64 * 1024)
+    for i in range(5000):
+        transform({"app": "Firefox", "title": f"Unique title number {i} " + "x" * 100})
+
+    stats = transform.stats()
+    assert stats["weight"] <= 64 * 1024
+    assert 0 < stats["size"] < 5000
+
+
+def test_equivalent_to_uncached_on_random_windows():
+    rng = random.Random(0)
+    config = dict(
+        exclude_titles=compile_exclude_titles(["bank", "^private"]),
+        research_category_map={"tube": "Video", "mail": "Email"},
+        research_app_category_map={"Slack": "Chat"},
+    )
+    config["research_classifier"] = ResearchClassifier(
+        config["research_category_map"], config["research_app_category_map"]
+    )
+    transform = TransformCache(transform_window, maxsize=8)
+    apps = ["Firefox", "slack", "xterm"]
+    titles = ["YouTube", "Gmail", "my bank", "private notes", "bash", ""]
+
+    for _ in range(500):
+        window = {"app": rng.choice(apps), "title": rng.choice(titles)}
+        if rng.random() < 0.3:
+            window["url"] = "https://" + rng.choice(titles)
+        research = rng.random() < 0.5
+        kwargs = config if research else {"exclude_titles": config["exclude_titles"]}
+        assert transform(dict(window), **kwargs) == transform_window(dict(window), **kwargs)
+
+
+def test_window_info_is_the_key():
+    counting = CountingTransform()
+    transform = TransformCache(counting)
+
+    for _ in range(3):
+        result = transform(WindowInfo("Firefox", "GitHub", url="https://github.com"))
+        assert result == {"app": "Firefox", "title": "GitHub", "url": "https://github.com"}
+    assert transform(WindowInfo("Firefox", "GitHub")) == {"app": "Firefox", "title": "GitHub"}
+
+    assert counting.calls == 2
+    assert transform.cache.weight > 0
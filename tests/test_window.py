@@ -0,0 +1,152 @@
+import tracemalloc
+from datetime import datetime, timezone
+
+import pytest
+
+from aw_watcher_window.main import transform_window
+from aw_watcher_window.sampler import Sample
+from aw_watcher_window.transform_cache import TransformCache
+from aw_watcher_window.window import Interner, WindowInfo
+
+
+def decoded(text):
+    """A fresh str object every time, like a title decoded from an X property."""
+    return text.encode("utf8").decode("utf8")
+
+
+def test_interner_shares_equal_strings():
+    intern = Interner()
+
+    first = intern(decoded("Firefox"))
+    second = intern(decoded("Firefox"))
+
+    assert first is second
+    assert len(intern) == 1
+
+
+def test_interner_is_bounded():
+    intern = Interner(maxsize=10)
+
+    for i in range(25):
+        intern(str(i))
+
+    assert len(intern) <= 10
+    assert intern.resets == 2
+    with pytest.raises(ValueError):
+        Interner(maxsize=0)
+
+
+@pytest.mark.parametrize(
+    "window",
+    [
+        {"app": "Code", "title": "main.py"},
+        {"app": "Safari", "title": "GitHub", "url": "https://github.com", "incognito": False},
+    ],
+)
+def test_dict_round_trip(window):
+    info = WindowInfo.from_dict(window)
+
+    assert info.to_dict() == window
+    assert info == WindowInfo.from_dict(dict(window))
+
+
+def test_from_dict_without_title():
+    # What the JXA script prints for an app without a main window
+    info = WindowInfo.from_dict({"app": "Finder"})
+
+    assert info == WindowInfo("Finder", "")
+    assert info.to_dict() == {"app": "Finder", "title": ""}
+
+
+def test_from_dict_interns():
+    intern = Interner()
+
+    a = WindowInfo.from_dict({"app": decoded("Code"), "title": decoded("main.py")}, intern)
+    b = WindowInfo.from_dict({"app": decoded("Code"), "title": decoded("main.py")}, intern)
+
+    assert a.app is b.app and a.title is b.title
+
+
+TITLES = [f"Document {i} - Editor" for i in range(20)]
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def dict_sample(i):
+    """A sample as built before WindowInfo: a fresh dict of freshly decoded strings."""
+    window = {"app": decoded("Editor"), "title": decoded(TITLES[i % len(TITLES)])}
+    return Sample(window, START, 2.0)  # type: ignore
+
+
+def info_sample(i, intern):
+    window = WindowInfo(intern(decoded("Editor")), intern(decoded(TITLES[i % len(TITLES)])))
+    return Sample(window, START, 2.0)
+
+
+def retained(build, n):
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        kept = [build(i) for i in range(n)]
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert len(kept) == n
+    return after - before
+
+
+@pytest.mark.benchmark
+def test_benchmark_retained_memory_per_sample():
+    """Samples held on to (e.g. queued while sending is slow) cost a fraction of what dicts do."""
+    n = 10_000
+    intern = Interner()
+
+    dicts = retained(dict_sample, n)
+    infos = retained(lambda i: info_sample(i, intern), n)
+
+    print(f"\nretained per sample: dict {dicts / n:.0f} B, WindowInfo {infos / n:.0f} B")
+    assert infos < dicts / 2
+
+
+def allocated_per_poll(poll, n):
+    """Bytes allocated per call of *poll*, freed or not."""
+    for i in range(100):
+        poll(i)  # warm up caches
+    tracemalloc.start()
+    try:
+        total = 0
+        for i in range(n):
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            poll(i)
+            _, peak = tracemalloc.get_traced_memory()
+            total += peak - before
+    finally:
+        tracemalloc.stop()
+    return total / n
+
+
+@pytest.mark.benchmark
+def test_benchmark_allocations_per_poll():
+    """Sample, compare with the last one and transform (behind the cache), as _sample_loop does."""
+    intern = Interner()
+    transform = TransformCache(transform_window)
+    last = {}
+
+    def dict_poll(i):
+        window = dict_sample(i).window
+        changed = window != last.get("dict")
+        last["dict"] = dict(window)
+        key = tuple(sorted(window.items()))
+        return changed, key, transform_window(dict(window))
+
+    def info_poll(i):
+        window = info_sample(i, intern).window
+        changed = window != last.get("info")
+        last["info"] = window
+        return changed, transform(window)
+
+    dicts = allocated_per_poll(dict_poll, 2000)
+    infos = allocated_per_poll(info_poll, 2000)
+
+    print(f"\npeak allocated per poll: dict {dicts:.0f} B, WindowInfo {infos:.0f} B")
+    assert infos < dicts
@@ -0,0 +1,169 @@
+"""windows.py, against fake pywin32 and wmi modules so it can be tested anywhere."""
+
+import importlib
+import sys
+from types import ModuleType, SimpleNamespace
+
+import pytest
+
+from conftest import FakeClock
+
+PROCESS_QUERY_INFORMATION = 0x0400
+
+
+class FakeSystem:
+    """A process table, with the win32 calls windows.py makes counted per name."""
+
+    def __init__(self):
+        # pid -> (exe path, start time, elevated, protected)
+        self.processes = {}
+        self.foreground = {}  # hwnd -> pid
+        self.calls = {}
+
+    def count(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def start(self, pid, path, start_time, elevated=False, protected=False):
+        """Elevated processes can't be opened for PROCESS_QUERY_INFORMATION, protected ones aren't in WMI either."""
+        self.processes[pid] = (path, start_time, elevated, protected)
+
+    # win32api
+
+    def OpenProcess(self, access, inherit, pid):
+        self.count("OpenProcess")
+        if pid not in self.processes:
+            raise OSError("The parameter is incorrect")
+        if self.processes[pid][2] and access & PROCESS_QUERY_INFORMATION:
+            raise OSError("Access is denied")
+        return SimpleNamespace(pid=pid)
+
+    def CloseHandle(self, handle):
+        pass
+
+    # win32process
+
+    def GetWindowThreadProcessId(self, hwnd):
+        return 1, self.foreground[hwnd]
+
+    def GetModuleFileNameEx(self, handle, module):
+        self.count("GetModuleFileNameEx")
+        return self.processes[handle.pid][0]
+
+    def GetProcessTimes(self, handle):
+        return {"CreationTime": self.processes[handle.pid][1]}
+
+    # wmi
+
+    def WMI(self):
+        return self
+
+    def query(self, wql):
+        self.count("wmi")
+        pid = int(wql.rsplit("=", 1)[1])
+        if pid not in self.processes or self.processes[pid][3]:
+            return []
+        return [SimpleNamespace(Name=self.processes[pid][0].rsplit("\\", 1)[1])]
+
+
+@pytest.fixture
+def system(monkeypatch):
+    system = FakeSystem()
+    for name, functions in {
+        "win32api": ["OpenProcess", "CloseHandle"],
+        "win32gui": [],
+        "win32process": ["GetWindowThreadProcessId", "GetModuleFileNameEx", "GetProcessTimes"],
+        "wmi": ["WMI"],
+    }.items():
+        module = ModuleType(name)
+        for function in functions:
+            setattr(module, function, getattr(system, function))
+        monkeypatch.setitem(sys.modules, name, module)
+    monkeypatch.delitem(sys.modules, "aw_watcher_window.windows", raising=False)
+    yield system
+    sys.modules.pop("aw_watcher_window.windows", None)
+
+
+@pytest.fixture
+def windows(system):
+    return importlib.import_module("aw_watcher_window.windows")
+
+
+def test_name_is_looked_up_once_per_process(system, windows):
+    system.start(100, "C:\\Program Files\\Mozilla Firefox\\firefox.exe", 1)
+    system.foreground[1] = 100
+
+    names = [windows.get_process_name(1) for _ in range(10)]
+
+    assert names == ["firefox.exe"] * 10
+    assert system.calls["GetModuleFileNameEx"] == 1
+    assert windows.process_names.stats()["lookups"] == 1
+
+
+def test_reused_pid_is_looked_up_again(system, windows):
+    cache = windows.ProcessNameCache([windows._get_process_name])
+    system.start(100, "C:\\Windows\\notepad.exe", 1)
+    assert cache.get(100) == "notepad.exe"
+
+    # notepad exits, and its PID goes to a new process
+    system.start(100, "C:\\Windows\\System32\\cmd.exe", 2)
+
+    assert cache.get(100) == "cmd.exe"
+    assert system.calls["GetModuleFileNameEx"] == 2
+
+
+def test_elevated_process_falls_back_to_wmi_once(system, windows):
+    clock = FakeClock()
+    cache = windows.ProcessNameCache(
+        [windows._get_process_name, windows._get_process_name_wmi], clock=clock
+    )
+    system.start(200, "C:\\Windows\\regedit.exe", 5, elevated=True)
+
+    for _ in range(10):
+        assert cache.get(200) == "regedit.exe"
+        clock.now += 1
+
+    assert system.calls["wmi"] == 1
+
+
+def test_failed_lookups_are_cached_for_a_while(system, windows):
+    clock = FakeClock()
+    cache = windows.ProcessNameCache(
+        [windows._get_process_name, windows._get_process_name_wmi], ttl=60.0, clock=clock
+    )
+    system.start(300, "C:\\Windows\\System32\\Taskmgr.exe", 7, elevated=True, protected=True)
+
+    for _ in range(30):
+        assert cache.get(300) is None
+        clock.now += 1
+    assert system.calls["wmi"] == 1
+
+    clock.now += 60
+    assert cache.get(300) is None
+    assert system.calls["wmi"] == 2
+
+
+def test_unverifiable_names_expire(system, windows):
+    """Without a start time, a PID could be reused unnoticed, so names are kept for ttl only."""
+    clock = FakeClock()
+    cache = windows.ProcessNameCache(
+        [lambda pid: "app.exe"], start_time=lambda pid: None, ttl=10.0, clock=clock
+    )
+
+    cache.get(1)
+    clock.now += 5
+    cache.get(1)
+    assert cache.lookup_count == 1
+
+    clock.now += 10
+    cache.get(1)
+    assert cache.lookup_count == 2
+
+
+def test_wmi_is_connected_on_first_use(system, windows):
+    connections = []
+    sys.modules["wmi"].WMI = lambda: connections.append(1) or system
+
+    assert connections == []
+    assert windows._get_process_name_wmi(12345) is None
+    assert windows._get_process_name_wmi(12345) is None
+    assert connections == [1]
@@ -0,0 +1,149 @@
+from types import SimpleNamespace
+
+import pytest
+import Xlib.error
+from Xlib import Xatom
+
+from aw_watcher_window.cache import LRUCache
+from aw_watcher_window.xlib_batch import ActiveWindowQuery
+
+ATOMS = {"_NET_ACTIVE_WINDOW": 300, "_NET_WM_NAME": 301, "UTF8_STRING": 302}
+RTT = 0.05
+
+
+class FakeRequest:
+    def __init__(self, display, reply):
+        self.display = display
+        self.sent_at = display.now
+        self._reply = reply
+
+    def reply(self):
+        # The server answers requests in order, one RTT after they were sent
+        self.display.now = max(self.display.now, self.sent_at + RTT)
+        if isinstance(self._reply, Exception):
+            raise self._reply
+        self.property_type, self.value = self._reply or (0, None)
+
+
+class FakeDisplay:
+    """A display with a high-latency link, measured on a virtual clock."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.requests = 0
+        self.active_window_id = 0x100
+        self.properties = {}
+
+    def screen(self):
+        return SimpleNamespace(root=SimpleNamespace(id=1))
+
+    def intern_atom(self, name):
+        return ATOMS[name]
+
+    def set_window(self, window_id, wm_class=None, net_wm_name=None, wm_name=None):
+        if wm_class is not None:
+            self.properties[(window_id, Xatom.WM_CLASS)] = (Xatom.STRING, (8, wm_class))
+        if net_wm_name is not None:
+            self.properties[(window_id, 301)] = (302, (8, net_wm_name))
+        if wm_name is not None:
+            self.properties[(window_id, Xatom.WM_NAME)] = (Xatom.STRING, (8, wm_name))
+
+    def send(self, display, window_id, atom, property_type):
+        assert display is self
+        self.requests += 1
+        if window_id == 1:
+            return FakeRequest(self, (Xatom.WINDOW, (32, [self.active_window_id])))
+        if window_id not in {w for w, _ in self.properties}:
+            return FakeRequest(self, Xlib.error.BadWindow.__new__(Xlib.error.BadWindow))
+        return FakeRequest(self, self.properties.get((window_id, atom)))
+
+
+@pytest.fixture
+def display():
+    d = FakeDisplay()
+    d.set_window(0x100, wm_class=b"firefox\0Firefox\0", net_wm_name="Café".encode("utf8"))
+    d.set_window(0x200, wm_class=b"xterm\0XTerm\0", wm_name=b"bash")
+    return d
+
+
+def make_query(display):
+    return ActiveWindowQuery(display, LRUCache(), send=display.send)
+
+
+def test_query_returns_class_and_name(display):
+    info = make_query(display).query()
+
+    assert (info.id, info.cls, info.name) == (0x100, "Firefox", "Café")
+
+
+def test_falls_back_to_wm_name(display):
+    display.active_window_id = 0x200
+
+    info = make_query(display).query()
+
+    assert (info.cls, info.name) == ("XTerm", "bash")
+
+
+def test_no_active_window(display):
+    display.active_window_id = 0
+
+    assert make_query(display).query() is None
+
+
+def test_missing_class_is_left_to_the_slow_path(display):
+    display.set_window(0x300, net_wm_name=b"no class")
+    display.active_window_id = 0x300
+
+    info = make_query(display).query()
+
+    assert info.cls is None
+    assert info.name == "no class"
+
+
+def test_destroyed_window(display):
+    display.active_window_id = 0x400
+
+    info = make_query(display).query()
+
+    assert info.cls is None
+    assert info.name == "unknown"
+
+
+def test_cached_class_is_not_requested(display):
+    cache = LRUCache()
+    cache.put((0x100, "class"), "Firefox")
+    query = ActiveWindowQuery(display, cache, send=display.send)
+
+    info = query.query()
+
+    assert info.cls == "Firefox"
+    # _NET_ACTIVE_WINDOW, _NET_WM_NAME and WM_NAME, but no WM_CLASS
+    assert display.requests == 3
+
+
+def test_benchmark_latency_per_poll(display):
+    """Each poll should cost one RTT while the active window is unchanged, two on a switch.
+
+    Unpipelined, every request would cost a full RTT of its own.
+    """
+    query = make_query(display)
+
+    def poll():
+        start, requests = display.now, display.requests
+        query.query()
+        return display.now - start, display.requests - requests
+
+    latency, requests = poll()  # cold: nothing to speculate on
+    assert latency == pytest.approx(2 * RTT)
+    assert requests == 4
+
+    latencies = [poll()[0] for _ in range(10)]
+    assert latencies == [pytest.approx(RTT)] * 10
+
+    display.active_window_id = 0x200
+    latency, _ = poll()
+    assert latency == pytest.approx(2 * RTT)
+    print(
+        f"\npipelined: {RTT * 1000:.0f}ms/poll steady, {latency * 1000:.0f}ms on switch; "
+        f"sequential: {3 * RTT * 1000:.0f}-{4 * RTT * 1000:.0f}ms/poll"
+    )
@@ -0,0 +1,272 @@
+import os
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+from Xlib import X, Xatom
+
+import aw_watcher_window.main as main_module
+from aw_watcher_window.exceptions import FatalError
+from aw_watcher_window.lib import FakeWindowSource
+from aw_watcher_window.window import WindowInfo
+from aw_watcher_window.xlib_events import (
+    ROOT_EVENT_MASK,
+    WINDOW_EVENT_MASK,
+    ActiveWindowWatcher,
+    EventDispatcher,
+    wait_any,
+)
+from aw_watcher_window.xlib_watchdog import StalledCallError
+
+NET_ACTIVE_WINDOW = 300
+NET_WM_NAME = 301
+
+
+class FakeWindow:
+    def __init__(self, display, window_id):
+        self.display = display
+        self.id = window_id
+        self.event_mask = None
+
+    def change_attributes(self, event_mask):
+        self.event_mask = event_mask
+
+    def get_full_property(self, atom, property_type):
+        assert atom == NET_ACTIVE_WINDOW
+        self.display.round_trips += 1
+        return SimpleNamespace(value=[self.display.active_window_id])
+
+
+class FakeDisplay:
+    """Just enough of Xlib.display.Display for ActiveWindowWatcher."""
+
+    def __init__(self, active_window_id=0x100):
+        self.active_window_id = active_window_id
+        self.root = FakeWindow(self, 1)
+        self.windows = {}
+        self.events = []
+        self.round_trips = 0
+        self._read_fd, self._write_fd = os.pipe()
+
+    def close(self):
+        os.close(self._read_fd)
+        os.close(self._write_fd)
+
+    def screen(self):
+        return SimpleNamespace(root=self.root)
+
+    def intern_atom(self, name):
+        return {"_NET_ACTIVE_WINDOW": NET_ACTIVE_WINDOW, "_NET_WM_NAME": NET_WM_NAME}[name]
+
+    def create_resource_object(self, kind, window_id):
+        return self.windows.setdefault(window_id, FakeWindow(self, window_id))
+
+    def flush(self):
+        pass
+
+    def fileno(self):
+        return self._read_fd
+
+    def pending_events(self):
+        return len(self.events)
+
+    def next_event(self):
+        return self.events.pop(0)
+
+    # Helpers for tests
+
+    def set_active_window(self, window_id):
+        self.active_window_id = window_id
+        self.property_notify(self.root, NET_ACTIVE_WINDOW)
+
+    def property_notify(self, window, atom):
+        self.events.append(SimpleNamespace(type=X.PropertyNotify, window=window, atom=atom))
+
+    def destroy_notify(self, window):
+        self.events.append(SimpleNamespace(type=X.DestroyNotify, window=window))
+
+
+@pytest.fixture
+def display():
+    d = FakeDisplay()
+    yield d
+    d.close()
+
+
+def test_subscribes_to_root_and_active_window(display):
+    watcher = ActiveWindowWatcher(EventDispatcher(display))
+
+    assert display.root.event_mask == ROOT_EVENT_MASK
+    assert watcher.window.id == 0x100
+    assert watcher.window.event_mask == WINDOW_EVENT_MASK
+
+
+def test_wait_times_out_without_events(display):
+    watcher = ActiveWindowWatcher(EventDispatcher(display))
+
+    assert watcher.wait(0.01) is False
+
+
+def test_active_window_change_moves_subscription(display):
+    watcher = ActiveWindowWatcher(EventDispatcher(display))
+
+    display.set_active_window(0x200)
+
+    assert watcher.wait(1.0) is True
+    assert watcher.window.id == 0x200
+    assert display.windows[0x200].event_mask is not None
+
+
+@pytest.mark.parametrize("atom", [NET_WM_NAME, Xatom.WM_NAME])
+def test_title_change_on_active_window(display, atom):
+    watcher = ActiveWindowWatcher(EventDispatcher(display))
+
+    display.property_notify(watcher.window, atom)
+
+    assert watcher.wait(1.0) is True
+
+
+def test_ignores_unrelated_properties_and_windows(display):
+    watcher = ActiveWindowWatcher(EventDispatcher(display))
+    other = display.create_resource_object("window", 0x300)
+
+    display.property_notify(other, NET_WM_NAME)
+    display.property_notify(watcher.window, 999)
+    display.property_notify(display.root, 999)
+
+    assert watcher.wait(0.01) is False
+    assert display.pending_events() == 0
+
+
+def test_destroyed_window_is_dropped(display):
+    watcher = ActiveWindowWatcher(EventDispatcher(display))
+
+    display.destroy_notify(watcher.window)
+
+    assert watcher.wait(1.0) is True
+    assert watcher.window is None
+
+
+def test_no_active_window(display):
+    display.active_window_id = 0
+    watcher = ActiveWindowWatcher(EventDispatcher(display))
+
+    assert watcher.window is None
+
+
+def test_dispatcher_shares_events_with_all_listeners(display):
+    dispatcher = EventDispatcher(display)
+    watcher = ActiveWindowWatcher(dispatcher)
+    seen = []
+    dispatcher.add_listener(seen.append)
+
+    display.set_active_window(0x200)
+    # someone else (e.g. a poll in xlib.py) drains the queue before the watcher waits
+    assert dispatcher.drain() == 1
+
+    assert len(seen) == 1
+    assert watcher.wait(0.01) is True
+    assert watcher.window.id == 0x200
+
+
+class Watched:
+    """A stand-in for xlib._watched, counting the round-trips made inside it."""
+
+    def __init__(self, display, stall=False):
+        self.display = display
+        self.stall = stall
+        self.round_trips = 0
+
+    @contextmanager
+    def __call__(self):
+        before = self.display.round_trips
+        yield
+        self.round_trips += self.display.round_trips - before
+        if self.stall:
+            raise StalledCallError("aborted")
+
+
+def test_requests_are_made_while_watched(display):
+    watched = Watched(display)
+    watcher = ActiveWindowWatcher(EventDispatcher(display), watched)
+    assert watched.round_trips == 1
+
+    display.set_active_window(0x200)
+    assert watcher.wait(1.0) is True
+
+    assert watched.round_trips == display.round_trips == 2
+
+
+def test_stalled_watcher_counts_as_changed(display):
+    watched = Watched(display)
+    watcher = ActiveWindowWatcher(EventDispatcher(display), watched)
+    watched.stall = True
+
+    # its owner finds the connection rebuilt on its next call
+    assert wait_any([watcher], 0.01) == [watcher]
+
+
+class FakeClient:
+    def __init__(self):
+        self.heartbeats = []
+
+    def heartbeat(self, bucket_id, event, pulsetime, queued=False):
+        self.heartbeats.append((event.timestamp, dict(event.data), pulsetime))
+
+
+class ScriptedSource(FakeWindowSource):
+    """*windows* one after the other, with wait() returning *results* one after the other."""
+
+    def __init__(self, windows, results):
+        super().__init__(windows)
+        self.results = list(results)
+        self.timeouts = []
+
+    def wait(self, timeout):
+        self.timeouts.append(timeout)
+        if not self.results:
+            raise FatalError()
+        return self.results.pop(0)
+
+
+def test_event_loop_closes_previous_window_on_change():
+    source = ScriptedSource(
+        [
+            {"app": "Firefox", "title": "a"},
+            {"app": "Firefox", "title": "a"},
+            {"app": "Terminal", "title": "b"},
+        ],
+        [False, True],
+    )
+    client = FakeClient()
+
+    main_module.event_loop(client, "bucket", source, keepalive_time=10.0)
+
+    data = [hb[1] for hb in client.heartbeats]
+    assert data == [
+        {"app": "Firefox", "title": "a"},
+        {"app": "Firefox", "title": "a"},
+        # the previous window is extended up to the switch
+        {"app": "Firefox", "title": "a"},
+        {"app": "Terminal", "title": "b"},
+    ]
+    assert client.heartbeats[2][0] == client.heartbeats[3][0]
+    assert {hb[2] for hb in client.heartbeats} == {main_module.compute_pulsetime(10.0)}
+    assert source.timeouts == [10.0, 10.0, 10.0]
+
+
+def test_event_loop_extends_last_window_when_stopped():
+    client = FakeClient()
+
+    class StoppedSource(FakeWindowSource):
+        def wait(self, timeout):
+            # like SIGTERM arriving while waiting (see exit_on_sigterm)
+            raise SystemExit(0)
+
+    with pytest.raises(SystemExit):
+        main_module.event_loop(
+            client, "bucket", StoppedSource([WindowInfo("Firefox", "a")]), keepalive_time=10.0
+        )
+
+    assert [hb[1] for hb in client.heartbeats] == [{"app": "Firefox", "title": "a"}] * 2
+    assert client.heartbeats[1][0] >= client.heartbeats[0][0]
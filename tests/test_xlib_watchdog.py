@@ -0,0 +1,232 @@
+import socket
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+import Xlib.error
+
+import aw_watcher_window.main as main_module
+from aw_watcher_window import xlib
+from aw_watcher_window.exceptions import FatalError
+from aw_watcher_window.lib import XlibSource
+from aw_watcher_window.window import WindowInfo
+from aw_watcher_window.xlib_watchdog import StalledCallError, XWatchdog
+
+
+class HangingDisplay:
+    """Stands in for a Display whose replies never come, until its socket is shut down."""
+
+    def __init__(self):
+        self.sock, self.peer = socket.socketpair()
+        self.display = SimpleNamespace(socket=self.sock)
+        self.closed = False
+
+    def read_reply(self, spin=False):
+        """Blocks (or with *spin*, busy-waits) for a reply, like python-xlib stuck in recv."""
+        if spin:
+            self.sock.setblocking(False)
+        while True:
+            try:
+                data = self.sock.recv(1)
+            except BlockingIOError:
+                continue
+            if not data:
+                raise Xlib.error.ConnectionClosedError("server")
+            return data
+
+    def reply(self):
+        self.peer.send(b"x")
+
+    def create_resource_object(self, type, id):
+        return SimpleNamespace(id=id)
+
+    def close(self):
+        self.closed = True
+        self.sock.close()
+        self.peer.close()
+
+
+@pytest.fixture
+def watchdog():
+    recoveries = []
+    wd = XWatchdog(lambda: recoveries.append(1), deadline=0.1, check_interval=0.01)
+    wd.recovered = recoveries
+    wd.start()
+    yield wd
+    wd.stop()
+
+
+def test_hanging_call_is_aborted(watchdog):
+    display = HangingDisplay()
+    start = time.monotonic()
+
+    with pytest.raises(StalledCallError) as excinfo:
+        with watchdog.watch(display):
+            display.read_reply()
+
+    assert time.monotonic() - start < 2.0
+    assert isinstance(excinfo.value.__cause__, Xlib.error.ConnectionClosedError)
+    assert watchdog.recovered == [1]
+    stats = watchdog.stats()
+    assert (stats["stalls"], stats["hangs"], stats["spins"], stats["recoveries"]) == (1, 1, 0, 1)
+    display.close()
+
+
+def test_spinning_call_is_aborted(watchdog):
+    display = HangingDisplay()
+    # The real thread CPU time lags under load, so all of the wall time it is
+    watchdog.cpu_time = lambda ident: time.monotonic()
+
+    with pytest.raises(StalledCallError):
+        with watchdog.watch(display):
+            display.read_reply(spin=True)
+
+    assert watchdog.stats()["spins"] == 1
+    assert watchdog.recovered == [1]
+    display.close()
+
+
+def test_calls_within_deadline_are_left_alone(watchdog):
+    display = HangingDisplay()
+
+    for _ in range(3):
+        display.reply()
+        with watchdog.watch(display):
+            assert display.read_reply() == b"x"
+    with pytest.raises(KeyError):
+        with watchdog.watch(display):
+            raise KeyError()
+
+    assert watchdog.stats()["stalls"] == 0
+    assert watchdog.recovered == []
+    display.close()
+
+
+def test_failed_recovery_is_fatal():
+    def recover():
+        raise Xlib.error.DisplayConnectionError(":0", "gone")
+
+    watchdog = XWatchdog(recover, deadline=0.1, check_interval=0.01)
+    watchdog.start()
+    display = HangingDisplay()
+    try:
+        with pytest.raises(FatalError):
+            with watchdog.watch(display):
+                display.read_reply()
+    finally:
+        watchdog.stop()
+        display.close()
+
+    assert watchdog.stats()["recovery_failures"] == 1
+
+
+def test_check_on_a_fake_clock():
+    now = [0.0]
+    cpu = {"value": 0.0}
+    aborted = []
+    watchdog = XWatchdog(
+        lambda: now.__setitem__(0, now[0] + 0.25),
+        deadline=5.0,
+        abort=aborted.append,
+        clock=lambda: now[0],
+        cpu_time=lambda ident: cpu["value"],
+    )
+
+    with pytest.raises(StalledCallError):
+        with watchdog.watch("display"):
+            now[0] = 4.0
+            watchdog.check()
+            assert aborted == []
+            now[0] = 6.0
+            cpu["value"] = 5.0
+            watchdog.check()
+            watchdog.check()
+            assert aborted == ["display"]
+
+    stats = watchdog.stats()
+    assert (stats["spins"], stats["hangs"]) == (1, 0)
+    # from the abort to the new connection
+    assert stats["recovery_seconds_max"] == pytest.approx(0.25, abs=0.01)
+
+
+@pytest.fixture
+def fake_x(monkeypatch):
+    """xlib connected to HangingDisplays, a new one on every connect()."""
+    displays = []
+    interned = []
+
+    def _open(connection):
+        display = HangingDisplay()
+        displays.append(display)
+
+        def query():
+            display.read_reply()
+            return SimpleNamespace(id=1, cls="Firefox", name="a")
+
+        interned.append("_NET_WM_NAME")
+        connection.display = display
+        connection.dispatcher = SimpleNamespace(drain=lambda: None)
+        connection.active_window_query = SimpleNamespace(query=query)
+        connection.NET_WM_NAME = len(interned)
+
+    monkeypatch.setattr(xlib, "_connection", None)
+    monkeypatch.setattr(xlib.XConnection, "_open", _open)
+    monkeypatch.setattr(xlib, "_cache_window_attribute", lambda window, attr, value, cache: None)
+    watchdog = XWatchdog(xlib.reconnect, deadline=0.1, check_interval=0.01)
+    monkeypatch.setattr(xlib, "watchdog", watchdog)
+    watchdog.start()
+    yield SimpleNamespace(displays=displays, interned=interned, watchdog=watchdog)
+    watchdog.stop()
+    for display in displays:
+        display.close()
+
+
+def test_xlib_reconnects_after_stall(fake_x):
+    with pytest.raises(StalledCallError):
+        xlib.get_current_window_info()
+
+    (hung, fresh) = fake_x.displays
+    assert hung.closed
+    assert xlib.display is fresh
+    # atoms were interned again on the new connection
+    assert xlib.NET_WM_NAME == 2
+
+    fresh.reply()
+    assert xlib.get_current_window_info() == ("Firefox", "a")
+    assert fake_x.watchdog.stats()["recoveries"] == 1
+
+
+def test_stalled_poll_is_skipped_not_fatal(fake_x):
+    assert main_module.fetch_current_window(XlibSource()) is None
+
+    threading.Timer(0.02, fake_x.displays[-1].reply).start()
+    assert main_module.fetch_current_window(XlibSource()) == WindowInfo("Firefox", "a")
+
+
+def test_event_wait_moves_to_the_new_connection(fake_x, monkeypatch):
+    watchers = []
+
+    def active_window_watcher():
+        xlib.connect()
+        display = xlib.display
+
+        def wait(timeout):
+            with xlib._watched(display):
+                return display.read_reply() == b"x"
+
+        watchers.append(SimpleNamespace(dispatcher=xlib.dispatcher, wait=wait))
+        return watchers[-1]
+
+    monkeypatch.setattr(xlib, "active_window_watcher", active_window_watcher)
+    source = XlibSource()
+
+    # stalled: reconnected, and the window may have changed meanwhile
+    assert source.wait(60.0) is True
+    assert len(watchers) == 1
+
+    fake_x.displays[-1].reply()
+    assert source.wait(60.0) is True
+    # the first watcher was on the connection that was closed
+    assert len(watchers) == 2
+    assert watchers[-1].dispatcher is xlib.dispatcher
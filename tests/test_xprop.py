@@ -0,0 +1,197 @@
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+
+import pytest
+from Xlib import Xatom
+
+from aw_watcher_window import xprop
+
+ATOMS = {
+    "_NET_CLIENT_LIST": 400,
+    "_NET_ACTIVE_WINDOW": 401,
+    "_NET_WM_NAME": 402,
+    "_NET_WM_DESKTOP": 403,
+    "_NET_WM_PID": 404,
+    "WM_WINDOW_ROLE": 405,
+    "UTF8_STRING": 406,
+}
+ROOT = 1
+
+
+class FakeRequest:
+    def __init__(self, prop):
+        self.prop = prop
+
+    def reply(self):
+        self.property_type = 1 if self.prop else 0
+        self.value = self.prop
+
+
+class FakeDisplay:
+    """Windows with properties, answering GetProperty like python-xlib deferred requests."""
+
+    def __init__(self, n_windows):
+        self.requests = 0
+        self.properties = {}
+        self.window_ids = [0x1000000 + i for i in range(n_windows)]
+        self.active_window_id = self.window_ids[-1] if self.window_ids else 0
+        self.properties[(ROOT, ATOMS["_NET_CLIENT_LIST"])] = (32, self.window_ids)
+        self.properties[(ROOT, ATOMS["_NET_ACTIVE_WINDOW"])] = (32, [self.active_window_id])
+        for i, wid in enumerate(self.window_ids):
+            self.properties[(wid, ATOMS["_NET_WM_NAME"])] = (8, f"Window {i} – ünïcode".encode())
+            self.properties[(wid, Xatom.WM_CLASS)] = (8, f"app{i}\0App{i}\0".encode())
+            self.properties[(wid, ATOMS["_NET_WM_DESKTOP"])] = (32, [i % 3])
+            self.properties[(wid, ATOMS["_NET_WM_PID"])] = (32, [1000 + i])
+            if i % 2:
+                self.properties[(wid, Xatom.WM_COMMAND)] = (8, f"app{i}\0--flag\0".encode())
+                self.properties[(wid, ATOMS["WM_WINDOW_ROLE"])] = (8, b"browser")
+
+    def screen(self):
+        return SimpleNamespace(root=SimpleNamespace(id=ROOT))
+
+    def intern_atom(self, name):
+        return ATOMS[name]
+
+    def send(self, display, window_id, atom, property_type):
+        self.requests += 1
+        return FakeRequest(self.properties.get((window_id, atom)))
+
+    def xprop_output(self, window_id):
+        """What `xprop -root` / `xprop -id` would print for the same properties."""
+        names = {v: k for k, v in ATOMS.items()}
+        names.update({Xatom.WM_CLASS: "WM_CLASS", Xatom.WM_COMMAND: "WM_COMMAND"})
+        lines = []
+        for (wid, atom), (fmt, value) in self.properties.items():
+            if wid != window_id:
+                continue
+            name = names[atom]
+            if fmt == 32 and name == "_NET_CLIENT_LIST":
+                lines.append(f"{name}(WINDOW): window id # " + ", ".join(hex(v) for v in value))
+            elif fmt == 32 and name == "_NET_ACTIVE_WINDOW":
+                lines.append(f"{name}(WINDOW): window id # {hex(value[0])}, 0x0")
+            elif fmt == 32:
+                lines.append(f"{name}(CARDINAL) = {value[0]}")
+            elif name == "WM_COMMAND":
+                parts = value.decode().split("\0")[:-1]
+                lines.append(f"{name}(STRING) = {{ " + ", ".join(f'"{p}"' for p in parts) + " }")
+            elif name == "WM_CLASS":
+                parts = value.decode().split("\0")[:-1]
+                lines.append(f"{name}(STRING) = " + ", ".join(f'"{p}"' for p in parts))
+            else:
+                lines.append(f'{name}(UTF8_STRING) = "{value.decode()}"')
+        return "\n".join(lines) + "\n"
+
+
+def fork_per_window(display):
+    wids = xprop.get_window_ids()
+    return xprop.get_windows(wids, xprop.get_active_window_id())
+
+
+@pytest.fixture
+def fake_xprop(monkeypatch):
+    """Answers `xprop` calls from a FakeDisplay, and counts how many would have been forked."""
+    calls = []
+
+    def install(display):
+        def run(cmd, stdout):
+            calls.append(cmd)
+            wid = ROOT if cmd[1] == "-root" else int(cmd[2], 16)
+            return SimpleNamespace(stdout=display.xprop_output(wid).encode())
+
+        monkeypatch.setattr(xprop.subprocess, "run", run)
+        return calls
+
+    return install
+
+
+def test_batched_matches_fork_per_window(fake_xprop):
+    display = FakeDisplay(6)
+    calls = fake_xprop(display)
+
+    expected = fork_per_window(display)
+    actual = xprop.get_windows_batched(display, send=display.send)
+
+    assert actual == expected
+    assert actual[1]["command"] == ['{ "app1", "--flag" }']
+    assert actual[-1]["active"] is True
+    # 2x `xprop -root` + one `xprop -id` per window, vs no forks at all
+    assert len(calls) == 8
+
+
+def test_batched_handles_missing_properties():
+    display = FakeDisplay(1)
+    wid = display.window_ids[0]
+    for key in list(display.properties):
+        if key[0] == wid:
+            del display.properties[key]
+
+    (window,) = xprop.get_windows_batched(display, send=display.send)
+
+    assert window == {
+        "id": hex(wid),
+        "active": True,
+        "name": "unknown",
+        "class": ["unknown"],
+        "desktop": -1,
+        "command": [],
+        "role": [],
+        "pid": -1,
+    }
+
+
+def test_batched_without_client_list():
+    display = FakeDisplay(0)
+    del display.properties[(ROOT, ATOMS["_NET_CLIENT_LIST"])]
+    del display.properties[(ROOT, ATOMS["_NET_ACTIVE_WINDOW"])]
+
+    assert xprop.get_windows_batched(display, send=display.send) == []
+
+
+def test_subprocess_backend_works_without_python_xlib():
+    script = (
+        "import sys; sys.modules['Xlib'] = None\n"
+        "from aw_watcher_window import xprop\n"
+        "xprop.xprop_root = lambda: '_NET_CLIENT_LIST(WINDOW): window id # 0x1, 0x2\\n'\n"
+        "print(xprop.get_window_ids())\n"
+    )
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True)
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "['0x1', '0x2']"
+
+
+@pytest.mark.benchmark
+def test_benchmark_fork_per_window_vs_batched(tmp_path, monkeypatch):
+    """Spawns a real (trivial) process per xprop call, to show what the forks cost."""
+    n_windows = 40
+    display = FakeDisplay(n_windows)
+    outputs = {}
+    for wid in [ROOT] + display.window_ids:
+        path = tmp_path / hex(wid)
+        path.write_text(display.xprop_output(wid))
+        outputs[wid] = str(path)
+
+    real_run = subprocess.run
+
+    def run(cmd, stdout):
+        wid = ROOT if cmd[1] == "-root" else int(cmd[2], 16)
+        return real_run(["cat", outputs[wid]], stdout=stdout)
+
+    monkeypatch.setattr(xprop.subprocess, "run", run)
+
+    start = time.perf_counter()
+    expected = fork_per_window(display)
+    forked = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = xprop.get_windows_batched(display, send=display.send)
+    batched = time.perf_counter() - start
+
+    assert actual == expected
+    print(
+        f"\n{n_windows} windows: fork-per-window {forked * 1000:.1f}ms ({n_windows + 2} processes), "
+        f"batched {batched * 1000:.1f}ms ({display.requests} requests in 2 round-trips)"
+    )
+    assert batched < forked